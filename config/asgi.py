@@ -2,6 +2,8 @@
 ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it (``uvicorn config.asgi:application``) to stream the admin's new-order
+events (``core.views.order_events``) without holding a worker per open tab.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
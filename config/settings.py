@@ -40,7 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'core',
     'restaurant',
-    
+    'delivery',
 ]
 
 MIDDLEWARE = [
@@ -84,6 +84,25 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Shared by every worker process: the catalog version key (restaurant/catalog.py)
+# must be seen by all of them to invalidate their catalog snapshots.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache',
+    },
+    # Rendered template fragments, keyed by catalog version: a per-process
+    # cache is enough since a new version simply uses new keys.
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -126,10 +145,85 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
 
+# Hashed names, manifest, re-encoded images and .gz/.br siblings (see core/staticfiles.py).
+# Build with: python manage.py build_static
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'core.staticfiles.OptimizedManifestStaticFilesStorage',
+    },
+}
+# PNG/JPEG assets above this size are re-encoded, and downscaled to fit STATIC_IMAGE_MAX_SIZE px
+STATIC_IMAGE_MAX_BYTES = 200 * 1024
+STATIC_IMAGE_MAX_SIZE = 1920
+# Reduce oversized PNGs to a 256-colour palette (lossy)
+STATIC_PNG_QUANTIZE = True
+# Serve STATIC_ROOT from Django (core.views.serve_static) when no web server does it
+SERVE_STATIC = True
+
 
 # Media files (uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Serve MEDIA_ROOT from Django (core.views.serve_media: ETag/304, byte ranges)
+SERVE_MEDIA = True
+# Hand the file bodies to the front server: None, 'x-sendfile' (Apache, lighttpd)
+# or 'x-accel-redirect' (nginx, with an internal location for MEDIA_ACCEL_PREFIX)
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Browser cache lifetime of uploads (derived/ images are always cached for a year)
+MEDIA_CACHE_MAX_AGE = 0
+# Widths of the resized WebP/JPEG copies of catalog images (see restaurant/images.py)
+RESTAURANT_IMAGE_WIDTHS = (160, 320, 640, 960)
+# Process uploads with the run_image_worker command (False: inline, during the admin save)
+RESTAURANT_IMAGE_JOBS = True
+
+
+# Cart storage (see restaurant/cart.py)
+RESTAURANT_CART_BACKEND = 'restaurant.cart.SessionCart'
+# Copy session carts into Cart rows when they reach the checkout page
+RESTAURANT_CART_ADMIN_MIRROR = False
+# User agents (regex, case-insensitive) that get a read-only cart and never create a session
+RESTAURANT_BOT_USER_AGENTS = (
+    r'bot|crawl|spider|slurp|mediapartners|facebookexternalhit|whatsapp|'
+    r'embedly|bingpreview|lighthouse|headlesschrome|curl|wget|python-requests'
+)
+# Lifetime of the cached catalog fragments of the menu and order pages (0 disables)
+RESTAURANT_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+# Delivered and cancelled orders move to ArchivedOrder after this many days
+# (python manage.py archive_orders), by batches of RESTAURANT_ARCHIVE_BATCH
+# orders with RESTAURANT_ARCHIVE_PAUSE seconds between two batches
+RESTAURANT_ARCHIVE_AFTER_DAYS = 90
+RESTAURANT_ARCHIVE_BATCH = 500
+RESTAURANT_ARCHIVE_PAUSE = 0.5
+# Kitchen board (restaurant.views.kitchen_board): seconds between two refreshes,
+# and changes per refresh above which the page reloads instead
+KITCHEN_POLL_INTERVAL = 5
+KITCHEN_MAX_CHANGES = 100
+# The order feeds (kitchen board, admin changelist) read back this many seconds
+# before their cursor: longer than the longest write transaction on orders
+ORDER_FEED_GRACE = 5
+# Courier dispatch (delivery.dispatch, python manage.py run_dispatcher): seconds
+# a partial batch waits for more orders of its zone, and between two rounds
+DELIVERY_BATCH_WAIT = 120
+DELIVERY_DISPATCH_INTERVAL = 10
+
+
+# New-order notifications of the admin (core.views.order_events / order_poll):
+# seconds between two reads of the cache, between keep-alive comments, before
+# the event stream is closed (clients reconnect) and before a long poll answers
+ORDER_EVENTS_POLL = 1.0
+ORDER_EVENTS_HEARTBEAT = 15
+ORDER_EVENTS_TIMEOUT = 300
+ORDER_POLL_TIMEOUT = 25
+# Under WSGI the poll answers at once; the page polls again after this many seconds
+ORDER_POLL_INTERVAL = 10
+
+# Models whose admin list shows a counter instead of COUNT(*) (core/counts.py);
+# reset the counters with: python manage.py recount_rows
+ROW_COUNT_MODELS = ('restaurant.Order', 'restaurant.ArchivedOrder', 'core.Feedback')
 
 
 # Default primary key field type
@@ -1,14 +1,16 @@
 from django.contrib import admin
 from .models import Feedback
+from .pagination import KeysetPaginationMixin
 
 @admin.register(Feedback)
-class FeedbackAdmin(admin.ModelAdmin):
+class FeedbackAdmin(KeysetPaginationMixin, admin.ModelAdmin):
     list_display = ['name', 'email', 'rating', 'get_star_display', 'created_at', 'is_read']
     list_filter = ['rating', 'is_read', 'created_at']
     search_fields = ['name', 'email', 'message']
     readonly_fields = ['created_at']
     list_editable = ['is_read']
-    date_hierarchy = 'created_at'
+    # No date_hierarchy: its year/month links aggregate the whole table,
+    # the created_at filter covers the same needs without a query
     
     fieldsets = (
         ('Informations Client', {
@@ -0,0 +1,50 @@
+"""
+Approximate row counts of the big tables.
+
+``COUNT(*)`` reads a whole table (or index) on SQLite and PostgreSQL; the
+admin changelists of orders and feedbacks used to run it on every load.
+Instead, ``RowCount`` keeps one counter per model of ``ROW_COUNT_MODELS``,
+incremented and decremented by the ``post_save``/``post_delete`` signals
+(``core/signals.py``) in the transaction of the change.
+
+Bulk operations (``bulk_create``, raw SQL) bypass the signals, so the
+counter can drift: ``manage.py recount_rows`` resets it from an exact
+count, e.g. every night.
+"""
+from django.apps import apps
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import RowCount
+
+DEFAULT_MODELS = ('restaurant.Order', 'restaurant.ArchivedOrder', 'core.Feedback')
+
+
+def counted_models():
+    return [apps.get_model(label) for label in getattr(settings, 'ROW_COUNT_MODELS', DEFAULT_MODELS)]
+
+
+def is_counted(model):
+    return model._meta.label in {m._meta.label for m in counted_models()}
+
+
+def adjust_count(model, delta):
+    RowCount.objects.filter(label=model._meta.label_lower).update(rows=F('rows') + delta)
+
+
+def recount(model):
+    """Store the exact row count of ``model`` (one ``COUNT(*)``) and return it"""
+    rows = model._base_manager.count()
+    RowCount.objects.update_or_create(
+        label=model._meta.label_lower, defaults={'rows': rows, 'counted_at': timezone.now()},
+    )
+    return rows
+
+
+def approximate_count(model):
+    """Row count of a counted model, from its counter; counted once if missing"""
+    rows = RowCount.objects.filter(label=model._meta.label_lower).values_list('rows', flat=True).first()
+    if rows is None:
+        return recount(model)
+    return max(rows, 0)
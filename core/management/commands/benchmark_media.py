@@ -0,0 +1,79 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.views.static import serve
+
+from core.views import serve_media
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare serving an uploaded file with django.views.static.serve (the "
+        "DEBUG static() helper) and core.views.serve_media"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help="File under MEDIA_ROOT (default: the largest one)")
+        parser.add_argument('--requests', type=int, default=500)
+
+    def handle(self, *args, **options):
+        path = options['path'] or self.largest_file()
+        size = os.path.getsize(os.path.join(settings.MEDIA_ROOT, path))
+        factory = RequestFactory()
+        url = settings.MEDIA_URL + path
+
+        def helper(**headers):
+            return lambda: serve(factory.get(url, **headers), path, document_root=settings.MEDIA_ROOT)
+
+        def media(**headers):
+            return lambda: serve_media(factory.get(url, **headers), path)
+
+        with override_settings(MEDIA_SENDFILE=None):
+            first = serve_media(factory.get(url), path)
+        etag, last_modified = first['ETag'], first['Last-Modified']
+        first.close()
+        revalidate = {'HTTP_IF_NONE_MATCH': etag, 'HTTP_IF_MODIFIED_SINCE': last_modified}
+        scenarios = [
+            # (label, MEDIA_SENDFILE, helper view, serve_media view)
+            ('full download', None, helper(), media()),
+            ('revalidation', None, helper(**revalidate), media(**revalidate)),
+            ('range, first 64 KiB', None, helper(HTTP_RANGE='bytes=0-65535'), media(HTTP_RANGE='bytes=0-65535')),
+            ('full, X-Accel-Redirect', 'x-accel-redirect', helper(), media()),
+        ]
+
+        self.stdout.write(f"{path}, {size / 1024:.1f} KiB, {options['requests']} requests")
+        self.stdout.write(f"  {'':<24} {'static() helper':>24} {'serve_media':>24}")
+        for label, sendfile, *views in scenarios:
+            cells = []
+            with override_settings(MEDIA_SENDFILE=sendfile):
+                for view in views:
+                    rps, status, sent = self.measure(view, options['requests'])
+                    cells.append(f"{rps:8.0f} req/s {status} {sent / 1024:6.1f} KiB")
+            self.stdout.write(f"  {label:<24} {cells[0]:>24} {cells[1]:>24}")
+
+    def largest_file(self):
+        files = [
+            os.path.relpath(os.path.join(directory, name), settings.MEDIA_ROOT).replace(os.sep, '/')
+            for directory, _, names in os.walk(settings.MEDIA_ROOT)
+            for name in names
+        ]
+        if not files:
+            raise CommandError(f"No file in {settings.MEDIA_ROOT}")
+        return max(files, key=lambda name: os.path.getsize(os.path.join(settings.MEDIA_ROOT, name)))
+
+    def measure(self, view, requests):
+        """req/s, status and bytes streamed by Python of one scenario"""
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = view()
+            if response.streaming:
+                sent = sum(len(chunk) for chunk in response.streaming_content)
+            else:
+                sent = len(response.content)
+            response.close()
+        elapsed = time.perf_counter() - start
+        return requests / elapsed, response.status_code, sent
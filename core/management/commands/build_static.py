@@ -0,0 +1,49 @@
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from core.staticfiles import brotli, load_report
+
+
+def kib(size):
+    return f"{size / 1024:9.1f}" if size is not None else f"{'-':>9}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Collect the static files with hashed names, re-encode oversized images, "
+        "precompress text assets and print the size of every asset before and after"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', help="Empty STATIC_ROOT first")
+        parser.add_argument('--top', type=int, default=0, help="Only list the N largest assets")
+
+    def handle(self, *args, **options):
+        call_command('collectstatic', interactive=False, clear=options['clear'], verbosity=0)
+        # The manifest changed on disk
+        staticfiles_storage.hashed_files, staticfiles_storage.manifest_hash = staticfiles_storage.load_manifest()
+        report = load_report()
+        if brotli is None:
+            self.stdout.write(self.style.WARNING("brotli is not installed: gzip siblings only"))
+
+        rows = sorted(report.items(), key=lambda item: item[1]['source'], reverse=True)
+        if options['top']:
+            rows = rows[:options['top']]
+        self.stdout.write(f"{'asset':<60} {'source':>9} {'built':>9} {'gzip':>9} {'brotli':>9}  (KiB)")
+        for name, entry in rows:
+            self.stdout.write(
+                f"{name[:60]:<60} {kib(entry['source'])} {kib(entry['optimized'])} "
+                f"{kib(entry.get('gz'))} {kib(entry.get('br'))}"
+            )
+
+        source = sum(entry['source'] for entry in report.values())
+        # What a client downloads: the smallest encoding of each asset
+        sent = sum(
+            min(entry['optimized'], entry.get('gz', entry['optimized']), entry.get('br', entry['optimized']))
+            for entry in report.values()
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(report)} assets: {source / 1024:.1f} KiB before, {sent / 1024:.1f} KiB sent after "
+            f"({100 - sent * 100 / max(source, 1):.0f}% less)"
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core.counts import approximate_count, counted_models, recount
+
+
+class Command(BaseCommand):
+    help = "Reset the approximate row counts of the admin lists (core.counts) from exact counts"
+
+    def handle(self, *args, **options):
+        for model in counted_models():
+            before = approximate_count(model)
+            rows = recount(model)
+            self.stdout.write(f"{model._meta.label_lower}: {rows} ({rows - before:+d})")
@@ -25,6 +25,8 @@ class Feedback(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        # Admin pages (-created_at, -id), see core/pagination.py
+        indexes = [models.Index(fields=['created_at'], name='feedback_created_idx')]
         verbose_name = "Feedback"
         verbose_name_plural = "Feedbacks"
     
@@ -33,4 +35,15 @@ class Feedback(models.Model):
     
     def get_star_display(self):
         """Returns star icons based on rating"""
-        return '⭐' * self.rating
\ No newline at end of file
+        return '⭐' * self.rating
+
+
+class RowCount(models.Model):
+    """Row count of a big table, kept up to date by signals (see core/counts.py)"""
+    label = models.CharField(max_length=100, unique=True)  # 'restaurant.order'
+    rows = models.BigIntegerField(default=0)
+    # Last exact COUNT(*) (manage.py recount_rows)
+    counted_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.label}: {self.rows}"
@@ -0,0 +1,147 @@
+"""
+Keyset pagination of the admin changelists of big tables.
+
+Django's changelist pages with ``LIMIT … OFFSET`` (the database reads and
+drops every row before the page) and runs ``COUNT(*)`` twice per load.
+``KeysetPaginationMixin`` makes a ``ModelAdmin`` ordered by ``-created_at``
+page on ``(created_at, id)`` instead:
+
+- ``?after=<key>`` lists the rows older than the last row of a page,
+  ``?before=<key>`` the rows newer than its first one and ``?before=end``
+  the oldest rows: each page is a range read of the ``created_at`` index,
+  whatever its position;
+- the total is the approximate count of ``core.counts`` when no filter or
+  search applies, otherwise a count that stops after ``COUNT_LIMIT`` rows;
+- facet counts are disabled.
+
+Sorted by another column (``?o=``), the list falls back to Django's
+numbered pages.
+"""
+import copy
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ALL_VAR, ChangeList
+from django.db.models import Q
+
+from .counts import approximate_count, is_counted
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+OLDEST = 'end'
+# The changelist ordering of Meta.ordering = ['-created_at']
+KEYSET_ORDERING = ('-created_at', '-pk')
+COUNT_LIMIT = 1000
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_key(created_at, pk):
+    return f'{(created_at - EPOCH) // timedelta(microseconds=1)}_{pk}'
+
+
+def decode_key(key):
+    """``(created_at, pk)`` of a page key; ``ValueError`` if malformed"""
+    micros, pk = key.split('_')
+    try:
+        return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except OverflowError:
+        raise ValueError(key)
+
+
+def older_than(created_at, pk):
+    # The first condition is a range of the index, the second breaks ties
+    return Q(created_at__lte=created_at) & (Q(created_at__lt=created_at) | Q(pk__lt=pk))
+
+
+def newer_than(created_at, pk):
+    return Q(created_at__gte=created_at) & (Q(created_at__gt=created_at) | Q(pk__gt=pk))
+
+
+class KeysetChangeList(ChangeList):
+
+    def __init__(self, request, *args, **kwargs):
+        after, before = request.GET.get(AFTER_VAR), request.GET.get(BEFORE_VAR)
+        try:
+            self.after = decode_key(after) if after else None
+            self.before = decode_key(before) if before and before != OLDEST else None
+        except ValueError:
+            raise IncorrectLookupParameters
+        self.oldest = before == OLDEST
+        if after or before:
+            # Not filters: kept out of the filter, search and sort links
+            request = copy.copy(request)
+            request.GET = request.GET.copy()
+            request.GET.pop(AFTER_VAR, None)
+            request.GET.pop(BEFORE_VAR, None)
+        super().__init__(request, *args, **kwargs)
+
+    def get_results(self, request):
+        self.keyset = tuple(self.queryset.query.order_by) == KEYSET_ORDERING
+        if not self.keyset:
+            return super().get_results(request)
+
+        self.count_approximate = self.count_limited = False
+        if not self.queryset.query.where and is_counted(self.model):
+            result_count = approximate_count(self.model)
+            self.count_approximate = True
+        else:
+            result_count = self.queryset.order_by()[:COUNT_LIMIT + 1].count()
+            if result_count > COUNT_LIMIT:
+                result_count, self.count_limited = COUNT_LIMIT, True
+        can_show_all = result_count <= self.list_max_show_all and not self.count_limited
+
+        has_previous = has_next = False
+        if self.show_all and can_show_all:
+            result_list = self.queryset._clone()
+        else:
+            queryset = self.queryset
+            backwards = bool(self.before) or self.oldest
+            if self.after:
+                queryset = queryset.filter(older_than(*self.after))
+            elif self.before:
+                queryset = queryset.filter(newer_than(*self.before))
+            if backwards:
+                queryset = queryset.reverse()
+            keys = list(queryset.values_list('created_at', 'pk')[:self.list_per_page + 1])
+            more = len(keys) > self.list_per_page
+            keys = keys[:self.list_per_page]
+            if backwards:
+                keys.reverse()
+                has_previous, has_next = more, not self.oldest
+            else:
+                has_previous, has_next = bool(self.after), more
+            result_list = self.queryset.filter(pk__in=[pk for created_at, pk in keys])
+            self.next_url = self.previous_url = self.get_query_string()
+            if keys:
+                self.next_url = self.get_query_string({AFTER_VAR: encode_key(*keys[-1])})
+                self.previous_url = self.get_query_string({BEFORE_VAR: encode_key(*keys[0])})
+            else:
+                # Past the rows deleted since: back to the first page
+                has_previous, has_next = bool(self.after or self.before or self.oldest), False
+        self.first_url = self.get_query_string()
+        self.oldest_url = self.get_query_string({BEFORE_VAR: OLDEST})
+        self.has_previous, self.has_next = has_previous, has_next
+        self.show_all_url = (
+            self.get_query_string({ALL_VAR: ''})
+            if can_show_all and not self.show_all and (has_previous or has_next) else ''
+        )
+
+        self.result_count = result_count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = result_list
+        self.can_show_all = can_show_all
+        # Numbered pages would need the exact count
+        self.multi_page = False
+        self.paginator = None
+
+
+class KeysetPaginationMixin:
+    """``ModelAdmin`` mixin for the big tables ordered by ``-created_at``"""
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
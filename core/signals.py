@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+
+from .counts import adjust_count, counted_models
+
+
+def row_added(sender, created, **kwargs):
+    if created:
+        adjust_count(sender, 1)
+
+
+def row_deleted(sender, **kwargs):
+    adjust_count(sender, -1)
+
+
+for model in counted_models():
+    post_save.connect(row_added, sender=model, dispatch_uid=f'row-count-save-{model._meta.label}')
+    post_delete.connect(row_deleted, sender=model, dispatch_uid=f'row-count-delete-{model._meta.label}')
@@ -0,0 +1,175 @@
+"""
+Static asset pipeline.
+
+``collectstatic`` (or ``manage.py build_static``) with
+``OptimizedManifestStaticFilesStorage``:
+
+1. re-encodes PNG/JPEG assets heavier than ``STATIC_IMAGE_MAX_BYTES``
+   (downscaled to ``STATIC_IMAGE_MAX_SIZE`` px, PNGs reduced to a dithered
+   256-colour palette, metadata dropped), keeping the original when
+   re-encoding does not make it smaller;
+2. writes content-hashed copies (``css/site.3f2a9c1b.css``) and
+   ``staticfiles.json``, as Django's ``ManifestStaticFilesStorage``;
+3. writes ``.gz`` and, when the ``brotli`` package is installed, ``.br``
+   siblings of every text asset;
+4. records the size of every asset at each step in
+   ``staticfiles-report.json``.
+
+``{% static %}`` then emits the hashed names, which ``core.views.serve_static``
+serves with immutable cache headers and the precompressed body the client
+accepts. Before the first build, ``{% static %}`` falls back to the plain
+names.
+"""
+import gzip
+import io
+import json
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {
+    '.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml',
+    '.ico', '.ttf', '.otf', '.eot', '.webmanifest',
+}
+OPTIMIZABLE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+REPORT_NAME = 'staticfiles-report.json'
+# Encodings in order of preference: (Accept-Encoding token, suffix)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def is_compressible(name):
+    return os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS
+
+
+def optimize_image(data, extension):
+    """Re-encode an image asset; returns ``None`` if it would not get smaller"""
+    from PIL import Image, UnidentifiedImageError
+
+    max_size = getattr(settings, 'STATIC_IMAGE_MAX_SIZE', 1920)
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (OSError, UnidentifiedImageError):
+        return None
+    if max(image.size) > max_size:
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    if extension == '.png':
+        if image.mode != 'P' and getattr(settings, 'STATIC_PNG_QUANTIZE', True):
+            # Lossy but dithered: photos saved as PNG shrink ~10x
+            image = image.convert('RGBA').quantize(
+                256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.FLOYDSTEINBERG,
+            )
+        image.save(buffer, 'PNG', optimize=True)
+    else:
+        image.convert('RGB').save(buffer, 'JPEG', quality=82, optimize=True, progressive=True)
+    optimized = buffer.getvalue()
+    return optimized if len(optimized) < len(data) else None
+
+
+def compress(data):
+    """``{suffix: compressed bytes}`` of the encodings worth keeping"""
+    results = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        results['.br'] = brotli.compress(data, quality=11)
+    # Not worth a sibling if it saves less than 5%
+    return {suffix: body for suffix, body in results.items() if len(body) < len(data) * 0.95}
+
+
+class OptimizedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """``ManifestStaticFilesStorage`` that also optimizes and precompresses"""
+    manifest_strict = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # {name: {'source': bytes, 'optimized': bytes}} of the files copied
+        self.collected = {}
+        self._post_processing = False
+        # (hashed_files, set of its values): rebuilt when the manifest is reloaded
+        self._hashed_names = None
+
+    def is_hashed(self, name):
+        """Whether ``name`` is the hashed (immutable) copy of a file of the manifest"""
+        if self._hashed_names is None or self._hashed_names[0] is not self.hashed_files:
+            self._hashed_names = (self.hashed_files, frozenset(self.hashed_files.values()))
+        return name in self._hashed_names[1]
+
+    def stored_name(self, name):
+        # Not built yet (development, tests): serve the plain name
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def _save(self, name, content):
+        # Both the plain copy and, during post-processing, the hashed copy
+        # (which Django writes from the source file) are optimized; the
+        # encoding is deterministic so they end up identical.
+        extension = os.path.splitext(name)[1].lower()
+        if extension in OPTIMIZABLE_EXTENSIONS:
+            data = content.read()
+            source = len(data)
+            if source > getattr(settings, 'STATIC_IMAGE_MAX_BYTES', 200 * 1024):
+                data = optimize_image(data, extension) or data
+            if not self._post_processing:
+                self.collected[name] = {'source': source, 'optimized': len(data)}
+            content = ContentFile(data)
+        return super()._save(name, content)
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed = {}
+        self._post_processing = True
+        try:
+            for name, hashed_name, result in super().post_process(paths, dry_run, **options):
+                if hashed_name and not isinstance(result, Exception):
+                    hashed[name] = hashed_name
+                yield name, hashed_name, result
+            if not dry_run:
+                self.precompress(paths, hashed)
+        finally:
+            self._post_processing = False
+
+    def precompress(self, paths, hashed):
+        """Write the compressed siblings and the size report"""
+        previous = load_report(self)
+        report = {}
+        for name in paths:
+            hashed_name = hashed.get(name, name)
+            size = self.size(hashed_name)
+            # Files collectstatic did not copy again keep their first sizes
+            entry = self.collected.get(name) or {
+                'source': previous.get(name, {}).get('source', size), 'optimized': size,
+            }
+            entry['hashed_name'] = hashed_name
+            if is_compressible(name):
+                with self.open(hashed_name) as handle:
+                    data = handle.read()
+                for suffix, body in compress(data).items():
+                    for target in {name, hashed_name}:
+                        self._write(target + suffix, body)
+                    entry[suffix.lstrip('.')] = len(body)
+            report[name] = entry
+        self._write(REPORT_NAME, json.dumps(report, indent=1, sort_keys=True).encode())
+
+    def _write(self, name, data):
+        if self.exists(name):
+            self.delete(name)
+        super()._save(name, ContentFile(data))
+
+
+def load_report(storage=None):
+    """The size report of the last build, ``{}`` if there was none"""
+    from django.contrib.staticfiles.storage import staticfiles_storage
+
+    storage = storage or staticfiles_storage
+    if not storage.exists(REPORT_NAME):
+        return {}
+    with storage.open(REPORT_NAME) as handle:
+        return json.loads(handle.read())
@@ -1,3 +1,416 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import StaticFilesStorage, staticfiles_storage
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+
+from restaurant.events import LAST_ORDER_KEY, last_order_id, publish_order
+from restaurant.models import Order
+
+from .admin import FeedbackAdmin
+from .counts import approximate_count
+from .models import Feedback, RowCount
+from .staticfiles import REPORT_NAME
+
+
+class StaticPipelineTests(TestCase):
+
+    def setUp(self):
+        source = tempfile.mkdtemp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        self.addCleanup(shutil.rmtree, root)
+        os.makedirs(os.path.join(source, 'css'))
+        with open(os.path.join(source, 'css', 'site.css'), 'w') as handle:
+            handle.write('.card { background: url("../big.png"); }\n' * 400)
+        Image.effect_noise((600, 400), 30).convert('RGBA').save(os.path.join(source, 'big.png'))
+        Image.new('RGB', (8, 8), 'red').save(os.path.join(source, 'small.png'))
+        override = override_settings(
+            STATIC_ROOT=root,
+            STATICFILES_DIRS=[source],
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            STATIC_IMAGE_MAX_BYTES=100 * 1024,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.source, self.root = source, root
+        call_command('build_static', stdout=io.StringIO())
+
+    def test_build_hashes_optimizes_and_compresses(self):
+        with open(os.path.join(self.root, REPORT_NAME)) as handle:
+            report = json.load(handle)
+
+        css = report['css/site.css']
+        self.assertRegex(css['hashed_name'], r'^css/site\.[0-9a-f]{12}\.css$')
+        self.assertLess(css['gz'], css['optimized'] / 10)
+        with gzip.open(os.path.join(self.root, css['hashed_name'] + '.gz')) as handle:
+            # References inside CSS point to the hashed names too
+            self.assertIn(report['big.png']['hashed_name'].split('/')[-1], handle.read().decode())
+
+        big = report['big.png']
+        self.assertLess(big['optimized'], big['source'])
+        self.assertEqual(os.path.getsize(os.path.join(self.root, big['hashed_name'])), big['optimized'])
+        small = report['small.png']
+        self.assertEqual(small['optimized'], small['source'])
+        self.assertNotIn('gz', small)
+
+        html = Template('{% load static %}{% static "css/site.css" %}').render(Context())
+        self.assertEqual(html, '/static/' + css['hashed_name'])
+
+    def test_serving_precompressed_and_immutable(self):
+        hashed_name = staticfiles_storage.stored_name('css/site.css')
+
+        response = self.client.get('/static/' + hashed_name, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        body = gzip.decompress(b''.join(response.streaming_content))
+        self.assertTrue(body.startswith(b'.card'))
+
+        response = self.client.get('/static/' + hashed_name, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)  # other encoding, other ETag
+        etag = response['ETag']
+        self.assertNotIn('Content-Encoding', response)
+        response = self.client.get('/static/' + hashed_name, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # The set of hashed names is built once, not per request
+        names = staticfiles_storage._hashed_names
+        self.client.get('/static/' + hashed_name)
+        self.assertIs(staticfiles_storage._hashed_names, names)
+
+        response = self.client.get('/static/css/site.css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=0, must-revalidate')
+        self.assertEqual(self.client.get('/static/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/static/missing.css').status_code, 404)
+
+    def test_serving_with_another_storage(self):
+        hashed_name = staticfiles_storage.stored_name('css/site.css')
+        with patch('core.views.staticfiles_storage', StaticFilesStorage()):
+            response = self.client.get('/static/' + hashed_name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=0, must-revalidate')
+
+
+class MediaServingTests(TestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        override = override_settings(MEDIA_ROOT=root, MEDIA_SENDFILE=None)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.root = root
+        self.data = bytes(range(256)) * 40
+        os.makedirs(os.path.join(root, 'products'))
+        with open(os.path.join(root, 'products', 'm.jpg'), 'wb') as handle:
+            handle.write(self.data)
+
+    def get(self, path='/media/products/m.jpg', **headers):
+        response = self.client.get(path, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_full_and_conditional_requests(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=0, must-revalidate')
+
+        etag, modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag)[0].status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='W/' + etag)[0].status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=modified)[0].status_code, 304)
+        # If-None-Match wins over If-Modified-Since
+        stale = self.get(HTTP_IF_NONE_MATCH='"0-0"', HTTP_IF_MODIFIED_SINCE=modified)[0]
+        self.assertEqual(stale.status_code, 200)
+
+        os.utime(os.path.join(self.root, 'products', 'm.jpg'), (1, 1))
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag)[0].status_code, 200)
+
+    def test_range_requests(self):
+        response, body = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.data)}')
+        self.assertEqual(response['Content-Length'], '10')
+
+        response, body = self.get(HTTP_RANGE='bytes=-100')
+        self.assertEqual(body, self.data[-100:])
+        response, body = self.get(HTTP_RANGE='bytes=10000-')
+        self.assertEqual(body, self.data[10000:])
+        response, body = self.get(HTTP_RANGE='bytes=10200-99999')
+        self.assertEqual(body, self.data[10200:])
+
+        response, _ = self.get(HTTP_RANGE='bytes=20000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+        # Several ranges, or an outdated If-Range: the whole file
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-1,5-9')[1], self.data)
+        etag = self.get()[0]['ETag']
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"0-0"')[1], self.data)
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)[1], self.data[:10])
+
+    def test_sendfile_offload(self):
+        with override_settings(MEDIA_SENDFILE='x-accel-redirect'):
+            response, body = self.get()
+        self.assertEqual(body, b'')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/products/m.jpg')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('ETag', response)
+
+        with override_settings(MEDIA_SENDFILE='x-sendfile'):
+            response, body = self.get()
+        self.assertEqual(body, b'')
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.root, 'products', 'm.jpg'))
+
+        with override_settings(MEDIA_SENDFILE='x-sendfile'):
+            modified = http_date(os.path.getmtime(os.path.join(self.root, 'products', 'm.jpg')))
+            response, _ = self.get(HTTP_IF_MODIFIED_SINCE=modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('X-Sendfile', response)
+
+    def test_sendfile_offload_of_non_ascii_names(self):
+        with open(os.path.join(self.root, 'products', 'crêpe au miel.jpg'), 'wb') as handle:
+            handle.write(self.data)
+        url = '/media/products/cr%C3%AApe%20au%20miel.jpg'
+        with override_settings(MEDIA_SENDFILE='x-accel-redirect'):
+            response, _ = self.get(url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/products/cr%C3%AApe%20au%20miel.jpg')
+
+        # No raw path in a header: served here
+        with override_settings(MEDIA_SENDFILE='x-sendfile'):
+            response, body = self.get(url)
+        self.assertNotIn('X-Sendfile', response)
+        self.assertEqual(body, self.data)
+
+    def test_derivatives_are_immutable_and_paths_contained(self):
+        os.makedirs(os.path.join(self.root, 'derived', 'products'))
+        with open(os.path.join(self.root, 'derived', 'products', 'abc-320.webp'), 'wb') as handle:
+            handle.write(b'RIFF')
+        response, _ = self.get('/media/derived/products/abc-320.webp')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        self.assertEqual(self.get('/media/../manage.py')[0].status_code, 404)
+        self.assertEqual(self.get('/media/products/')[0].status_code, 404)
+        self.assertEqual(self.client.post('/media/products/m.jpg').status_code, 405)
+
+
+@override_settings(ORDER_EVENTS_POLL=0.01, ORDER_EVENTS_TIMEOUT=0.1, ORDER_POLL_TIMEOUT=0.1)
+class OrderNotificationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user('caisse', password='x', is_staff=True)
+        self.client.force_login(self.staff)
+
+    def order(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Order.objects.create(customer_phone='0550', total_price='900.00', **kwargs)
+
+    def test_racing_publishes_never_lower_the_last_id(self):
+        first, second = self.order(), self.order()
+        # The publish of the first order wrote last, over the second one
+        cache.set(LAST_ORDER_KEY, first.id, None)
+        with self.assertNumQueries(0):
+            self.assertEqual(last_order_id(), second.id)
+        self.assertEqual(cache.get(LAST_ORDER_KEY), second.id)
+        publish_order(first)
+        self.assertEqual(last_order_id(), second.id)
+
+    def test_committed_orders_are_published(self):
+        first = self.order(customer_name='Amine')
+        self.assertEqual(last_order_id(), first.id)
+
+        response = self.client.get('/orders/poll/', {'since_id': first.id - 1})
+        self.assertEqual(response.json(), {
+            'last_id': first.id,
+            'orders': [{
+                'id': first.id, 'customer': 'Amine', 'total': '900.00',
+                'created_at': first.created_at.isoformat(),
+            }],
+            'retry_after': 10,
+        })
+
+    def test_poll_reads_only_the_cache(self):
+        order = self.order()
+        # Only the session and the staff user are read
+        with self.assertNumQueries(4):
+            self.assertEqual(self.client.get('/orders/poll/').json()['last_id'], order.id)
+            response = self.client.get('/orders/poll/', {'since_id': order.id})
+        self.assertEqual(response.json(), {'last_id': order.id, 'orders': [], 'retry_after': 10})
+
+        # Cursor ahead of the latest order (database reset): answered at once
+        self.assertEqual(self.client.get('/orders/poll/', {'since_id': order.id + 5}).json()['last_id'], order.id)
+
+        # Cold cache: one query to find the latest order
+        cache.clear()
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get('/orders/poll/').json()['last_id'], order.id)
+
+    def test_expired_events_still_move_the_cursor(self):
+        order = self.order()
+        cache.delete(f'restaurant:order-event:{order.id}')
+        response = self.client.get('/orders/poll/', {'since_id': order.id - 1})
+        self.assertEqual(response.json()['orders'], [{'id': order.id}])
+
+    def test_staff_only(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/orders/poll/').status_code, 302)
+        self.assertEqual(self.client.get('/orders/events/').status_code, 302)
+
+    def test_stream_needs_asgi(self):
+        self.assertEqual(self.client.get('/orders/events/').status_code, 204)
+
+    @override_settings(ORDER_POLL_TIMEOUT=5)
+    def test_short_poll_under_wsgi(self):
+        order = self.order()
+        started = time.monotonic()
+        # Nothing new: answered at once, the page waits retry_after seconds
+        response = self.client.get('/orders/poll/', {'since_id': order.id})
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(response.json()['retry_after'], 10)
+
+    async def test_long_poll_under_asgi(self):
+        order = await Order.objects.acreate(customer_phone='0550', total_price='900.00')
+        await asyncio.to_thread(publish_order, order)
+        client = AsyncClient()
+        await client.aforce_login(self.staff)
+        started = time.monotonic()
+        # Nothing new: answered after ORDER_POLL_TIMEOUT
+        response = await client.get('/orders/poll/', {'since_id': order.id})
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+        self.assertEqual(response.json(), {'last_id': order.id, 'orders': []})
+
+    async def read_stream(self, **params):
+        client = AsyncClient()
+        await client.aforce_login(self.staff)
+        response = await client.get('/orders/events/', params)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return ''.join([chunk.decode() async for chunk in response.streaming_content])
+
+    async def test_event_stream(self):
+        first = await Order.objects.acreate(customer_phone='0550', total_price='900.00')
+        await asyncio.to_thread(publish_order, first)
+        second = await Order.objects.acreate(customer_phone='0661', total_price='450.00')
+        await asyncio.to_thread(publish_order, second)
+
+        body = await self.read_stream(since_id=first.id - 1)
+        self.assertTrue(body.startswith(f'retry: 3000\nid: {first.id - 1}\nevent: ready\n'))
+        self.assertIn(f'id: {first.id}\nevent: order\ndata: {{"id": {first.id}, "customer": "0550"', body)
+        self.assertIn(f'id: {second.id}\nevent: order\n', body)
+
+        # Without a cursor the stream starts at the latest order
+        body = await self.read_stream()
+        self.assertIn(f'id: {second.id}\nevent: ready\n', body)
+        self.assertNotIn('event: order', body)
+
+
+@patch.object(FeedbackAdmin, 'list_per_page', 4)
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('gerant', password='x'))
+        self.url = reverse('admin:core_feedback_changelist')
+        start = timezone.now() - timedelta(days=30)
+        for i in range(11):
+            Feedback.objects.create(name=f'Client {i}', email='c@example.com', rating=i % 5 + 1, message='...')
+        # Pairs of feedbacks sent at the same time: ties broken by id
+        for feedback in Feedback.objects.all():
+            Feedback.objects.filter(pk=feedback.pk).update(created_at=start + timedelta(hours=feedback.pk // 2))
+        self.expected = list(Feedback.objects.order_by('-created_at', '-pk').values_list('pk', flat=True))
+
+    def page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl'], [feedback.pk for feedback in response.context['cl'].result_list]
+
+    def test_walk_forward_and_back(self):
+        cl, seen = self.page(self.url)
+        self.assertFalse(cl.has_previous)
+        while cl.has_next:
+            cl, rows = self.page(self.url + cl.next_url)
+            seen += rows
+        self.assertEqual(seen, self.expected)
+
+        cl, seen = self.page(self.url + '?before=end')
+        self.assertEqual(seen, self.expected[-4:])
+        self.assertFalse(cl.has_next)
+        while cl.has_previous:
+            cl, rows = self.page(self.url + cl.previous_url)
+            seen = rows + seen
+        self.assertEqual(seen, self.expected)
+
+    def test_malformed_keys_are_rejected(self):
+        for key in ['abc', '12', '1_2_3', '99999999999999999999_1', '-99999999999999999999_1']:
+            with self.subTest(key=key):
+                response = self.client.get(self.url, {'after': key})
+                # The admin's answer to bad lookup parameters
+                self.assertEqual(response.status_code, 302)
+                self.assertIn('e=1', response['Location'])
+
+    def test_filters_keep_the_keyset(self):
+        cl, first = self.page(self.url + '?rating__exact=1')
+        self.assertFalse(cl.count_approximate)
+        self.assertIn('rating__exact=1', cl.next_url)
+        self.assertNotIn('after', cl.get_query_string({'is_read__exact': 1}))
+        cl, second = self.page(self.url + cl.next_url)
+        self.assertEqual(first + second, [pk for pk in self.expected if Feedback.objects.get(pk=pk).rating == 1])
+        self.assertEqual(cl.result_count, 3)
+
+    def test_counter_instead_of_count(self):
+        self.page(self.url)  # the first read counts the rows once
+        with CaptureQueriesContext(connection) as ctx:
+            cl, _ = self.page(self.url)
+        self.assertTrue(cl.count_approximate)
+        self.assertEqual(cl.result_count, 11)
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if 'COUNT(' in q['sql']])
+        self.assertContains(self.client.get(self.url), 'Environ 11')
+
+        Feedback.objects.create(name='Nouveau', email='n@example.com', rating=5, message='...')
+        Feedback.objects.first().delete()
+        Feedback.objects.filter(pk__in=self.expected[:3]).delete()
+        self.assertEqual(approximate_count(Feedback), 8)
+
+        # Bulk inserts are not counted until the next recount
+        Feedback.objects.bulk_create([Feedback(name='Lot', email='l@example.com', rating=3, message='...')])
+        self.assertEqual(approximate_count(Feedback), 8)
+        call_command('recount_rows', stdout=io.StringIO())
+        self.assertEqual(RowCount.objects.get(label='core.feedback').rows, 9)
+
+    def test_filtered_count_is_bounded(self):
+        with patch('core.pagination.COUNT_LIMIT', 5):
+            cl, _ = self.page(self.url + '?q=Client')
+        self.assertTrue(cl.count_limited)
+        self.assertEqual(cl.result_count, 5)
+
+    def test_other_orderings_use_numbered_pages(self):
+        cl, rows = self.page(self.url + '?o=3&p=2')
+        self.assertFalse(cl.keyset)
+        self.assertEqual(cl.result_count, 11)
+        self.assertEqual(len(rows), 4)
+
+    def test_bad_cursor(self):
+        response = self.client.get(self.url + '?after=nope')
+        self.assertRedirects(response, self.url + '?e=1', fetch_redirect_response=False)
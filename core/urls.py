@@ -9,6 +9,8 @@ urlpatterns = [
     path("machaoui-ilyes-oran/", views.index, name="machaoui_seo"),
 
     path("latest-order-meta/", views.latest_order_meta, name="latest_order_meta"),
+    path("orders/events/", views.order_events, name="order_events"),
+    path("orders/poll/", views.order_poll, name="order_poll"),
     path("submit-form/",views.submit_feedback,name="submit_form"),
     re_path(r'^sitemap\.xml$', TemplateView.as_view(
         template_name="sitemap.xml",
@@ -1,4 +1,25 @@
+import asyncio
+import json
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from restaurant.events import events_between, last_order_id
+
+from .staticfiles import ENCODINGS
 
 # Create your views here.
 def index1(request):
@@ -73,4 +94,273 @@ def submit_feedback(request):
             request, 
             "Une erreur s'est produite lors de l'envoi de votre feedback. Veuillez réessayer."
         )
-        return redirect('core:home')
\ No newline at end of file
+        return redirect('core:home')
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+RANGE_CHUNK = 64 * 1024
+
+
+def _resolve(root, path):
+    """Absolute path of ``path`` inside ``root``; 404 outside of it or if missing"""
+    try:
+        full_path = safe_join(root, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    return full_path
+
+
+def _etag(stat, suffix=''):
+    return f'"{int(stat.st_mtime)}-{stat.st_size}{suffix}"'
+
+
+def _etag_matches(header, etag):
+    """Weak comparison, as required for ``If-None-Match``"""
+    tags = [tag.removeprefix('W/') for tag in parse_etags(header)]
+    return '*' in tags or etag in tags
+
+
+def _not_modified(request, etag, mtime):
+    """Whether the client's copy is current (``If-None-Match`` wins over ``If-Modified-Since``)"""
+    if 'If-None-Match' in request.headers:
+        return _etag_matches(request.headers['If-None-Match'], etag)
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return since is not None and int(mtime) <= since
+
+
+def _byte_range(request, etag, mtime, size):
+    """
+    ``(start, end)`` (inclusive) of the single range requested, ``None``
+    for the whole file, or ``False`` if the range cannot be satisfied.
+    Multiple ranges are answered with the whole file, which RFC 9110
+    allows.
+    """
+    match = RANGE_RE.match(request.headers.get('Range', '').replace(' ', ''))
+    if not match or not any(match.groups()):
+        return None
+    # If-Range: only send a part of the representation the client has
+    validator = request.headers.get('If-Range')
+    if validator and validator != etag and parse_http_date_safe(validator) != int(mtime):
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size or start > end or (not first and int(last) == 0):
+        return False
+    return start, end
+
+
+def _read_range(handle, start, length):
+    try:
+        handle.seek(start)
+        while length > 0:
+            chunk = handle.read(min(RANGE_CHUNK, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        handle.close()
+
+
+@require_safe
+def serve_static(request, path):
+    """
+    Serve a collected static file (see ``core/staticfiles.py``).
+
+    Hashed names are cached for a year as ``immutable``; other names must
+    be revalidated. The ``.br``/``.gz`` sibling is sent when the client
+    accepts it.
+    """
+    full_path = _resolve(settings.STATIC_ROOT, path)
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    accepted = {
+        token.split(';')[0].strip()
+        for token in request.headers.get('Accept-Encoding', '').split(',')
+    }
+    encoding = None
+    for token, suffix in ENCODINGS:
+        if token in accepted and os.path.isfile(full_path + suffix):
+            encoding, full_path = token, full_path + suffix
+            break
+
+    stat = os.stat(full_path)
+    etag = _etag(stat, '-' + encoding if encoding else '')
+    # Only OptimizedManifestStaticFilesStorage knows its hashed names
+    is_hashed = getattr(staticfiles_storage, 'is_hashed', None)
+    immutable = is_hashed is not None and is_hashed(path)
+    cache_control = 'public, max-age=31536000, immutable' if immutable else 'public, max-age=0, must-revalidate'
+
+    if _not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(
+            open(full_path, 'rb'), content_type=content_type, filename=os.path.basename(path)
+        )
+        if 'Content-Disposition' in response:
+            del response['Content-Disposition']
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serve an uploaded file from ``MEDIA_ROOT``.
+
+    Answers ``If-None-Match``/``If-Modified-Since`` with 304 and single
+    byte ``Range`` requests with 206. With ``MEDIA_SENDFILE`` set, the
+    body is left to the front server (``X-Sendfile`` for Apache/lighttpd,
+    ``X-Accel-Redirect`` for nginx), which also handles ranges. Image
+    derivatives (``derived/``, named after their content) are cached as
+    ``immutable``.
+
+    The ``X-Accel-Redirect`` URI is percent-encoded (spaces, accents of
+    dish names); ``X-Sendfile`` takes a raw path, so files with a non-ASCII
+    name are served by Django instead.
+    """
+    full_path = _resolve(settings.MEDIA_ROOT, path)
+    stat = os.stat(full_path)
+    etag = _etag(stat)
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if path.startswith('derived/'):
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = f"public, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 0)}, must-revalidate"
+
+    sendfile = getattr(settings, 'MEDIA_SENDFILE', None)
+    if _not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+    elif sendfile == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        prefix = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = quote(prefix.rstrip('/') + '/' + path)
+    elif sendfile == 'x-sendfile' and full_path.isascii():
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        byte_range = _byte_range(request, etag, stat.st_mtime, stat.st_size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+        elif byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                _read_range(open(full_path, 'rb'), start, end - start + 1),
+                status=206, content_type=content_type,
+            )
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        else:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        response['Accept-Ranges'] = 'bytes'
+    if response.status_code != 416:
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+    return response
+
+
+RECONNECT_DELAY = 3000  # ms, sent to EventSource
+
+
+def _cursor(value, default):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+async def _new_orders(since_id, last_id):
+    """Events after ``since_id``; just the id if they already expired"""
+    events = await sync_to_async(events_between)(since_id, last_id)
+    return events or [{'id': last_id}]
+
+
+async def _order_stream(since_id):
+    poll = getattr(settings, 'ORDER_EVENTS_POLL', 1.0)
+    heartbeat = getattr(settings, 'ORDER_EVENTS_HEARTBEAT', 15)
+    lifetime = getattr(settings, 'ORDER_EVENTS_TIMEOUT', 300)
+    loop = asyncio.get_running_loop()
+    started = quiet_since = loop.time()
+
+    yield f'retry: {RECONNECT_DELAY}\nid: {since_id}\nevent: ready\ndata: {json.dumps({"last_id": since_id})}\n\n'
+    # Closed after ``lifetime``: EventSource reconnects with Last-Event-ID
+    while loop.time() - started < lifetime:
+        await asyncio.sleep(poll)
+        last_id = await sync_to_async(last_order_id)()
+        if last_id > since_id:
+            for event in await _new_orders(since_id, last_id):
+                yield f'id: {event["id"]}\nevent: order\ndata: {json.dumps(event)}\n\n'
+            since_id = last_id
+            quiet_since = loop.time()
+        elif loop.time() - quiet_since >= heartbeat:
+            # Keeps proxies from closing an idle connection
+            yield ': keep-alive\n\n'
+            quiet_since = loop.time()
+
+
+@staff_member_required
+async def order_events(request):
+    """
+    Server-Sent Events stream of new orders (``event: order``).
+
+    Resumes after ``Last-Event-ID`` or ``?since_id=``; without either it
+    starts at the latest order. Only reads the cache (see
+    ``restaurant.events``). Needs an ASGI server (``config.asgi``): under
+    WSGI a stream would hold a worker thread, so it answers 204, which
+    makes EventSource give up and the page fall back to ``order_poll``.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    last_id = await sync_to_async(last_order_id)()
+    since_id = _cursor(request.headers.get('Last-Event-ID') or request.GET.get('since_id'), last_id)
+    response = StreamingHttpResponse(
+        _order_stream(min(since_id, last_id)), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: do not buffer the stream
+    return response
+
+
+@staff_member_required
+async def order_poll(request):
+    """
+    Long-polling fallback of ``order_events``: answers as soon as there is
+    an order after ``?since_id=``, or after ``ORDER_POLL_TIMEOUT`` seconds
+    with no order. Without ``since_id`` it answers the current cursor.
+
+    Under WSGI the wait would hold a worker thread per admin tab: it answers
+    at once, with ``retry_after`` (``ORDER_POLL_INTERVAL`` seconds) for the
+    page to wait before the next poll.
+    """
+    poll = getattr(settings, 'ORDER_EVENTS_POLL', 1.0)
+    timeout = getattr(settings, 'ORDER_POLL_TIMEOUT', 25)
+    long_poll = isinstance(request, ASGIRequest)
+    last_id = await sync_to_async(last_order_id)()
+    since_id = _cursor(request.GET.get('since_id'), None)
+    orders = []
+    # A cursor ahead of the latest order (database reset) is answered at once
+    if since_id is not None and since_id <= last_id:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while long_poll and last_id == since_id and loop.time() < deadline:
+            await asyncio.sleep(poll)
+            last_id = await sync_to_async(last_order_id)()
+        if last_id > since_id:
+            orders = await _new_orders(since_id, last_id)
+    data = {'last_id': last_id, 'orders': orders}
+    if not long_poll:
+        data['retry_after'] = getattr(settings, 'ORDER_POLL_INTERVAL', 10)
+    response = JsonResponse(data)
+    response['Cache-Control'] = 'no-cache'
+    return response
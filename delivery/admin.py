@@ -1,3 +1,50 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.utils import timezone
 
-# Register your models here.
+from .models import Courier, DeliveryJob, Zone
+
+
+@admin.register(Zone)
+class ZoneAdmin(admin.ModelAdmin):
+    list_display = ['name', 'keywords']
+    search_fields = ['name', 'keywords']
+
+
+@admin.register(Courier)
+class CourierAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'status', 'capacity', 'active_jobs', 'jobs_done', 'available_since']
+    list_filter = ['status']
+    list_editable = ['capacity']
+    list_select_related = ['user']
+    search_fields = ['user__username', 'user__first_name', 'user__last_name']
+    readonly_fields = ['active_jobs', 'jobs_done', 'available_since', 'updated_at']
+    actions = ['start_shift', 'end_shift']
+
+    @admin.action(description="Début de service (disponible)", permissions=['change'])
+    def start_shift(self, request, queryset):
+        # Couriers out on a trip come back available through the dispatcher
+        updated = queryset.filter(status='offline').update(status='available', available_since=timezone.now())
+        self.message_user(request, f"{updated} livreur(s) disponible(s).", messages.SUCCESS)
+
+    @admin.action(description="Fin de service (hors service)", permissions=['change'])
+    def end_shift(self, request, queryset):
+        busy = queryset.filter(status='delivering').count()
+        updated = queryset.filter(status='available').update(status='offline')
+        self.message_user(request, f"{updated} livreur(s) hors service.", messages.SUCCESS)
+        if busy:
+            self.message_user(request, f"{busy} livreur(s) encore en livraison.", messages.WARNING)
+
+
+@admin.register(DeliveryJob)
+class DeliveryJobAdmin(admin.ModelAdmin):
+    """Read-only: jobs are queued and assigned by manage.py run_dispatcher"""
+    list_display = ['order', 'zone', 'courier', 'status', 'queued_at', 'assigned_at', 'done_at']
+    list_filter = ['status', 'zone']
+    list_select_related = ['order', 'zone', 'courier__user']
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
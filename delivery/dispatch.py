@@ -0,0 +1,178 @@
+"""
+Courier dispatch.
+
+A round of the dispatcher (``dispatch_round``, run in a loop by
+``manage.py run_dispatcher``) has three steps:
+
+1. ``release_couriers``: jobs whose order was delivered, cancelled or
+   archived are closed; a courier with no job left is back and available again.
+2. ``enqueue_ready_orders``: ``ready`` orders with an address and no courier
+   get a queued ``DeliveryJob``, in the zone their address names.
+3. ``dispatch``: while a courier is available, the oldest queued job picks the
+   zone, and the courier waiting the longest takes it with the next queued
+   jobs of that zone, up to their capacity. Couriers leave in turn, so the
+   trips spread evenly. A partial batch waits up to ``DELIVERY_BATCH_WAIT``
+   seconds for more orders of its zone.
+
+Each decision reads the first rows of an index (``courier_queue_idx``,
+``job_queue_idx``, ``job_zone_queue_idx``) and writes with conditional
+UPDATEs, whatever the length of the queues. One dispatcher process runs at a
+time; orders assigned by hand in the admin are left alone.
+"""
+import unicodedata
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from restaurant.models import Order
+
+from .models import Courier, DeliveryJob, Zone
+
+CLOSED_STATUSES = ('delivered', 'cancelled')
+
+
+def fold(text):
+    """Lowercase ``text`` without accents, for the zone keywords"""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def zone_keywords():
+    """``[(zone id, folded keywords)]`` of all the zones"""
+    return [(zone.pk, [fold(word) for word in zone.keyword_list()]) for zone in Zone.objects.all()]
+
+
+def zone_for_address(address, keywords):
+    """Id of the first zone with a keyword in ``address``, or ``None``"""
+    address = fold(address)
+    for zone_id, words in keywords:
+        if any(word in address for word in words):
+            return zone_id
+    return None
+
+
+def enqueue_ready_orders(now=None):
+    """Queue the ready orders waiting for a courier; returns how many"""
+    now = now or timezone.now()
+    orders = list(
+        Order.objects.filter(status='ready', delivery_person__isnull=True, delivery_job__isnull=True)
+        .exclude(customer_address__isnull=True).exclude(customer_address='')
+        .order_by().values_list('pk', 'customer_address')
+    )
+    if not orders:
+        return 0
+    keywords = zone_keywords()
+    DeliveryJob.objects.bulk_create([
+        DeliveryJob(order_id=pk, zone_id=zone_for_address(address, keywords), queued_at=now)
+        for pk, address in orders
+    ], ignore_conflicts=True)
+    return len(orders)
+
+
+def release_couriers(now=None):
+    """Close the jobs whose order is over or was assigned by hand; returns how many"""
+    now = now or timezone.now()
+    closed = list(
+        DeliveryJob.objects.filter(
+            Q(status='assigned', order__status__in=CLOSED_STATUSES)
+            | Q(status='assigned', order__isnull=True)
+            | (Q(status='queued') & (~Q(order__status='ready') | Q(order__delivery_person__isnull=False)))
+        ).order_by().values_list('pk', 'courier_id')
+    )
+    if not closed:
+        return 0
+    per_courier = Counter(courier_id for _, courier_id in closed if courier_id)
+    with transaction.atomic():
+        DeliveryJob.objects.filter(pk__in=[pk for pk, _ in closed]).update(status='done', done_at=now)
+        for courier_id, jobs in per_courier.items():
+            Courier.objects.filter(pk=courier_id).update(
+                active_jobs=Greatest(F('active_jobs') - jobs, 0), jobs_done=F('jobs_done') + jobs,
+            )
+        # Back from their trip once their last order is closed
+        Courier.objects.filter(pk__in=per_courier, status='delivering', active_jobs=0).update(
+            status='available', available_since=now,
+        )
+    return len(closed)
+
+
+def courier_queue():
+    """Available couriers, longest waiting first (courier_queue_idx)"""
+    return Courier.objects.filter(status='available').order_by('available_since', 'pk')
+
+
+def job_queue(zone_id=None, held=()):
+    """Queued jobs, oldest first: of ``zone_id``, or of every zone but the ``held`` ones"""
+    jobs = DeliveryJob.objects.filter(status='queued').order_by('queued_at', 'pk')
+    if zone_id is not None:
+        return jobs.filter(zone_id=zone_id)
+    return jobs.exclude(zone__in=held) if held else jobs
+
+
+class _Taken(Exception):
+    """Courier or job changed since it was read: the assignment is undone"""
+
+
+def assign(courier, jobs, now):
+    """Give ``jobs`` to ``courier``; ``False`` if either was taken meanwhile"""
+    pks = [job.pk for job in jobs]
+    try:
+        with transaction.atomic():
+            if not Courier.objects.filter(pk=courier.pk, status='available').update(
+                status='delivering', active_jobs=F('active_jobs') + len(jobs),
+            ):
+                raise _Taken
+            if DeliveryJob.objects.filter(pk__in=pks, status='queued').update(
+                status='assigned', courier=courier, assigned_at=now,
+            ) != len(jobs):
+                raise _Taken
+            # Real time: updated_at is the cursor of the admin feed and the kitchen board
+            Order.objects.filter(pk__in=[job.order_id for job in jobs]).update(
+                delivery_person_id=courier.user_id, updated_at=timezone.now(),
+            )
+    except _Taken:
+        return False
+    return True
+
+
+def dispatch(now=None, batch_wait=None):
+    """Assign the queued jobs to the available couriers; returns ``[(courier, jobs)]``"""
+    now = now or timezone.now()
+    if batch_wait is None:
+        batch_wait = getattr(settings, 'DELIVERY_BATCH_WAIT', 120)
+    wait = timedelta(seconds=batch_wait)
+    batches = []
+    # Zones whose partial batch waits for more orders
+    held = set()
+    while True:
+        courier = courier_queue().first()
+        if courier is None:
+            break
+        head = job_queue(held=held).first()
+        if head is None:
+            break
+        if head.zone_id is None:
+            # Unknown area: delivered alone
+            jobs = [head]
+        else:
+            jobs = list(job_queue(head.zone_id)[:courier.capacity])
+            if len(jobs) < courier.capacity and now - head.queued_at < wait:
+                held.add(head.zone_id)
+                continue
+        if not assign(courier, jobs, now):
+            # Taken by someone else: the next round reads the queues again
+            break
+        batches.append((courier, jobs))
+    return batches
+
+
+def dispatch_round(now=None, batch_wait=None):
+    """One round of the dispatcher; returns the batches assigned"""
+    now = now or timezone.now()
+    release_couriers(now)
+    enqueue_ready_orders(now)
+    return dispatch(now, batch_wait)
@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from delivery.dispatch import dispatch_round
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue the ready orders, batch them by zone and assign them to the available "
+        "couriers, every DELIVERY_DISPATCH_INTERVAL seconds (one process at a time)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=getattr(settings, 'DELIVERY_DISPATCH_INTERVAL', 10),
+            help="Seconds between two rounds",
+        )
+        parser.add_argument('--batch-wait', type=int, help="Seconds a partial batch waits (default: DELIVERY_BATCH_WAIT)")
+        parser.add_argument('--once', action='store_true', help="Run a single round")
+
+    def handle(self, *args, **options):
+        while True:
+            for courier, jobs in dispatch_round(batch_wait=options['batch_wait']):
+                orders = ', '.join(f"#{job.order_id}" for job in jobs)
+                self.stdout.write(f"{courier}: {orders}")
+            if options['once']:
+                break
+            time.sleep(options['interval'])
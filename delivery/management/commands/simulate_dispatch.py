@@ -0,0 +1,150 @@
+import heapq
+import math
+import random
+import time
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from delivery.dispatch import dispatch_round
+from delivery.models import Courier, DeliveryJob, Zone
+from restaurant.models import Order
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted ``values``"""
+    return values[min(len(values) - 1, max(math.ceil(p / 100 * len(values)) - 1, 0))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a synthetic evening of orders through the dispatcher, on a virtual clock, "
+        "and report the dispatch latency percentiles. Everything is rolled back at the end; "
+        "the database is locked meanwhile, so run it on a copy of production"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=250)
+        parser.add_argument('--couriers', type=int, default=12)
+        parser.add_argument('--zones', type=int, default=6)
+        parser.add_argument('--capacity', type=int, default=3, help="Orders per trip")
+        parser.add_argument('--hours', type=float, default=5, help="Length of the evening")
+        parser.add_argument('--tick', type=int, default=10, help="Virtual seconds between two rounds")
+        parser.add_argument(
+            '--batch-wait', type=int, default=getattr(settings, 'DELIVERY_BATCH_WAIT', 120),
+            help="Seconds a partial batch waits for more orders of its zone",
+        )
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            report = self.simulate(rng, options)
+            transaction.set_rollback(True)
+        self.report(options, *report)
+
+    def simulate(self, rng, options):
+        token = uuid4().hex[:8]
+        start = timezone.now()
+        # The real couriers and orders sit the evening out (rolled back with the rest)
+        Courier.objects.update(status='offline')
+        Order.objects.filter(status='ready').update(status='preparing')
+        DeliveryJob.objects.filter(status='queued').update(status='done')
+
+        zones = [
+            Zone.objects.create(name=f"Simulation {token} {i}", keywords=f"sim-{token}-{i}-")
+            for i in range(options['zones'])
+        ]
+        for i in range(options['couriers']):
+            user = User.objects.create(username=f"sim-{token}-{i}")
+            Courier.objects.create(user=user, status='available', capacity=options['capacity'], available_since=start)
+
+        # Evening rush: arrivals peak at 40% of the evening, 8 to 25 minutes in the kitchen
+        span = options['hours'] * 3600
+        ready_at = []
+        orders = []
+        for i in range(options['orders']):
+            ready_at.append(rng.triangular(0, span, span * 0.4) + rng.uniform(8 * 60, 25 * 60))
+            # A few addresses no zone recognizes: delivered alone
+            address = "Adresse inconnue" if rng.random() < 0.05 else f"12 rue sim-{token}-{rng.randrange(len(zones))}-"
+            orders.append(Order(
+                customer_phone=f"05{i:08d}", customer_name="Simulation", customer_address=address,
+                total_price=1000, status='preparing',
+            ))
+        orders = Order.objects.bulk_create(orders)
+        ready = sorted(zip(ready_at, (order.pk for order in orders)))
+        ready_time = {pk: start + timedelta(seconds=offset) for offset, pk in ready}
+
+        trips = []
+        batches = []
+        round_times = []
+        decision_times = []
+        t = 0
+        delivered = 0
+        while delivered < len(orders) and t < span + 6 * 3600:
+            now = start + timedelta(seconds=t)
+            due = []
+            while ready and ready[0][0] <= t:
+                due.append(heapq.heappop(ready)[1])
+            if due:
+                Order.objects.filter(pk__in=due).update(status='ready')
+            back = []
+            while trips and trips[0][0] <= t:
+                back.extend(heapq.heappop(trips)[1])
+            if back:
+                delivered += Order.objects.filter(pk__in=back).update(status='delivered')
+
+            began = time.perf_counter()
+            assigned = dispatch_round(now, options['batch_wait'])
+            elapsed = time.perf_counter() - began
+            round_times.append(elapsed)
+            if assigned:
+                decision_times.append(elapsed / len(assigned))
+            for courier, jobs in assigned:
+                # Out and back, plus a few minutes per door
+                trip = rng.uniform(10 * 60, 20 * 60) + 3 * 60 * len(jobs)
+                heapq.heappush(trips, (t + trip, [job.order_id for job in jobs]))
+                batches.append((courier.pk, len(jobs)))
+            t += options['tick']
+            if not ready and not trips and not DeliveryJob.objects.filter(status='queued').exists():
+                break
+
+        latencies = sorted(
+            (assigned_at - ready_time[order_id]).total_seconds() / 60
+            for order_id, assigned_at in DeliveryJob.objects.filter(
+                order__in=orders, assigned_at__isnull=False,
+            ).values_list('order_id', 'assigned_at')
+        )
+        return latencies, batches, round_times, decision_times, len(orders)
+
+    def report(self, options, latencies, batches, round_times, decision_times, total):
+        if not latencies:
+            self.stdout.write(self.style.WARNING("No order was dispatched"))
+            return
+        per_courier = {}
+        for courier, size in batches:
+            per_courier[courier] = per_courier.get(courier, 0) + size
+        loads = sorted(per_courier.values())
+        round_times = sorted(round_times)
+        decision_times = sorted(decision_times)
+        self.stdout.write(
+            f"{total} orders, {options['couriers']} couriers, {options['zones']} zones: "
+            f"{len(latencies)} dispatched in {len(batches)} trips "
+            f"({len(latencies) / len(batches):.1f} orders per trip)"
+        )
+        self.stdout.write(
+            "dispatch latency (ready → courier): "
+            + ", ".join(f"p{p} {percentile(latencies, p):.1f} min" for p in (50, 90, 99))
+            + f", max {latencies[-1]:.1f} min"
+        )
+        self.stdout.write(f"orders per courier: min {loads[0]}, max {loads[-1]}")
+        self.stdout.write(
+            f"dispatcher round: p50 {percentile(round_times, 50) * 1000:.1f} ms, "
+            f"p99 {percentile(round_times, 99) * 1000:.1f} ms ({len(round_times)} rounds), "
+            f"{percentile(decision_times, 50) * 1000:.1f} ms per trip assigned"
+        )
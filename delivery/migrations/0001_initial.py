@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('restaurant', '0009_archivedorder'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Zone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('keywords', models.TextField(help_text='Quartiers et rues de la zone, séparés par des virgules')),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Courier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('offline', 'Hors service'), ('available', 'Disponible'), ('delivering', 'En livraison')], default='offline', max_length=20)),
+                ('capacity', models.PositiveSmallIntegerField(default=3, help_text='Commandes emportées par tournée')),
+                ('active_jobs', models.PositiveIntegerField(default=0, editable=False)),
+                ('jobs_done', models.PositiveIntegerField(default=0, editable=False)),
+                ('available_since', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='courier', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['user__username'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DeliveryJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'En attente'), ('assigned', 'Assignée'), ('done', 'Terminée')], default='queued', max_length=20)),
+                ('queued_at', models.DateTimeField()),
+                ('assigned_at', models.DateTimeField(blank=True, null=True)),
+                ('done_at', models.DateTimeField(blank=True, null=True)),
+                ('courier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='delivery.courier')),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_job', to='restaurant.order')),
+                ('zone', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='delivery.zone')),
+            ],
+            options={
+                'ordering': ['-queued_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='courier',
+            index=models.Index(fields=['status', 'available_since'], name='courier_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryjob',
+            index=models.Index(fields=['status', 'queued_at'], name='job_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryjob',
+            index=models.Index(fields=['status', 'zone', 'queued_at'], name='job_zone_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryjob',
+            index=models.Index(fields=['courier', 'status'], name='job_courier_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0001_initial'),
+        ('restaurant', '0009_archivedorder'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deliveryjob',
+            name='order',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='delivery_job', to='restaurant.order'),
+        ),
+    ]
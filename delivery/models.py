@@ -1,3 +1,83 @@
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class Zone(models.Model):
+    """Delivery area, recognized from the words of the customer address"""
+    name = models.CharField(max_length=100, unique=True)
+    keywords = models.TextField(help_text="Quartiers et rues de la zone, séparés par des virgules")
+
+    def __str__(self):
+        return self.name
+
+    def keyword_list(self):
+        return [word.strip().lower() for word in self.keywords.split(',') if word.strip()]
+
+    class Meta:
+        ordering = ['name']
+
+
+class Courier(models.Model):
+    """Delivery person (an admin user) and their availability for the dispatcher"""
+    STATUS_CHOICES = [
+        ('offline', 'Hors service'),
+        ('available', 'Disponible'),
+        ('delivering', 'En livraison'),
+    ]
+
+    user = models.OneToOneField('auth.User', on_delete=models.CASCADE, related_name='courier')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='offline')
+    capacity = models.PositiveSmallIntegerField(default=3, help_text="Commandes emportées par tournée")
+    # Jobs assigned and not closed yet (maintained by delivery.dispatch)
+    active_jobs = models.PositiveIntegerField(default=0, editable=False)
+    jobs_done = models.PositiveIntegerField(default=0, editable=False)
+    # Back at the restaurant since: the dispatcher serves the longest waiting first
+    available_since = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.user.get_full_name() or self.user.get_username()
+
+    class Meta:
+        ordering = ['user__username']
+        indexes = [
+            # Next free courier: first row of the index
+            models.Index(fields=['status', 'available_since'], name='courier_queue_idx'),
+        ]
+
+
+class DeliveryJob(models.Model):
+    """A ready order waiting for, or carried by, a courier"""
+    STATUS_CHOICES = [
+        ('queued', 'En attente'),
+        ('assigned', 'Assignée'),
+        ('done', 'Terminée'),
+    ]
+
+    # Kept, detached from its order, when the order is archived
+    order = models.OneToOneField(
+        'restaurant.Order', on_delete=models.SET_NULL, blank=True, null=True, related_name='delivery_job',
+    )
+    zone = models.ForeignKey(Zone, on_delete=models.SET_NULL, blank=True, null=True, related_name='jobs')
+    courier = models.ForeignKey(Courier, on_delete=models.SET_NULL, blank=True, null=True, related_name='jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    queued_at = models.DateTimeField()
+    assigned_at = models.DateTimeField(blank=True, null=True)
+    done_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        if self.order_id is None:
+            return "Livraison d'une commande archivée"
+        return f"Livraison de la commande #{self.order_id}"
+
+    class Meta:
+        ordering = ['-queued_at']
+        # Each dispatch decision reads the first rows of one of these
+        indexes = [
+            # Head of the queue
+            models.Index(fields=['status', 'queued_at'], name='job_queue_idx'),
+            # Head of the queue of a zone (batches)
+            models.Index(fields=['status', 'zone', 'queued_at'], name='job_zone_queue_idx'),
+            # Jobs of a courier
+            models.Index(fields=['courier', 'status'], name='job_courier_idx'),
+        ]
@@ -1,3 +1,195 @@
+import io
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from restaurant.archive import archive_batch
+from restaurant.models import Order
+from restaurant.queryplans import HotQuery, check_plans
+from restaurant.workflow import transition_orders
+
+from .dispatch import (
+    courier_queue, dispatch, dispatch_round, enqueue_ready_orders, job_queue, release_couriers,
+    zone_for_address, zone_keywords,
+)
+from .models import Courier, DeliveryJob, Zone
+
+
+class DispatchMixin:
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.centre = Zone.objects.create(name='Centre', keywords='Front de mer, Place d’Armes')
+        cls.senia = Zone.objects.create(name='Es Sénia', keywords='es senia, Aéroport')
+        cls.start = timezone.now() - timedelta(hours=1)
+
+    def courier(self, name, capacity=3, minutes=0):
+        return Courier.objects.create(
+            user=User.objects.create_user(name), status='available', capacity=capacity,
+            available_since=self.start + timedelta(minutes=minutes),
+        )
+
+    def ready(self, address='12 Front de Mer', count=1):
+        return [
+            Order.objects.create(
+                customer_phone='0550000000', customer_address=address,
+                total_price=Decimal('900.00'), status='ready',
+            )
+            for _ in range(count)
+        ]
+
+
+class ZoneTests(DispatchMixin, TestCase):
+
+    def test_address_words_without_case_or_accents(self):
+        keywords = zone_keywords()
+        self.assertEqual(zone_for_address('3 rue de la PLACE D’ARMES', keywords), self.centre.pk)
+        self.assertEqual(zone_for_address('Cité 200 logts, Es-Senia / ES SÉNIA', keywords), self.senia.pk)
+        self.assertIsNone(zone_for_address('Bir El Djir', keywords))
+        self.assertIsNone(zone_for_address(None, keywords))
+
+
+class DispatchTests(DispatchMixin, TestCase):
+
+    def test_ready_orders_are_queued_once(self):
+        queued = self.ready() + self.ready('Aéroport')
+        # Pickup, assigned by hand, still in the kitchen
+        self.ready('')
+        Order.objects.filter(pk=self.ready()[0].pk).update(delivery_person=User.objects.create_user('ali'))
+        Order.objects.create(customer_phone='0550000000', customer_address='Front de mer', total_price=1)
+
+        self.assertEqual(enqueue_ready_orders(), 2)
+        self.assertEqual(enqueue_ready_orders(), 0)
+        jobs = DeliveryJob.objects.order_by('order_id')
+        self.assertEqual([job.order_id for job in jobs], [order.pk for order in queued])
+        self.assertEqual([job.zone_id for job in jobs], [self.centre.pk, self.senia.pk])
+
+    def test_batches_by_zone_to_the_longest_waiting_courier(self):
+        first, second = self.courier('karim', minutes=0), self.courier('nadia', capacity=2, minutes=5)
+        centre = self.ready(count=4)
+        senia = self.ready('Es Senia', count=2)
+        enqueue_ready_orders()
+
+        batches = dispatch(batch_wait=0)
+        self.assertEqual(
+            [(courier.pk, [job.order_id for job in jobs]) for courier, jobs in batches],
+            [(first.pk, [o.pk for o in centre[:3]]), (second.pk, [centre[3].pk])],
+        )
+        self.assertEqual(Order.objects.filter(delivery_person=first.user).count(), 3)
+        self.assertEqual(
+            dict(Courier.objects.values_list('pk', 'active_jobs')), {first.pk: 3, second.pk: 1},
+        )
+        # Nobody is left at the restaurant
+        self.assertEqual(job_queue(self.senia.pk).count(), len(senia))
+        self.assertEqual(dispatch(batch_wait=0), [])
+
+    def test_partial_batch_waits_for_its_zone(self):
+        self.courier('karim')
+        self.ready(count=2)
+        enqueue_ready_orders(self.start)
+        # Two orders for three seats: held while young, sent once too old
+        self.assertEqual(dispatch(self.start + timedelta(seconds=60), batch_wait=120), [])
+        [(courier, jobs)] = dispatch(self.start + timedelta(seconds=120), batch_wait=120)
+        self.assertEqual(len(jobs), 2)
+
+    def test_held_zone_does_not_block_the_others(self):
+        self.courier('karim')
+        self.ready()
+        unknown = self.ready('Bir El Djir')
+        enqueue_ready_orders(self.start)
+        # The unknown address goes alone, right away
+        [(courier, jobs)] = dispatch(self.start, batch_wait=120)
+        self.assertEqual([job.order_id for job in jobs], [unknown[0].pk])
+
+    def test_couriers_come_back_when_their_orders_are_closed(self):
+        courier = self.courier('karim')
+        orders = self.ready(count=2)
+        dispatch_round(batch_wait=0)
+        transition_orders([orders[0].pk], 'delivered')
+        self.assertEqual(release_couriers(), 1)
+        courier.refresh_from_db()
+        self.assertEqual((courier.status, courier.active_jobs), ('delivering', 1))
+
+        transition_orders([orders[1].pk], 'cancelled')
+        release_couriers()
+        courier.refresh_from_db()
+        self.assertEqual((courier.status, courier.active_jobs, courier.jobs_done), ('available', 0, 2))
+        self.assertFalse(DeliveryJob.objects.exclude(status='done').exists())
+
+    def test_queued_jobs_of_orders_taken_by_hand_are_closed(self):
+        orders = self.ready(count=2)
+        enqueue_ready_orders()
+        Order.objects.filter(pk=orders[0].pk).update(delivery_person=User.objects.create_user('ali'))
+        transition_orders([orders[1].pk], 'cancelled')
+        self.assertEqual(release_couriers(), 2)
+        self.courier('karim')
+        self.assertEqual(dispatch(batch_wait=0), [])
+
+    def test_archiving_keeps_the_jobs(self):
+        courier = self.courier('karim')
+        orders = self.ready(count=2)
+        dispatch_round(batch_wait=0)
+        transition_orders([orders[0].pk], 'delivered')
+        release_couriers()
+        # Archived while the second one is still on the road
+        Order.objects.filter(pk__in=[o.pk for o in orders]).update(status='delivered')
+        self.assertEqual(archive_batch(timezone.now()), 2)
+
+        jobs = DeliveryJob.objects.filter(courier=courier)
+        self.assertEqual([job.order_id for job in jobs], [None, None])
+        self.assertEqual(release_couriers(), 1)
+        courier.refresh_from_db()
+        self.assertEqual((courier.status, courier.active_jobs, courier.jobs_done), ('available', 0, 2))
+
+    def test_lost_race_ends_the_round(self):
+        self.courier('karim')
+        self.ready()
+        enqueue_ready_orders()
+        with patch('delivery.dispatch.assign', return_value=False) as assign:
+            self.assertEqual(dispatch(batch_wait=0), [])
+        self.assertEqual(assign.call_count, 1)
+        # Retried by the next round
+        self.assertEqual(len(dispatch(batch_wait=0)), 1)
+
+    def test_decisions_do_not_depend_on_the_queue_length(self):
+        def queries(orders):
+            DeliveryJob.objects.all().delete()
+            Order.objects.all().delete()
+            Courier.objects.all().delete()
+            self.courier(f'livreur{orders}')
+            self.ready(count=orders)
+            enqueue_ready_orders()
+            with CaptureQueriesContext(connection) as ctx:
+                [(courier, jobs)] = dispatch(batch_wait=0)
+            self.assertEqual(len(jobs), 3)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(queries(3), queries(300))
+
+    def test_queue_reads_use_the_indexes(self):
+        failures = check_plans([
+            HotQuery('next courier', courier_queue()[:1], limited=True),
+            HotQuery('queue head', job_queue(held={self.centre.pk})[:1], limited=True),
+            HotQuery('zone batch', job_queue(self.centre.pk)[:3], limited=True),
+            HotQuery('courier jobs', DeliveryJob.objects.filter(courier_id=1, status='assigned')),
+        ])
+        self.assertFalse(failures, failures)
+
+
+class SimulateDispatchTests(DispatchMixin, TestCase):
 
-# Create your tests here.
+    def test_reports_percentiles_and_rolls_back(self):
+        out = io.StringIO()
+        call_command('simulate_dispatch', orders=40, couriers=3, zones=2, hours=1, tick=30, stdout=out)
+        output = out.getvalue()
+        self.assertIn('40 orders, 3 couriers, 2 zones: 40 dispatched', output)
+        self.assertRegex(output, r'p50 [\d.]+ min, p90 [\d.]+ min, p99 [\d.]+ min')
+        self.assertEqual(Zone.objects.count(), 2)
+        self.assertFalse(Courier.objects.exists() or Order.objects.exists())
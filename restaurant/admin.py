@@ -1,10 +1,28 @@
-from django.contrib import admin
+import copy
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.templatetags.admin_list import result_hidden_fields, results
+from django.db.models import Prefetch, Q
+from django.forms.models import ModelChoiceIterator
+from django.http import JsonResponse
+from django.shortcuts import redirect
+from django.urls import path
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.pagination import KeysetPaginationMixin
+
 from .models import (
     Category, Product, IngredientCategory, Ingredient, 
     SpecialMeal, SpecialMealIngredient, Order, OrderItem,
     OrderSpecialMeal, OrderSpecialMealIngredient,
-    Cart, CartItem, CartSpecialMeal, CartSpecialMealIngredient
+    Cart, CartItem, CartSpecialMeal, ImageJob, ArchivedOrder
 )
+from .orders import refresh_summary
+from .workflow import TRANSITIONS, transition_orders
 
 
 @admin.register(Category)
@@ -48,34 +66,96 @@ class SpecialMealAdmin(admin.ModelAdmin):
     inlines = [SpecialMealIngredientInline]
 
 
-class OrderItemInline(admin.TabularInline):
+# Related rows read by the choice labels (``Ingredient.__str__`` shows its category)
+CHOICE_SELECT_RELATED = {Ingredient: ('category',)}
+
+
+class SharedChoiceIterator(ModelChoiceIterator):
+    """Choices of a select, read on first use and shared by every copy of the field"""
+
+    def __init__(self, field, store):
+        super().__init__(field)
+        self.store = store
+
+    def choices(self):
+        if 'choices' not in self.store:
+            self.store['choices'] = list(super().__iter__())
+        return self.store['choices']
+
+    def __iter__(self):
+        return iter(self.choices())
+
+    def __len__(self):
+        return len(self.choices())
+
+    def __bool__(self):
+        return bool(self.choices())
+
+
+class SharedChoicesMixin:
+    """
+    Foreign key selects whose choices are read once per request, instead of
+    once per row of a list-editable changelist or an inline formset.
+    """
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if (formfield is None or request is None
+                or db_field.name in self.raw_id_fields or db_field.name in self.autocomplete_fields):
+            return formfield
+        related = CHOICE_SELECT_RELATED.get(db_field.related_model)
+        if related:
+            formfield.queryset = formfield.queryset.select_related(*related)
+        stores = request.__dict__.setdefault('_admin_choices', {})
+        store = stores.setdefault((db_field.model, db_field.name), {})
+        formfield.iterator = partial(SharedChoiceIterator, store=store)
+        formfield.widget.choices = formfield.choices
+        return formfield
+
+
+class OrderItemInline(SharedChoicesMixin, admin.TabularInline):
     model = OrderItem
     extra = 0
     readonly_fields = ['total_price']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
 
-class OrderSpecialMealIngredientInline(admin.StackedInline):
+
+class OrderSpecialMealIngredientInline(SharedChoicesMixin, admin.StackedInline):
     model = OrderSpecialMealIngredient
     extra = 0
-    
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient__category')
+
 
 from django.utils.html import format_html, format_html_join
 
 
-class OrderSpecialMealInline(admin.StackedInline):
+class OrderSpecialMealInline(SharedChoicesMixin, admin.StackedInline):
     model = OrderSpecialMeal
     extra = 0
     readonly_fields = ['total_price', 'show_ingredients']
     fields = ('special_meal', 'quantity', 'total_price', 'show_ingredients')
     show_change_link = True
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('special_meal').prefetch_related(
+            Prefetch(
+                'selected_ingredients',
+                queryset=OrderSpecialMealIngredient.objects.select_related('ingredient'),
+            )
+        )
+
     def show_ingredients(self, obj):
         if not obj.pk:
             return "-"
 
+        # Prefetched by get_queryset
         ingredients = obj.selected_ingredients.all()
 
-        if not ingredients.exists():
+        if not ingredients:
             return "— No ingredients —"
 
         return format_html(
@@ -100,8 +180,42 @@ class OrderSpecialMealInline(admin.StackedInline):
     show_ingredients.short_description = "Selected Ingredients"
 
 
+class OrderSearchMixin:
+    """Search of the order lists"""
+
+    def get_search_results(self, request, queryset, search_term):
+        # A number is a phone prefix or an order id: both indexed, where
+        # the default "contains" search reads every row
+        term = search_term.strip().replace(' ', '')
+        digits = term.lstrip('+')
+        if digits.isdigit():
+            matches = Q(customer_phone__startswith=term)
+            if len(digits) < 19:  # fits a bigint
+                matches |= Q(pk=int(digits))
+            return queryset.filter(matches), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+def status_action(status):
+    """Admin action moving the selected orders to ``status`` (see restaurant/workflow.py)"""
+    label = dict(Order.STATUS_CHOICES)[status]
+
+    @admin.action(description=f"Passer à « {label} »", permissions=['change'])
+    def action(modeladmin, request, queryset):
+        changed, updated_at = transition_orders(queryset, status)
+        if changed:
+            modeladmin.message_user(request, f"{len(changed)} commande(s) passée(s) à « {label} »")
+        else:
+            modeladmin.message_user(
+                request, f"Aucune commande sélectionnée ne peut passer à « {label} »", messages.WARNING,
+            )
+
+    action.__name__ = f'mark_{status}'
+    return action
+
+
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(KeysetPaginationMixin, OrderSearchMixin, SharedChoicesMixin, admin.ModelAdmin):
     save_on_top = True   
 
     list_display = [
@@ -122,36 +236,140 @@ class OrderAdmin(admin.ModelAdmin):
     list_editable = ['delivery_person','status']
 
     inlines = [OrderItemInline, OrderSpecialMealInline]
+    # One UPDATE for all the selected orders, legal transitions only
+    actions = [status_action(status) for status in TRANSITIONS]
 
+    # Changelist parameters that do not filter rows, dropped by the feed
+    FEED_IGNORED_PARAMS = ('since', 'p', 'after', 'before', '_changelist_filters')
+    TRANSITION_MAX_ORDERS = 500
 
-    def order_summary(self, obj):
-        # Regular products
-        item_lines = [
-            f"{i.quantity}x {i.product.name}"
-            for i in obj.items.all()
-        ]
-
-        # Special meals with ingredients
-        special_lines = []
-        for sm in obj.special_meals.all():
-
-            ingredients = ", ".join(
-                f"{ing.quantity}x {ing.ingredient.name}"
-                for ing in sm.selected_ingredients.all()
-            )
-
-            if ingredients:
-                notes_text = f" (Note: {sm.notes})" if sm.notes else ""
-                special_lines.append(
-                    f"{sm.quantity}x {sm.special_meal.name} "
-                    f"[{ingredients}]{notes_text}"
-                )
-            else:
-                special_lines.append(
-                    f"{sm.quantity}x {sm.special_meal.name}"
-                )
+    def get_urls(self):
+        feed = path(
+            'feed/', self.admin_site.admin_view(self.feed_view), name='restaurant_order_feed',
+        )
+        transition = path(
+            'transition/', self.admin_site.admin_view(self.transition_view),
+            name='restaurant_order_transition',
+        )
+        return [feed, transition] + super().get_urls()
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        feed_ids = getattr(request, 'order_feed_ids', None)
+        if feed_ids is not None:
+            queryset = queryset.filter(pk__in=feed_ids)
+        return queryset
+
+    def changelist_view(self, request, extra_context=None):
+        # The feed reads from ORDER_FEED_GRACE seconds before it (feed_view)
+        extra_context = {**(extra_context or {}), 'order_feed_cursor': timezone.now().isoformat()}
+        return super().changelist_view(request, extra_context)
+
+    def _get_obj_does_not_exist_redirect(self, request, opts, object_id):
+        # Archived orders keep their id and their admin links
+        if object_id.isdigit() and ArchivedOrder.objects.filter(pk=object_id).exists():
+            return redirect('admin:restaurant_archivedorder_change', object_id)
+        return super()._get_obj_does_not_exist_redirect(request, opts, object_id)
+
+    def feed_view(self, request):
+        """
+        Orders created or updated after ``?since=``, rendered as changelist
+        rows for the filters of the page (its other query parameters), so
+        ``order_auto_refresh.js`` patches the table instead of reloading it.
+        List-editable fields are named ``form-__prefix__-<field>``.
+
+        ``updated_at`` and ``created_at`` are stamped before the write
+        commits, so the read goes back ``ORDER_FEED_GRACE`` seconds: a row
+        committed after the previous poll is sent, maybe twice.
+        """
+        if not self.has_view_or_change_permission(request):
+            return JsonResponse({'error': 'forbidden'}, status=403)
+        try:
+            since = parse_datetime(request.GET.get('since', ''))
+            if since is not None:
+                since -= timedelta(seconds=getattr(settings, 'ORDER_FEED_GRACE', 5))
+        except (ValueError, OverflowError):
+            # Well formed but out of range
+            since = None
+        if since is None:
+            return JsonResponse({'error': 'since'}, status=400)
+
+        cursor = timezone.now()
+        changed = list(
+            Order.objects.filter(updated_at__gt=since).order_by('updated_at')
+            .values_list('pk', 'created_at')[:self.list_per_page + 1]
+        )
+        if len(changed) > self.list_per_page:
+            return JsonResponse({'cursor': cursor.isoformat(), 'reload': True})
+        if not changed:
+            return JsonResponse({'cursor': cursor.isoformat(), 'rows': [], 'removed': []})
+
+        feed_request = copy.copy(request)
+        feed_request.GET = request.GET.copy()
+        for param in self.FEED_IGNORED_PARAMS:
+            feed_request.GET.pop(param, None)
+        feed_request.order_feed_ids = [pk for pk, created_at in changed]
+        cl = self.get_changelist_instance(feed_request)
+        cl.formset = None
+        if self.list_editable:
+            FormSet = self.get_changelist_formset(feed_request)
+            cl.formset = FormSet(queryset=cl.result_list)
+
+        hidden = list(result_hidden_fields(cl))
+        created = dict(changed)
+        rows = []
+        for index, (order, cells) in enumerate(zip(cl.result_list, results(cl))):
+            prefix = f'form-{index}-'
+            rows.append({
+                'id': order.pk,
+                'created': created[order.pk] > since,
+                'html': ''.join(cells).replace(prefix, 'form-__prefix__-'),
+                'hidden': str(hidden[index]).replace(prefix, 'form-__prefix__-') if hidden else '',
+            })
+        shown = {row['id'] for row in rows}
+        return JsonResponse({
+            'cursor': cursor.isoformat(),
+            'rows': rows,
+            'removed': [pk for pk in created if pk not in shown],
+        })
+
+    def transition_view(self, request):
+        """
+        ``POST ids=3,4,5&status=ready``: moves the orders whose transition is
+        legal in one UPDATE and answers the ids that changed.
+        """
+        if request.method != 'POST':
+            return JsonResponse({'error': 'method'}, status=405)
+        if not self.has_change_permission(request):
+            return JsonResponse({'error': 'forbidden'}, status=403)
+        status = request.POST.get('status', '')
+        try:
+            ids = {
+                int(pk) for value in request.POST.getlist('ids') for pk in value.split(',') if pk.strip()
+            }
+        except ValueError:
+            return JsonResponse({'error': 'ids'}, status=400)
+        if not ids or len(ids) > self.TRANSITION_MAX_ORDERS:
+            return JsonResponse({'error': 'ids'}, status=400)
+        if status not in TRANSITIONS:
+            return JsonResponse({'error': 'status'}, status=400)
+
+        changed, updated_at = transition_orders(sorted(ids), status)
+        return JsonResponse({
+            'status': status,
+            'updated_at': updated_at.isoformat(),
+            'changed': changed,
+            'unchanged': sorted(ids.difference(changed)),
+        })
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # The lines may have been edited in the inlines
+        refresh_summary(form.instance)
 
-        lines = item_lines + special_lines
+    def order_summary(self, obj):
+        # Written with the order: no query per row
+        lines = [line['text'] for line in obj.summary.get('lines', [])]
 
         if not lines:
             return "—"
@@ -168,11 +386,46 @@ class OrderAdmin(admin.ModelAdmin):
     class Media:
         js = ("admin/order_auto_refresh.js",)
 
+
 @admin.register(OrderSpecialMeal)
-class OrderSpecialMealAdmin(admin.ModelAdmin):
+class OrderSpecialMealAdmin(SharedChoicesMixin, admin.ModelAdmin):
     list_display = ['order', 'special_meal', 'quantity', 'total_price']
+    # A select of every order ever placed would not scale
+    raw_id_fields = ['order']
     inlines = [OrderSpecialMealIngredientInline]
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        refresh_summary(form.instance.order)
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(KeysetPaginationMixin, OrderSearchMixin, admin.ModelAdmin):
+    """Read-only: orders are archived by manage.py archive_orders"""
+    list_display = [
+        'id', 'customer_phone', 'customer_name', 'order_summary', 'total_price',
+        'delivery_person', 'status', 'created_at', 'archived_at',
+    ]
+    list_filter = ['status', 'created_at']
+    search_fields = ['customer_phone', 'customer_name']
+    list_select_related = ['delivery_person']
+    readonly_fields = ['order_summary']
+    exclude = ['summary', 'lines']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def order_summary(self, obj):
+        lines = [line['text'] for line in obj.summary.get('lines', [])]
+        if not lines:
+            return "—"
+        return format_html_join(format_html("<br>"), "{}", ((line,) for line in lines))
+
+    order_summary.short_description = "Order Items"
+
 
 class CartItemInline(admin.TabularInline):
     model = CartItem
@@ -186,6 +439,24 @@ class CartSpecialMealInline(admin.TabularInline):
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ['session_key', 'created_at', 'get_total']
-    readonly_fields = ['created_at', 'updated_at']
-    inlines = [CartItemInline, CartSpecialMealInline]
\ No newline at end of file
+    list_display = ['session_key', 'created_at', 'get_total', 'items_count']
+    readonly_fields = ['total_price', 'items_count', 'created_at', 'updated_at']
+    inlines = [CartItemInline, CartSpecialMealInline]
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'model', 'object_id', 'source', 'status', 'attempts', 'run_after', 'updated_at']
+    list_filter = ['status', 'model']
+    readonly_fields = [field.name for field in ImageJob._meta.fields]
+    actions = ['retry_jobs']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Relancer les tâches sélectionnées")
+    def retry_jobs(self, request, queryset):
+        updated = queryset.exclude(status='running').update(
+            status='pending', attempts=0, run_after=timezone.now(), last_error='',
+        )
+        self.message_user(request, f"{updated} tâche(s) relancée(s)")
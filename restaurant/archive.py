@@ -0,0 +1,129 @@
+"""
+Archival of completed orders.
+
+Delivered and cancelled orders older than ``RESTAURANT_ARCHIVE_AFTER_DAYS``
+are moved from ``Order`` and its line tables into ``ArchivedOrder``: one
+row per order, with its id, its summary and its lines as JSON::
+
+    {'items': [{'product': 3, 'quantity': 2, 'unit_price': '350.00',
+                'total_price': '700.00', 'notes': None}],
+     'special_meals': [{'special_meal': 1, 'quantity': 1, 'base_price': '400.00',
+                        'total_price': '480.00', 'notes': 'Bien cuit',
+                        'ingredients': [{'ingredient': 7, 'quantity': 2,
+                                         'unit_price': '20.00'}]}]}
+
+Orders move ``RESTAURANT_ARCHIVE_BATCH`` at a time, each batch in its own
+short transaction, so the checkout and the admin never wait long for the
+write lock; ``manage.py archive_orders`` runs the batches with a pause in
+between.
+
+``find_order(pk)`` returns the order or its archived copy, for the pages
+that look orders up by id.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from core.counts import adjust_count
+
+from .models import ArchivedOrder, Order, OrderItem, OrderSpecialMeal, OrderSpecialMealIngredient
+from .orders import lines_summary
+
+ARCHIVE_STATUSES = ('delivered', 'cancelled')
+LINES_PREFETCH = (
+    Prefetch('items', queryset=OrderItem.objects.select_related('product')),
+    Prefetch(
+        'special_meals',
+        queryset=OrderSpecialMeal.objects.select_related('special_meal').prefetch_related(
+            Prefetch(
+                'selected_ingredients',
+                queryset=OrderSpecialMealIngredient.objects.select_related('ingredient'),
+            )
+        ),
+    ),
+)
+
+
+def archive_cutoff(days=None):
+    if days is None:
+        days = getattr(settings, 'RESTAURANT_ARCHIVE_AFTER_DAYS', 90)
+    return timezone.now() - timedelta(days=days)
+
+
+def archivable_orders(cutoff):
+    # Read through the (status, created_at) index
+    return Order.objects.filter(status__in=ARCHIVE_STATUSES, created_at__lt=cutoff).order_by()
+
+
+def archived_copy(order):
+    """``ArchivedOrder`` of an order whose lines are prefetched (``LINES_PREFETCH``)"""
+    items = order.items.all()
+    specials = order.special_meals.all()
+    return ArchivedOrder(
+        id=order.id,
+        customer_phone=order.customer_phone,
+        customer_name=order.customer_name,
+        customer_address=order.customer_address,
+        total_price=order.total_price,
+        additional_notes=order.additional_notes,
+        status=order.status,
+        delivery_person_id=order.delivery_person_id,
+        summary=lines_summary(items, specials),
+        lines={
+            'items': [{
+                'product': item.product_id,
+                'quantity': item.quantity,
+                'unit_price': str(item.unit_price),
+                'total_price': str(item.total_price),
+                'notes': item.notes,
+            } for item in items],
+            'special_meals': [{
+                'special_meal': special.special_meal_id,
+                'quantity': special.quantity,
+                'base_price': str(special.base_price),
+                'total_price': str(special.total_price),
+                'notes': special.notes,
+                'ingredients': [{
+                    'ingredient': ing.ingredient_id,
+                    'quantity': ing.quantity,
+                    'unit_price': str(ing.unit_price),
+                } for ing in special.selected_ingredients.all()],
+            } for special in specials],
+        },
+        created_at=order.created_at,
+        updated_at=order.updated_at,
+    )
+
+
+def archive_batch(cutoff, batch_size=None):
+    """Archive up to ``batch_size`` orders completed before ``cutoff``; returns how many"""
+    batch_size = batch_size or getattr(settings, 'RESTAURANT_ARCHIVE_BATCH', 500)
+    # Picked outside of the transaction: only the move holds the write lock
+    pks = list(archivable_orders(cutoff).values_list('pk', flat=True)[:batch_size])
+    if not pks:
+        return 0
+    with transaction.atomic():
+        # Checked again: an order may have been reopened in the meantime
+        orders = list(
+            archivable_orders(cutoff).filter(pk__in=pks)
+            .select_for_update(skip_locked=True).prefetch_related(*LINES_PREFETCH)
+        )
+        archived = [order.pk for order in orders]
+        ArchivedOrder.objects.bulk_create([archived_copy(order) for order in orders])
+        # Lines first: they have no signal receivers, so each is one DELETE. The
+        # delivery jobs stay as dispatch history, their order set to NULL.
+        OrderSpecialMealIngredient.objects.filter(order_special_meal__order__in=archived).delete()
+        OrderSpecialMeal.objects.filter(order__in=archived).delete()
+        OrderItem.objects.filter(order__in=archived).delete()
+        Order.objects.filter(pk__in=archived).delete()
+        # bulk_create sends no post_save (see core/counts.py)
+        adjust_count(ArchivedOrder, len(archived))
+    return len(archived)
+
+
+def find_order(pk):
+    """The order ``pk``, or its archived copy; ``None`` if there is neither"""
+    return Order.objects.filter(pk=pk).first() or ArchivedOrder.objects.filter(pk=pk).first()
@@ -0,0 +1,670 @@
+"""
+Cart backends.
+
+Views never touch ``Cart`` rows directly: they call ``get_cart(request)`` and
+use the common interface of ``BaseCart``:
+
+    cart.lines()            (product lines, special meal lines)
+    cart.total, cart.count, cart.is_empty
+    cart.add_product(product, quantity)
+    cart.add_special_meal(customization)
+    cart.update_quantity(line_type, line_id, quantity)
+    cart.remove(line_type, line_id)
+    cart.clear()
+    cart.apply(operations)   several of the above, all or nothing
+
+Product lines expose ``id``, ``product``, ``quantity`` and ``total_price``.
+Special meal lines expose ``id``, ``special_meal``, ``quantity``, ``notes``,
+``total_price`` and ``selected_ingredients.all()`` (each with ``ingredient``
+and ``quantity``), so templates and the order pipeline work the same with
+``CartItem``/``CartSpecialMeal`` rows and with session lines.
+
+The backend is chosen with the ``RESTAURANT_CART_BACKEND`` setting:
+
+``restaurant.cart.SessionCart`` (default)
+    Lines live in the session in a compact form. Browsing never writes to
+    the database; ``Cart`` rows are only written by ``mirror_to_db()`` when
+    ``RESTAURANT_CART_ADMIN_MIRROR`` is enabled, so staff can look at carts
+    that reached the checkout page.
+
+``restaurant.cart.DatabaseCart``
+    The historical behaviour: one ``Cart`` row per session, with
+    ``CartItem``/``CartSpecialMeal`` rows.
+
+Both backends are lazy: reading a cart that was never written renders an
+empty cart without creating a session or a ``Cart`` row. Those are only
+created by the first mutation. Requests whose user agent looks like a
+crawler (``RESTAURANT_BOT_USER_AGENTS``) get a read-only cart and never
+create either. The reads served without a stored cart are counted, see
+``avoided_writes()``.
+"""
+import copy
+import re
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.utils.module_loading import import_string
+
+from .catalog import get_catalog
+from .pricing import PRODUCT, from_cents, get_price_table
+from .models import Cart, CartItem, CartSpecialMeal, CartSpecialMealIngredient
+
+DEFAULT_BOT_USER_AGENTS = (
+    r'bot|crawl|spider|slurp|mediapartners|facebookexternalhit|whatsapp|'
+    r'embedly|bingpreview|lighthouse|headlesschrome|curl|wget|python-requests'
+)
+AVOIDED_KINDS = ('sessions', 'carts', 'bot_reads')
+AVOIDED_KEY = 'restaurant:cart-avoided:{}'
+AVOIDED_FLUSH_INTERVAL = 30
+
+_bot_pattern = None
+
+
+class CartLineNotFound(LookupError):
+    """Raised when a cart line id does not belong to the cart"""
+
+
+class CartReadOnly(PermissionError):
+    """Raised when a crawler tries to modify a cart"""
+
+
+def is_bot(request):
+    """Whether the request comes from a crawler or a link preview fetcher"""
+    global _bot_pattern
+    pattern = getattr(settings, 'RESTAURANT_BOT_USER_AGENTS', DEFAULT_BOT_USER_AGENTS)
+    if _bot_pattern is None or _bot_pattern.pattern != pattern:
+        _bot_pattern = re.compile(pattern, re.IGNORECASE)
+    return bool(_bot_pattern.search(request.META.get('HTTP_USER_AGENT', '')))
+
+
+class AvoidedWrites:
+    """
+    Counters of the sessions and carts the lazy carts did not create.
+
+    Increments are kept in memory and added to the shared cache at most
+    every ``AVOIDED_FLUSH_INTERVAL`` seconds, so counting costs no I/O on
+    the request path.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = dict.fromkeys(AVOIDED_KINDS, 0)
+        self._flushed_at = time.monotonic()
+
+    def record(self, kinds):
+        with self._lock:
+            for kind in kinds:
+                self._pending[kind] += 1
+            due = time.monotonic() - self._flushed_at >= AVOIDED_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = dict.fromkeys(AVOIDED_KINDS, 0)
+            self._flushed_at = time.monotonic()
+        for kind, value in pending.items():
+            if not value:
+                continue
+            key = AVOIDED_KEY.format(kind)
+            if not cache.add(key, value, None):
+                try:
+                    cache.incr(key, value)
+                except ValueError:
+                    cache.set(key, value, None)
+
+    def totals(self):
+        """Flush this process and return the shared counters"""
+        self.flush()
+        return {kind: cache.get(AVOIDED_KEY.format(kind), 0) for kind in AVOIDED_KINDS}
+
+    def reset(self):
+        with self._lock:
+            self._pending = dict.fromkeys(AVOIDED_KINDS, 0)
+        cache.delete_many([AVOIDED_KEY.format(kind) for kind in AVOIDED_KINDS])
+
+
+avoided = AvoidedWrites()
+
+
+def avoided_writes():
+    """
+    Return ``{'sessions': n, 'carts': n, 'bot_reads': n}``: the cart reads
+    served without creating a session, without creating a cart, and among
+    them those made by crawlers.
+    """
+    return avoided.totals()
+
+
+class BaseCart:
+    """Common interface of the cart backends"""
+
+    def __init__(self, request):
+        self.request = request
+        self.is_bot = is_bot(request)
+        self._read_counted = False
+
+    @property
+    def stored(self):
+        """Whether this visitor already has a stored cart"""
+        raise NotImplementedError
+
+    def _count_read(self):
+        """Record, once per request, a read served without a stored cart"""
+        if self._read_counted or self.stored:
+            return
+        self._read_counted = True
+        kinds = ['carts']
+        if not self.request.session.session_key:
+            kinds.append('sessions')
+        if self.is_bot:
+            kinds.append('bot_reads')
+        avoided.record(kinds)
+
+    def _check_writable(self):
+        if self.is_bot:
+            raise CartReadOnly("Le panier n'est pas disponible pour ce navigateur")
+
+    def lines(self):
+        """Return ``(product_lines, special_meal_lines)``"""
+        raise NotImplementedError
+
+    @property
+    def items(self):
+        return self.lines()[0]
+
+    @property
+    def special_meals(self):
+        return self.lines()[1]
+
+    @property
+    def total(self):
+        items, specials = self.lines()
+        total = sum((item.total_price for item in items), Decimal('0.00'))
+        return total + sum((special.total_price for special in specials), Decimal('0.00'))
+
+    @property
+    def count(self):
+        items, specials = self.lines()
+        return len(items) + len(specials)
+
+    @property
+    def is_empty(self):
+        return self.count == 0
+
+    def add_product(self, product, quantity):
+        raise NotImplementedError
+
+    def add_special_meal(self, customization):
+        """Add a ``restaurant.catalog.Customization`` as a new line"""
+        raise NotImplementedError
+
+    def update_quantity(self, line_type, line_id, quantity):
+        raise NotImplementedError
+
+    def remove(self, line_type, line_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def apply(self, operations):
+        """
+        Apply mutations in order, all or nothing.
+
+        Each operation is ``('add', PRODUCT, product, quantity)``,
+        ``('add', SPECIAL, customization)``, ``('update', line_type,
+        line_id, quantity)`` or ``('remove', line_type, line_id)``.
+        """
+        for action, line_type, *args in operations:
+            if action == 'add':
+                if line_type == PRODUCT:
+                    self.add_product(*args)
+                else:
+                    self.add_special_meal(*args)
+            elif action == 'update':
+                self.update_quantity(line_type, *args)
+            elif action == 'remove':
+                self.remove(line_type, *args)
+            else:
+                raise ValueError(f'Opération inconnue: {action}')
+
+
+class DatabaseCart(BaseCart):
+    """
+    Cart stored as ``Cart``/``CartItem``/``CartSpecialMeal`` rows.
+
+    The ``Cart`` row is looked up on first use and only created, together
+    with the session, by ``cart`` (i.e. by the first mutation).
+    """
+
+    def __init__(self, request):
+        super().__init__(request)
+        self._lines = None
+        self._cart = None
+        self._looked_up = False
+
+    def _stored_cart(self):
+        if not self._looked_up:
+            self._looked_up = True
+            session_key = self.request.session.session_key
+            if session_key:
+                self._cart = Cart.objects.filter(session_key=session_key).first()
+        return self._cart
+
+    @property
+    def stored(self):
+        return self._stored_cart() is not None
+
+    @property
+    def cart(self):
+        """The ``Cart`` row, created with the session if needed"""
+        if self._stored_cart() is None:
+            self._check_writable()
+            session = self.request.session
+            if not session.session_key:
+                session.create()
+            self._cart, created = Cart.objects.get_or_create(session_key=session.session_key)
+        return self._cart
+
+    def lines(self):
+        if self._lines is None:
+            if self._stored_cart() is None:
+                self._count_read()
+                self._lines = ([], [])
+                return self._lines
+            items = list(self.cart.cart_items.select_related('product'))
+            specials = list(
+                self.cart.cart_special_meals.select_related('special_meal').prefetch_related(
+                    Prefetch(
+                        'selected_ingredients',
+                        queryset=CartSpecialMealIngredient.objects.select_related('ingredient'),
+                    )
+                )
+            )
+            self._lines = (items, specials)
+        return self._lines
+
+    @property
+    def total(self):
+        if self._stored_cart() is None:
+            self._count_read()
+            return Decimal('0.00')
+        return self._cart.total_price
+
+    @property
+    def count(self):
+        if self._stored_cart() is None:
+            self._count_read()
+            return 0
+        return self._cart.items_count
+
+    def add_product(self, product, quantity):
+        line_total = from_cents(get_price_table().product(product.id, quantity))
+        with transaction.atomic():
+            updated = CartItem.objects.filter(cart=self.cart, product=product).update(
+                quantity=F('quantity') + quantity,
+                total_price=F('total_price') + line_total,
+            )
+            if not updated:
+                CartItem.objects.create(cart=self.cart, product=product, quantity=quantity)
+            self.cart.adjust_totals(line_total, 0 if updated else 1)
+        self._lines = None
+
+    def add_special_meal(self, customization):
+        with transaction.atomic():
+            cart_special = CartSpecialMeal.objects.create(
+                cart=self.cart,
+                special_meal_id=customization.meal_id,
+                quantity=customization.quantity,
+                notes=customization.notes,
+                total_price=customization.total_price
+            )
+            CartSpecialMealIngredient.objects.bulk_create([
+                CartSpecialMealIngredient(
+                    cart_special_meal=cart_special,
+                    ingredient_id=ingredient_id,
+                    quantity=ing_quantity
+                )
+                for ingredient_id, ing_quantity in customization.selections
+            ])
+            self.cart.adjust_totals(customization.total_price, 1)
+        self._lines = None
+
+    def update_quantity(self, line_type, line_id, quantity):
+        if self._stored_cart() is None:
+            raise CartLineNotFound('Article introuvable')
+        with transaction.atomic():
+            try:
+                if line_type == PRODUCT:
+                    item = CartItem.objects.get(id=line_id, cart=self.cart)
+                    previous = item.total_price
+                    item.quantity = quantity
+                    item.save()
+                else:
+                    item = CartSpecialMeal.objects.prefetch_related(
+                        'selected_ingredients'
+                    ).get(id=line_id, cart=self.cart)
+                    previous = item.total_price
+                    item.quantity = quantity
+                    item.calculate_total()
+                    item.save()
+            except (CartItem.DoesNotExist, CartSpecialMeal.DoesNotExist, KeyError, ValueError):
+                # KeyError: no longer in the price table
+                raise CartLineNotFound('Article introuvable')
+            self.cart.adjust_totals(item.total_price - previous)
+        self._lines = None
+
+    def remove(self, line_type, line_id):
+        if self._stored_cart() is None:
+            return
+        model = CartItem if line_type == PRODUCT else CartSpecialMeal
+        with transaction.atomic():
+            line = model.objects.filter(id=line_id, cart=self.cart).only('total_price').first()
+            if line is None:
+                return
+            line.delete()
+            self.cart.adjust_totals(-line.total_price, -1)
+        self._lines = None
+
+    def clear(self):
+        if self._stored_cart() is None:
+            self._lines = ([], [])
+            return
+        with transaction.atomic():
+            self.cart.cart_items.all().delete()
+            self.cart.cart_special_meals.all().delete()
+            Cart.objects.filter(pk=self.cart.pk).update(total_price=0, items_count=0)
+        self.cart.total_price, self.cart.items_count = Decimal('0.00'), 0
+        self._lines = ([], [])
+
+    def apply(self, operations):
+        with transaction.atomic():
+            super().apply(operations)
+
+    def reconcile(self, fix=False):
+        if self._stored_cart() is None:
+            return Decimal('0.00'), 0
+        return self._cart.reconcile(fix=fix)
+
+
+class SessionLine:
+    """A cart line resolved from the session"""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class SelectedIngredients(list):
+    """List of ingredient selections that reads like a related manager"""
+
+    def all(self):
+        return self
+
+    def exists(self):
+        return bool(self)
+
+
+class SessionCart(BaseCart):
+    """
+    Cart stored in ``request.session[SESSION_KEY]``.
+
+    The stored value only holds ids and quantities::
+
+        {'n': next_line_id,
+         'p': [[line_id, product_id, quantity], ...],
+         's': [[line_id, meal_id, quantity, notes, [[ingredient_id, quantity], ...]], ...],
+         't': running_total}
+
+    Prices and names are resolved against the catalog snapshot when the
+    lines are read, without a query. The running
+    total and the line count are kept up to date by every mutation from the
+    price table, so neither the cart badge nor the mutations cost a query.
+    """
+    SESSION_KEY = 'cart'
+
+    def __init__(self, request):
+        super().__init__(request)
+        self._lines = None
+        self._deferred = False
+        # Without a session cookie there is nothing to load: do not even
+        # touch the session, so no session row gets created or read.
+        stored = request.session.get(self.SESSION_KEY) if request.session.session_key else None
+        self._stored = bool(stored)
+        self.data = stored or self._empty()
+        if 't' not in self.data:
+            self.data['t'] = str(super().total)
+
+    @property
+    def stored(self):
+        return self._stored
+
+    def _empty(self, next_id=1):
+        return {'n': next_id, 'p': [], 's': [], 't': '0.00'}
+
+    def _add_to_total(self, delta):
+        self.data['t'] = str(Decimal(self.data['t']) + delta)
+
+    def _save(self):
+        self._check_writable()
+        self._stored = True
+        self._lines = None
+        if self._deferred:
+            return
+        self.request.session[self.SESSION_KEY] = self.data
+        self.request.session.modified = True
+
+    def _next_id(self):
+        line_id = self.data['n']
+        self.data['n'] = line_id + 1
+        return line_id
+
+    def lines(self):
+        if self._lines is None:
+            self._count_read()
+            self._lines = self._resolve()
+        return self._lines
+
+    @property
+    def total(self):
+        self._count_read()
+        return Decimal(self.data['t'])
+
+    @property
+    def count(self):
+        self._count_read()
+        return len(self.data['p']) + len(self.data['s'])
+
+    def _resolve(self):
+        product_rows = self.data['p']
+        special_rows = self.data['s']
+
+        catalog = get_catalog()
+        products = catalog.products
+        meals = catalog.meals_by_id
+        ingredients = catalog.ingredients_by_id
+        prices = catalog.price_table
+
+        items = []
+        for line_id, product_id, quantity in product_rows:
+            product = products.get(product_id)
+            if product is None:
+                continue
+            unit_price = from_cents(prices.product(product_id, 1))
+            items.append(SessionLine(
+                id=line_id,
+                product=product,
+                quantity=quantity,
+                unit_price=unit_price,
+                total_price=unit_price * quantity,
+            ))
+
+        specials = []
+        for line_id, meal_id, quantity, notes, selections in special_rows:
+            meal = meals.get(meal_id)
+            if meal is None:
+                continue
+            selected = SelectedIngredients(
+                SessionLine(ingredient=ingredients[ing_id], quantity=ing_quantity)
+                for ing_id, ing_quantity in selections
+                if ing_id in ingredients
+            )
+            unit_price = from_cents(prices.special_meal_unit(
+                meal_id, [(sel.ingredient.id, sel.quantity) for sel in selected]
+            ))
+            specials.append(SessionLine(
+                id=line_id,
+                special_meal=meal,
+                quantity=quantity,
+                notes=notes,
+                selected_ingredients=selected,
+                unit_price=unit_price,
+                total_price=unit_price * quantity,
+            ))
+
+        return items, specials
+
+    def add_product(self, product, quantity):
+        for row in self.data['p']:
+            if row[1] == product.id:
+                row[2] += quantity
+                break
+        else:
+            self.data['p'].append([self._next_id(), product.id, quantity])
+        self._add_to_total(from_cents(get_price_table().product(product.id, quantity)))
+        self._save()
+
+    def add_special_meal(self, customization):
+        self.data['s'].append([
+            self._next_id(),
+            customization.meal_id,
+            customization.quantity,
+            customization.notes,
+            [[ingredient_id, ing_quantity]
+             for ingredient_id, ing_quantity in customization.selections],
+        ])
+        self._add_to_total(customization.total_price)
+        self._save()
+
+    def _find(self, line_type, line_id):
+        rows = self.data['p'] if line_type == PRODUCT else self.data['s']
+        try:
+            line_id = int(line_id)
+        except (TypeError, ValueError):
+            raise CartLineNotFound('Article introuvable')
+        for row in rows:
+            if row[0] == line_id:
+                return rows, row
+        raise CartLineNotFound('Article introuvable')
+
+    def _unit_price(self, line_type, row):
+        """Unit price of a stored row, ``None`` if it left the catalog"""
+        prices = get_price_table()
+        try:
+            if line_type == PRODUCT:
+                return from_cents(prices.product(row[1], 1))
+            return from_cents(prices.special_meal_unit(row[1], row[4]))
+        except KeyError:
+            return None
+
+    def update_quantity(self, line_type, line_id, quantity):
+        rows, row = self._find(line_type, line_id)
+        unit_price = self._unit_price(line_type, row)
+        if unit_price is not None:
+            self._add_to_total(unit_price * (quantity - row[2]))
+        row[2] = quantity
+        self._save()
+
+    def remove(self, line_type, line_id):
+        try:
+            rows, row = self._find(line_type, line_id)
+        except CartLineNotFound:
+            return
+        unit_price = self._unit_price(line_type, row)
+        if unit_price is not None:
+            self._add_to_total(-unit_price * row[2])
+        rows.remove(row)
+        self._save()
+
+    def apply(self, operations):
+        if not operations:
+            return
+        # Work on a copy and write the session once, at the end
+        original, stored = self.data, self._stored
+        self.data = copy.deepcopy(original)
+        self._deferred = True
+        try:
+            super().apply(operations)
+        except Exception:
+            self.data, self._stored, self._lines = original, stored, None
+            raise
+        finally:
+            self._deferred = False
+        self._save()
+
+    def clear(self):
+        if not self._stored:
+            return
+        self.data = self._empty(self.data['n'])
+        self._save()
+        # The admin copy goes with it (emptied at checkout, see mirror_to_db)
+        if getattr(settings, 'RESTAURANT_CART_ADMIN_MIRROR', False):
+            Cart.objects.filter(session_key=self.request.session.session_key).delete()
+
+    def reconcile(self, fix=False):
+        """Compare the running total and count with the resolved lines"""
+        items, specials = self.lines()
+        total = super().total
+        count = len(items) + len(specials)
+        drift = (self.total - total, self.count - count)
+        if fix and any(drift):
+            self.data['p'] = [row for row in self.data['p'] if row[0] in {i.id for i in items}]
+            self.data['s'] = [row for row in self.data['s'] if row[0] in {s.id for s in specials}]
+            self.data['t'] = str(total)
+            self._save()
+        return drift
+
+    def mirror_to_db(self):
+        """Copy the session lines into ``Cart`` rows for the admin"""
+        session_key = self.request.session.session_key
+        if not session_key:
+            return None
+
+        items, specials = self.lines()
+        with transaction.atomic():
+            cart, created = Cart.objects.get_or_create(session_key=session_key)
+            cart.total_price = sum((line.total_price for line in items + specials), Decimal('0.00'))
+            cart.items_count = len(items) + len(specials)
+            cart.save(update_fields=['total_price', 'items_count', 'updated_at'])
+            cart.cart_items.all().delete()
+            cart.cart_special_meals.all().delete()
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=item.product, quantity=item.quantity,
+                         total_price=item.total_price)
+                for item in items
+            ])
+            cart_specials = CartSpecialMeal.objects.bulk_create([
+                CartSpecialMeal(cart=cart, special_meal=special.special_meal,
+                                quantity=special.quantity, notes=special.notes,
+                                total_price=special.total_price)
+                for special in specials
+            ])
+            CartSpecialMealIngredient.objects.bulk_create([
+                CartSpecialMealIngredient(cart_special_meal=cart_special,
+                                          ingredient=sel.ingredient, quantity=sel.quantity)
+                for special, cart_special in zip(specials, cart_specials)
+                for sel in special.selected_ingredients
+            ])
+        return cart
+
+
+def get_cart(request):
+    """Return the cart of the current visitor using the configured backend"""
+    backend = getattr(settings, 'RESTAURANT_CART_BACKEND', 'restaurant.cart.SessionCart')
+    return import_string(backend)(request)
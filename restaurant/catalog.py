@@ -0,0 +1,372 @@
+"""
+Catalog snapshot.
+
+The public menu pages and the special meal customization path read the
+catalog from an immutable ``CatalogSnapshot`` built in a fixed number of
+queries and kept per worker process. The snapshot carries the catalog
+version it was built for; every request compares it with the shared
+version key in the cache (one cache read, no database query) and rebuilds
+only when it changed.
+
+Saving or deleting any catalog model bumps the shared version (see
+``restaurant.signals``), which invalidates the snapshot of every worker.
+The cache must therefore be shared between workers (see ``CACHES``).
+"""
+import gzip
+import json
+import threading
+import time
+from functools import cached_property
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from .pricing import PriceTable, from_cents
+from .models import (
+    Category, Product, SpecialMeal, SpecialMealIngredient, IngredientCategory, Ingredient,
+)
+
+CATALOG_VERSION_KEY = 'restaurant:catalog-version'
+
+
+class CustomizationError(ValueError):
+    """Raised when a special meal customization breaks the meal rules"""
+
+
+class IngredientRule:
+    """What a special meal allows for one ingredient"""
+    __slots__ = ('ingredient_id', 'name', 'price', 'max_quantity', 'is_default', 'is_available')
+
+    def __init__(self, ingredient_id, name, price, max_quantity, is_default, is_available):
+        self.ingredient_id = ingredient_id
+        self.name = name
+        self.price = price
+        self.max_quantity = max_quantity
+        self.is_default = is_default
+        self.is_available = is_available
+
+
+class MealIndex:
+    """Allowed ingredients of a special meal, keyed by ingredient id"""
+
+    def __init__(self, meal_id, name, base_price, is_available, rules, version):
+        self.meal_id = meal_id
+        self.name = name
+        self.base_price = base_price
+        self.is_available = is_available
+        self.rules = rules
+        self.version = version
+
+    def __contains__(self, ingredient_id):
+        return ingredient_id in self.rules
+
+    def get(self, ingredient_id):
+        return self.rules.get(ingredient_id)
+
+
+class Customization:
+    """A validated and priced special meal configuration"""
+
+    def __init__(self, meal_id, name, quantity, selections, unit_price, notes=''):
+        self.meal_id = meal_id
+        self.name = name
+        self.quantity = quantity
+        # [(ingredient_id, quantity), ...]
+        self.selections = selections
+        self.unit_price = unit_price
+        self.total_price = unit_price * quantity
+        self.notes = notes
+
+
+class IngredientGroup:
+    """Ingredients of one ``IngredientCategory`` offered for a special meal"""
+    __slots__ = ('category', 'entries')
+
+    def __init__(self, category, entries):
+        self.category = category
+        # ((Ingredient, IngredientRule), ...)
+        self.entries = entries
+
+
+class CatalogSnapshot:
+    """
+    Read-only view of the whole catalog at a given version.
+
+    ``categories`` carry their available products in ``category.products``;
+    ``special_meals`` and ``featured_products`` only hold available rows.
+    The model instances are shared between requests and must not be
+    modified.
+    """
+
+    def __init__(self, version, categories, products, featured_products, special_meals,
+                 meals_by_id, ingredient_categories, meal_indexes, meal_groups):
+        attrs = dict(
+            version=version,
+            categories=categories,
+            products=products,
+            featured_products=featured_products,
+            special_meals=special_meals,
+            meals_by_id=meals_by_id,
+            ingredient_categories=ingredient_categories,
+            meal_indexes=meal_indexes,
+            meal_groups=meal_groups,
+        )
+        for name, value in attrs.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CatalogSnapshot is immutable')
+
+    def get_special_meal(self, meal_id):
+        """Return an available special meal or ``None``"""
+        meal = self.meals_by_id.get(meal_id)
+        return meal if meal is not None and meal.is_available else None
+
+    @cached_property
+    def ingredients_by_id(self):
+        return {
+            ingredient.id: ingredient
+            for ing_category in self.ingredient_categories
+            for ingredient in ing_category.ingredients
+        }
+
+    @cached_property
+    def price_table(self):
+        """Integer-cent price tables of this snapshot (see ``restaurant.pricing``)"""
+        return PriceTable.from_catalog(self)
+
+    @cached_property
+    def json_payload(self):
+        """
+        The catalog as served by the JSON API, encoded once per snapshot:
+        ``(body, gzipped_body)``.
+        """
+        def image_url(image):
+            return image.url if image else None
+
+        data = {
+            'version': self.version,
+            'categories': [
+                {
+                    'id': category.id,
+                    'title': category.title,
+                    'description': category.description,
+                    'products': [
+                        {
+                            'id': product.id,
+                            'name': product.name,
+                            'description': product.description,
+                            'price': product.price,
+                            'image': image_url(product.image),
+                            'is_featured': product.is_featured,
+                        }
+                        for product in category.products
+                    ],
+                }
+                for category in self.categories
+            ],
+            'special_meals': [
+                {
+                    'id': meal.id,
+                    'name': meal.name,
+                    'description': meal.description,
+                    'base_price': meal.base_price,
+                    'image': image_url(meal.image),
+                    'ingredients': [
+                        {
+                            'id': rule.ingredient_id,
+                            'max_quantity': rule.max_quantity,
+                            'is_default': rule.is_default,
+                        }
+                        for group in self.meal_groups[meal.id]
+                        for ingredient, rule in group.entries
+                    ],
+                }
+                for meal in self.special_meals
+            ],
+            'ingredient_categories': [
+                {
+                    'id': ing_category.id,
+                    'name': ing_category.name,
+                    'ingredients': [
+                        {
+                            'id': ingredient.id,
+                            'name': ingredient.name,
+                            'price': ingredient.price,
+                            'image': image_url(ingredient.image),
+                            'is_available': ingredient.is_available,
+                        }
+                        for ingredient in ing_category.ingredients
+                    ],
+                }
+                for ing_category in self.ingredient_categories
+            ],
+        }
+        body = json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+        return body, gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def catalog_version():
+    """Return the shared catalog version, initializing it if needed"""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Never go back to a version a worker may still hold after the key
+        # was evicted: start from the clock instead of 1.
+        initial = int(time.time() * 1000)
+        if _snapshot is not None:
+            initial = max(initial, _snapshot.version + 1)
+        cache.add(CATALOG_VERSION_KEY, initial, None)
+        version = cache.get(CATALOG_VERSION_KEY, initial)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidate the catalog snapshot of every worker"""
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        catalog_version()
+
+
+def build_catalog(version):
+    """Build a snapshot from the database in 6 queries"""
+    products = tuple(Product.objects.order_by('id'))
+    available = [product for product in products if product.is_available]
+
+    by_category = {}
+    for product in available:
+        by_category.setdefault(product.category_id, []).append(product)
+    categories = tuple(Category.objects.all())
+    for category in categories:
+        category.products = tuple(by_category.get(category.id, ()))
+
+    meals = tuple(SpecialMeal.objects.order_by('id'))
+    meals_by_id = {meal.id: meal for meal in meals}
+
+    ingredient_categories = tuple(IngredientCategory.objects.prefetch_related(
+        Prefetch('ingredient_set', queryset=Ingredient.objects.select_related('category'))
+    ))
+    for ing_category in ingredient_categories:
+        ing_category.ingredients = tuple(ing_category.ingredient_set.all())
+
+    rules_by_meal = {}
+    for rule in SpecialMealIngredient.objects.select_related('ingredient'):
+        rules_by_meal.setdefault(rule.special_meal_id, {})[rule.ingredient_id] = IngredientRule(
+            ingredient_id=rule.ingredient_id,
+            name=rule.ingredient.name,
+            price=rule.ingredient.price,
+            max_quantity=rule.max_quantity,
+            is_default=rule.is_default,
+            is_available=rule.ingredient.is_available,
+        )
+
+    meal_indexes = {}
+    meal_groups = {}
+    for meal in meals:
+        rules = rules_by_meal.get(meal.id, {})
+        meal_indexes[meal.id] = MealIndex(
+            meal_id=meal.id,
+            name=meal.name,
+            base_price=meal.base_price,
+            is_available=meal.is_available,
+            rules=rules,
+            version=version,
+        )
+        groups = []
+        for ing_category in ingredient_categories:
+            entries = tuple(
+                (ingredient, rules[ingredient.id])
+                for ingredient in ing_category.ingredients
+                if ingredient.id in rules and ingredient.is_available
+            )
+            if entries:
+                groups.append(IngredientGroup(ing_category, entries))
+        meal_groups[meal.id] = tuple(groups)
+
+    return CatalogSnapshot(
+        version=version,
+        categories=categories,
+        products={product.id: product for product in products},
+        featured_products=tuple(available[:4]),
+        special_meals=tuple(meal for meal in meals if meal.is_available),
+        meals_by_id=meals_by_id,
+        ingredient_categories=ingredient_categories,
+        meal_indexes=meal_indexes,
+        meal_groups=meal_groups,
+    )
+
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def get_catalog():
+    """Return this worker's snapshot, rebuilding it if the version moved"""
+    global _snapshot
+    version = catalog_version()
+    snapshot = _snapshot
+    if snapshot is None or snapshot.version != version:
+        with _lock:
+            snapshot = _snapshot
+            if snapshot is None or snapshot.version != version:
+                snapshot = _snapshot = build_catalog(version)
+    return snapshot
+
+
+def get_meal_index(meal_id):
+    """Return the ingredient index of a special meal, or ``None``"""
+    return get_catalog().meal_indexes.get(meal_id)
+
+
+def validate_customization(meal_id, quantity, ingredients, notes=''):
+    """
+    Check a customization against the meal index and price it.
+
+    ``ingredients`` is the list of ``{'id': ..., 'quantity': ...}`` sent by
+    the customize page. Repeated ingredients are merged before checking
+    ``max_quantity``. Raises ``CustomizationError`` on any invalid input.
+    """
+    try:
+        meal_id = int(meal_id)
+        quantity = int(quantity)
+    except (TypeError, ValueError):
+        raise CustomizationError('Repas invalide')
+
+    index = get_meal_index(meal_id)
+    if index is None or not index.is_available:
+        raise CustomizationError("Ce repas n'est pas disponible")
+    if quantity < 1:
+        raise CustomizationError('Quantité invalide')
+
+    requested = {}
+    for ing_data in ingredients:
+        try:
+            ingredient_id = int(ing_data['id'])
+            ing_quantity = int(ing_data.get('quantity', 1))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise CustomizationError('Ingrédient invalide')
+        requested[ingredient_id] = requested.get(ingredient_id, 0) + ing_quantity
+
+    selections = []
+    for ingredient_id, ing_quantity in requested.items():
+        rule = index.get(ingredient_id)
+        if rule is None:
+            raise CustomizationError(f"Ingrédient non proposé pour {index.name}")
+        if not rule.is_available:
+            raise CustomizationError(f"{rule.name} n'est plus disponible")
+        if not 1 <= ing_quantity <= rule.max_quantity:
+            raise CustomizationError(
+                f"{rule.name}: quantité maximale {rule.max_quantity}"
+            )
+        selections.append((ingredient_id, ing_quantity))
+
+    prices = get_catalog().price_table
+    return Customization(
+        meal_id=index.meal_id,
+        name=index.name,
+        quantity=quantity,
+        selections=selections,
+        unit_price=from_cents(prices.special_meal_unit(index.meal_id, selections)),
+        notes=notes,
+    )
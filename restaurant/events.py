@@ -0,0 +1,72 @@
+"""
+New-order events.
+
+When a new order commits (see ``restaurant.signals``), ``publish_order``
+writes a compact event to the shared cache (see ``CACHES``): one key per
+order and the id of the latest one. The staff notification endpoints
+(``core.views.order_events`` and ``core.views.order_poll``) only read
+these keys, so waiting for orders never queries the database; the only
+query is ``last_order_id`` on a cold cache.
+
+Events expire after ``EVENT_TIMEOUT``: a client resuming from an older
+cursor only gets the orders still cached, and the reload of the admin
+page catches up with the rest.
+"""
+from django.core.cache import cache
+from django.db.models import Max
+
+from .models import Order
+
+LAST_ORDER_KEY = 'restaurant:last-order-id'
+ORDER_EVENT_KEY = 'restaurant:order-event:%d'
+EVENT_TIMEOUT = 60 * 60
+MAX_EVENTS = 20  # events sent at once to a client that fell behind
+
+
+def order_event(order):
+    return {
+        'id': order.id,
+        'customer': order.customer_name or order.customer_phone,
+        'total': str(order.total_price),
+        'created_at': order.created_at.isoformat(),
+    }
+
+
+def advance_last_order_id(order_id):
+    """Raise the cached latest id to ``order_id``, never lower it"""
+    # The cache has no compare-and-set: write, then read back. A racing
+    # write of a lower id is seen and overwritten; a read back that misses
+    # it is caught up by last_order_id(), which looks for newer events.
+    if cache.add(LAST_ORDER_KEY, order_id, None):
+        return
+    while (cache.get(LAST_ORDER_KEY) or 0) < order_id:
+        cache.set(LAST_ORDER_KEY, order_id, None)
+
+
+def publish_order(order):
+    """Announce a committed order to the listening admin pages"""
+    cache.set(ORDER_EVENT_KEY % order.id, order_event(order), EVENT_TIMEOUT)
+    advance_last_order_id(order.id)
+
+
+def last_order_id():
+    """Id of the latest order, from the cache (one query if it is cold)"""
+    last_id = cache.get(LAST_ORDER_KEY)
+    if last_id is None:
+        last_id = Order.objects.aggregate(last=Max('id'))['last'] or 0
+        cache.add(LAST_ORDER_KEY, last_id, None)
+        return last_id
+    # Events past the cached id: a racing publish left a lower one
+    ids = range(last_id + 1, last_id + MAX_EVENTS + 1)
+    ahead = cache.get_many([ORDER_EVENT_KEY % order_id for order_id in ids])
+    if ahead:
+        last_id = max(event['id'] for event in ahead.values())
+        advance_last_order_id(last_id)
+    return last_id
+
+
+def events_between(since_id, last_id):
+    """Cached events of the orders after ``since_id`` up to ``last_id``, oldest first"""
+    ids = range(max(since_id + 1, last_id - MAX_EVENTS + 1), last_id + 1)
+    events = cache.get_many([ORDER_EVENT_KEY % order_id for order_id in ids])
+    return [events[ORDER_EVENT_KEY % order_id] for order_id in ids if ORDER_EVENT_KEY % order_id in events]
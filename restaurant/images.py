@@ -0,0 +1,271 @@
+"""
+Responsive image derivatives.
+
+Catalog images (``Product.image``, ``SpecialMeal.image``,
+``Ingredient.image``) are uploaded at whatever size the phone or camera
+produced. For each upload we write resized and recompressed variants next
+to the other media files:
+
+    derived/<upload dir>/<content hash>-<width>.webp
+    derived/<upload dir>/<content hash>-<width>.jpg
+
+The names only depend on the source bytes and the width, so generating the
+variants twice writes nothing new and re-uploading the same picture reuses
+them. What was generated is stored on the instance in ``image_variants``::
+
+    {'source': 'products/m.jpg', 'hash': '3f2a...', 'width': 1200,
+     'height': 800, 'webp': {'320': 'derived/...', ...}, 'jpeg': {...},
+     'placeholder': 'data:image/jpeg;base64,...'}
+
+``placeholder`` is a 16 px wide copy (about 450 bytes) inlined in the
+pages and shown until the real image scrolls into view.
+
+Before deriving, the original upload is rotated according to its EXIF
+orientation and rewritten without metadata (phone photos carry GPS
+positions). Uploads are processed in the background by the image job queue
+(see ``restaurant/jobs.py``); templates use the ``restaurant_images`` tags,
+which fall back to the original file while no variant exists.
+"""
+import base64
+import hashlib
+import io
+import logging
+import os
+import stat
+import tempfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (160, 320, 640, 960)
+DEFAULT_QUALITY = {'webp': 75, 'jpeg': 78}
+FORMATS = (
+    # (key, Pillow format, extension, content type)
+    ('webp', 'WEBP', 'webp', 'image/webp'),
+    ('jpeg', 'JPEG', 'jpg', 'image/jpeg'),
+)
+HASH_LENGTH = 16
+PLACEHOLDER_WIDTH = 16
+PLACEHOLDER_QUALITY = 40
+
+
+def variant_widths():
+    return tuple(sorted(getattr(settings, 'RESTAURANT_IMAGE_WIDTHS', DEFAULT_WIDTHS)))
+
+
+def variant_name(source_name, digest, width, extension):
+    """Deterministic storage name of one derivative"""
+    directory = source_name.rsplit('/', 1)[0] if '/' in source_name else ''
+    prefix = f'derived/{directory}/' if directory else 'derived/'
+    return f'{prefix}{digest}-{width}.{extension}'
+
+
+def encode(image, pillow_format, quality, progressive=True):
+    """Encode a Pillow image, without any metadata"""
+    buffer = io.BytesIO()
+    if pillow_format == 'JPEG':
+        if image.mode == 'RGBA':
+            # JPEG has no alpha: flatten transparent sauces on white
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        image.convert('RGB').save(buffer, 'JPEG', quality=quality, optimize=True, progressive=progressive)
+    else:
+        image.save(buffer, pillow_format, quality=quality, method=6)
+    return buffer.getvalue()
+
+
+def placeholder_uri(image):
+    """Tiny JPEG data URI of an image"""
+    width, height = image.size
+    tiny = image.resize(
+        (PLACEHOLDER_WIDTH, max(1, round(height * PLACEHOLDER_WIDTH / width))), Image.LANCZOS
+    )
+    # Baseline JPEG: progressive scans cost more than the pixels at this size
+    data = encode(tiny, 'JPEG', PLACEHOLDER_QUALITY, progressive=False)
+    return 'data:image/jpeg;base64,' + base64.b64encode(data).decode('ascii')
+
+
+def replace_file(storage, name, data):
+    """
+    Overwrite ``name`` with ``data`` without a moment where it is missing.
+    On disk the bytes are written beside the file and renamed over it;
+    other storages cannot rename, so a copy of the old bytes is kept under
+    another name until the new ones are saved.
+    """
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        path = None
+    if path is None or not os.path.exists(path):
+        with storage.open(name, 'rb') as handle:
+            backup = storage.save(f'{name}.orig', ContentFile(handle.read()))
+        storage.delete(name)
+        saved = storage.save(name, ContentFile(data))
+        if saved != name:
+            raise OSError(f"{name} was saved as {saved}")
+        storage.delete(backup)
+        return
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.sanitize-')
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(data)
+        # mkstemp creates it private: keep the permissions of the upload
+        os.chmod(temp, stat.S_IMODE(os.stat(path).st_mode))
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
+
+
+def sanitize_original(storage, name, data):
+    """
+    Apply the EXIF orientation of an upload and drop its metadata, in
+    place (see ``replace_file``). Returns the (possibly rewritten) bytes;
+    files without EXIF data are left untouched, so running it twice
+    changes nothing.
+    """
+    image = Image.open(io.BytesIO(data))
+    if not image.getexif():
+        return data
+    pillow_format = image.format
+    image = ImageOps.exif_transpose(image)
+    buffer = io.BytesIO()
+    if pillow_format == 'JPEG':
+        image.save(buffer, 'JPEG', quality=95, optimize=True)
+    else:
+        image.save(buffer, pillow_format)
+    data = buffer.getvalue()
+    replace_file(storage, name, data)
+    return data
+
+
+def process_image(storage, name):
+    """
+    Sanitize an uploaded image and write its derivatives. Returns the
+    ``image_variants`` mapping. Raises ``OSError`` or
+    ``UnidentifiedImageError`` if the file is missing or is not an image.
+
+    Only touches the storage, never the database, so it can run in a worker
+    process.
+    """
+    with storage.open(name, 'rb') as handle:
+        data = handle.read()
+    data = sanitize_original(storage, name, data)
+    source = Image.open(io.BytesIO(data))
+    source.load()
+
+    if source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+    width, height = source.size
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    quality = {**DEFAULT_QUALITY, **getattr(settings, 'RESTAURANT_IMAGE_QUALITY', {})}
+
+    # Never upscale: keep the widths the source can fill, or its own width
+    widths = [w for w in variant_widths() if w <= width] or [width]
+
+    variants = {
+        'source': name,
+        'hash': digest,
+        'width': width,
+        'height': height,
+        'placeholder': placeholder_uri(source),
+    }
+    for key, pillow_format, extension, content_type in FORMATS:
+        variants[key] = {}
+        for target in widths:
+            derived = variant_name(name, digest, target, extension)
+            if not storage.exists(derived):
+                resized = source
+                if target != width:
+                    resized = source.resize(
+                        (target, max(1, round(height * target / width))), Image.LANCZOS
+                    )
+                storage.save(derived, ContentFile(encode(resized, pillow_format, quality[key])))
+            variants[key][str(target)] = derived
+    return variants
+
+
+def build_variants(field_file):
+    """
+    ``process_image`` for an image field file. Returns ``{}`` if the file
+    is missing or is not an image.
+    """
+    if not field_file:
+        return {}
+    try:
+        return process_image(field_file.storage, field_file.name)
+    except (OSError, UnidentifiedImageError):
+        logger.warning("Cannot build variants of %s", field_file.name)
+        return {}
+
+
+def needs_variants(instance):
+    """Whether ``instance.image_variants`` does not describe the current image"""
+    if not instance.image:
+        return bool(instance.image_variants)
+    variants = instance.image_variants
+    return variants.get('source') != instance.image.name or 'placeholder' not in variants
+
+
+def store_variants(instance, variants):
+    """
+    Save ``variants`` on ``instance`` with a single UPDATE (no
+    ``post_save``), unless its image changed since they were built.
+    Returns whether anything changed.
+    """
+    source = instance.image.name if instance.image else ''
+    if variants and variants.get('source') != source:
+        return False
+    if variants == instance.image_variants:
+        return False
+    instance.image_variants = variants
+    queryset = type(instance).objects.filter(pk=instance.pk)
+    if variants:
+        queryset = queryset.filter(image=source)
+    queryset.update(image_variants=variants)
+    return True
+
+
+def refresh_variants(instance, force=False):
+    """
+    Build and store the variants of ``instance.image`` in this process.
+    Returns whether anything changed.
+    """
+    if not force and not needs_variants(instance):
+        return False
+    return store_variants(instance, build_variants(instance.image))
+
+
+def variant_urls(instance, key):
+    """``[(width, url), ...]`` of one format, smallest first"""
+    variants = getattr(instance, 'image_variants', None) or {}
+    if not instance.image or variants.get('source') != instance.image.name:
+        return []
+    storage = instance.image.storage
+    return sorted(
+        (int(width), storage.url(name)) for width, name in variants.get(key, {}).items()
+    )
+
+
+def placeholder(instance):
+    """Inline placeholder of the current image, or ``''``"""
+    variants = getattr(instance, 'image_variants', None) or {}
+    if not instance.image or variants.get('source') != instance.image.name:
+        return ''
+    return variants.get('placeholder', '')
+
+
+def best_url(instance, width, key='jpeg'):
+    """URL of the smallest variant at least ``width`` wide, or the original"""
+    urls = variant_urls(instance, key)
+    if not urls:
+        return instance.image.url if instance.image else ''
+    for variant_width, url in urls:
+        if variant_width >= width:
+            return url
+    return urls[-1][1]
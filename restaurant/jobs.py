@@ -0,0 +1,109 @@
+"""
+Image job queue.
+
+Saving a catalog image in the admin only inserts an ``ImageJob`` row, in
+the same transaction as the save, so the admin returns immediately. The
+``run_image_worker`` command claims due jobs, runs
+``restaurant.images.process_image`` (orientation fix, metadata removal,
+derivatives) in a process pool and stores the resulting variants.
+
+Jobs are idempotent: there is at most one job per (object, image file),
+the derivative names only depend on the image bytes and results for an
+image that was replaced in the meantime are dropped. A failed job is
+retried with an exponential delay until ``max_attempts``; a job whose
+worker died is claimed again once its lock is ``STALE_AFTER`` old, and
+failed once it has used its ``max_attempts``.
+"""
+from datetime import timedelta
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .catalog import bump_catalog_version
+from .images import process_image, store_variants
+from .models import ImageJob, Product, SpecialMeal, Ingredient
+
+JOB_MODELS = {
+    'product': Product,
+    'specialmeal': SpecialMeal,
+    'ingredient': Ingredient,
+}
+RETRY_DELAY = 30  # seconds before the first retry, doubled at each attempt
+STALE_AFTER = timedelta(minutes=10)
+
+
+def enqueue_image_job(instance):
+    """Queue the processing of ``instance.image`` (once per image file)"""
+    job, _ = ImageJob.objects.get_or_create(
+        model=instance._meta.model_name,
+        object_id=instance.pk,
+        source=instance.image.name,
+    )
+    return job
+
+
+def due_jobs(now):
+    return Q(status='pending', run_after__lte=now) | Q(
+        status='running', locked_at__lt=now - STALE_AFTER, attempts__lt=F('max_attempts'),
+    )
+
+
+def fail_stale_jobs(now):
+    """Give up on the jobs that killed their worker ``max_attempts`` times"""
+    return ImageJob.objects.filter(
+        status='running', locked_at__lt=now - STALE_AFTER, attempts__gte=F('max_attempts'),
+    ).update(status='failed', locked_at=None, last_error='Worker died', updated_at=now)
+
+
+def claim_jobs(limit):
+    """
+    Lock up to ``limit`` due jobs for this worker. Each job is claimed with
+    a conditional UPDATE, so concurrent workers never run the same job.
+    """
+    now = timezone.now()
+    fail_stale_jobs(now)
+    candidates = ImageJob.objects.filter(due_jobs(now)).values_list('pk', flat=True)[:limit]
+    claimed = [
+        pk for pk in candidates
+        if ImageJob.objects.filter(due_jobs(now), pk=pk).update(
+            status='running', locked_at=now, attempts=F('attempts') + 1,
+        )
+    ]
+    return list(ImageJob.objects.filter(pk__in=claimed))
+
+
+def current_instance(job):
+    """The job's object if it still has the image the job was created for"""
+    instance = JOB_MODELS[job.model].objects.filter(pk=job.object_id).first()
+    if instance is None or not instance.image or instance.image.name != job.source:
+        return None
+    return instance
+
+
+def run_job(model, source):
+    """Process one image; runs in a worker process and never queries"""
+    storage = JOB_MODELS[model]._meta.get_field('image').storage
+    return process_image(storage, source)
+
+
+def complete_job(job, variants=None):
+    """Store the variants (if the image is still current) and close the job"""
+    instance = current_instance(job)
+    if instance is not None and variants is not None and store_variants(instance, variants):
+        bump_catalog_version()
+    job.status = 'done'
+    job.last_error = ''
+    job.locked_at = None
+    job.save(update_fields=['status', 'last_error', 'locked_at', 'updated_at'])
+
+
+def fail_job(job, error):
+    """Schedule a retry, or give up after ``max_attempts``"""
+    job.last_error = f"{type(error).__name__}: {error}"
+    job.locked_at = None
+    if job.attempts >= job.max_attempts:
+        job.status = 'failed'
+    else:
+        job.status = 'pending'
+        job.run_after = timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+    job.save(update_fields=['status', 'last_error', 'locked_at', 'run_after', 'updated_at'])
@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from restaurant.archive import archivable_orders, archive_batch, archive_cutoff
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the delivered and cancelled orders older than RESTAURANT_ARCHIVE_AFTER_DAYS, "
+        "with their lines, to the archive table, one short transaction per batch"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Age of the orders to archive (default: RESTAURANT_ARCHIVE_AFTER_DAYS)")
+        parser.add_argument('--batch-size', type=int, help="Orders per transaction (default: RESTAURANT_ARCHIVE_BATCH)")
+        parser.add_argument(
+            '--pause', type=float, default=getattr(settings, 'RESTAURANT_ARCHIVE_PAUSE', 0.5),
+            help="Seconds between two batches, to let the other writers through",
+        )
+        parser.add_argument('--max-batches', type=int, default=0, help="Stop after N batches (0: until done)")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the orders to archive")
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options['days'])
+        if options['dry_run']:
+            self.stdout.write(f"{archivable_orders(cutoff).count()} orders to archive (before {cutoff:%Y-%m-%d})")
+            return
+
+        total = batches = 0
+        while not options['max_batches'] or batches < options['max_batches']:
+            archived = archive_batch(cutoff, options['batch_size'])
+            if not archived:
+                break
+            total += archived
+            batches += 1
+            self.stdout.write(f"batch {batches}: {archived} orders archived ({total} in total)")
+            time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(f"{total} orders archived"))
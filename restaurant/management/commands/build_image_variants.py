@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from restaurant.catalog import bump_catalog_version
+from restaurant.images import needs_variants, refresh_variants
+from restaurant.models import Product, SpecialMeal, Ingredient
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the resized WebP/JPEG variants of the product, special meal and "
+        "ingredient images that do not have them yet"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Rebuild every image (existing variant files with the same name are kept)",
+        )
+
+    def handle(self, *args, **options):
+        built = skipped = failed = 0
+        for model in (Product, SpecialMeal, Ingredient):
+            for instance in model.objects.only('id', 'image', 'image_variants').iterator():
+                if not options['force'] and not needs_variants(instance):
+                    skipped += 1
+                    continue
+                refresh_variants(instance, force=options['force'])
+                if instance.image and not instance.image_variants:
+                    failed += 1
+                    self.stderr.write(f"{model.__name__} #{instance.pk}: cannot read {instance.image.name}")
+                else:
+                    built += 1
+                    self.stdout.write(f"{model.__name__} #{instance.pk}: {instance.image.name or '-'}")
+
+        if built:
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"{built} image(s) processed, {skipped} up to date, {failed} failed"
+        ))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from restaurant.cart import avoided, avoided_writes
+
+
+class Command(BaseCommand):
+    help = (
+        "Show how many cart reads were served without creating a session or "
+        "a Cart row since the counters were last reset"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Reset the counters")
+
+    def handle(self, *args, **options):
+        totals = avoided_writes()
+        self.stdout.write(f"Sessions not created: {totals['sessions']}")
+        self.stdout.write(f"Carts not created:    {totals['carts']}")
+        self.stdout.write(f"  of which crawlers:  {totals['bot_reads']}")
+        if options['reset']:
+            avoided.reset()
+            self.stdout.write(self.style.SUCCESS("Counters reset"))
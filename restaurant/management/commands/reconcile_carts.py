@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from restaurant.models import Cart
+
+
+class Command(BaseCommand):
+    help = "Detect carts whose stored total or item count drifted from their lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true',
+            help="Reset the stored totals of drifted carts from their lines",
+        )
+
+    def handle(self, *args, **options):
+        drifted = 0
+        for cart in Cart.objects.iterator():
+            total_drift, count_drift = cart.reconcile(fix=options['fix'])
+            if total_drift or count_drift:
+                drifted += 1
+                self.stdout.write(
+                    f"{cart.session_key}: total off by {total_drift} DA, "
+                    f"count off by {count_drift}"
+                )
+
+        action = "fixed" if options['fix'] else "found"
+        self.stdout.write(self.style.SUCCESS(f"{drifted} drifted cart(s) {action}"))
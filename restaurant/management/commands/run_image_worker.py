@@ -0,0 +1,104 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from restaurant.jobs import claim_jobs, complete_job, current_instance, fail_job, run_job
+
+
+def setup_worker():
+    """Make Django usable in spawned (non-forked) worker processes"""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+class Command(BaseCommand):
+    help = (
+        "Process the queued catalog image jobs (orientation fix, metadata removal, "
+        "responsive variants) with a pool of worker processes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 2,
+            help="Worker processes (0 runs the jobs in this process)",
+        )
+        parser.add_argument('--batch', type=int, default=0, help="Jobs claimed at once (default: 2 per worker)")
+        parser.add_argument('--poll', type=float, default=2.0, help="Seconds between polls of an empty queue")
+        parser.add_argument('--once', action='store_true', help="Exit when no job is due")
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 0)
+        batch = options['batch'] or max(workers, 1) * 2
+        pool = None
+        processed = 0
+        try:
+            while True:
+                jobs = claim_jobs(batch)
+                if not jobs:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+
+                live = []
+                for job in jobs:
+                    # Object deleted or image replaced: nothing left to do
+                    if current_instance(job) is None:
+                        complete_job(job)
+                    else:
+                        live.append(job)
+
+                if workers == 0:
+                    results = self.run_inline(live)
+                else:
+                    if pool is None:
+                        pool = ProcessPoolExecutor(max_workers=workers, initializer=setup_worker)
+                    try:
+                        results = self.run_in_pool(pool, live)
+                    except BrokenProcessPool as e:
+                        pool.shutdown(cancel_futures=True)
+                        pool = None
+                        results = [(job, None, e) for job in live]
+
+                for job, variants, error in results:
+                    if error is None:
+                        complete_job(job, variants)
+                        self.stdout.write(f"{job.get_model_display()} #{job.object_id}: {job.source}")
+                    else:
+                        fail_job(job, error)
+                        self.stderr.write(f"{job.get_model_display()} #{job.object_id}: {job.last_error}")
+                processed += len(jobs)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f"{processed} job(s) processed"))
+
+    def run_inline(self, jobs):
+        results = []
+        for job in jobs:
+            try:
+                results.append((job, run_job(job.model, job.source), None))
+            except Exception as e:
+                results.append((job, None, e))
+        return results
+
+    def run_in_pool(self, pool, jobs):
+        # Forked workers must not inherit open database connections
+        connections.close_all()
+        futures = {pool.submit(run_job, job.model, job.source): job for job in jobs}
+        results = []
+        for future in as_completed(futures):
+            try:
+                results.append((futures[future], future.result(), None))
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                results.append((futures[future], None, e))
+        return results
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:30
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_cart_totals(apps, schema_editor):
+    Cart = apps.get_model('restaurant', 'Cart')
+    for cart in Cart.objects.iterator():
+        items = cart.cart_items.aggregate(total=Sum('total_price'), count=Count('id'))
+        specials = cart.cart_special_meals.aggregate(total=Sum('total_price'), count=Count('id'))
+        cart.total_price = (items['total'] or 0) + (specials['total'] or 0)
+        cart.items_count = items['count'] + specials['count']
+        cart.save(update_fields=['total_price', 'items_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0003_order_delivery_person'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_cart_totals, migrations.RunPython.noop),
+    ]
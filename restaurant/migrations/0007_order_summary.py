@@ -0,0 +1,99 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:02
+
+from django.db import migrations, models
+from django.db.models import Prefetch
+
+BATCH_SIZE = 500
+
+
+# Frozen copies of the line builders of restaurant/orders.py, so later
+# changes to them do not change what this migration writes
+def product_line(name, quantity, unit_price, total_price):
+    return {
+        'type': 'product',
+        'name': name,
+        'quantity': quantity,
+        'unit_price': str(unit_price),
+        'total_price': str(total_price),
+        'text': f"{quantity}x {name}",
+    }
+
+
+def special_line(name, quantity, base_price, total_price, notes, ingredients):
+    text = f"{quantity}x {name}"
+    if ingredients:
+        text += " [" + ", ".join(f"{qty}x {ingredient}" for ingredient, qty, price in ingredients) + "]"
+    if notes:
+        text += f" (Note: {notes})"
+    return {
+        'type': 'special',
+        'name': name,
+        'quantity': quantity,
+        'base_price': str(base_price),
+        'total_price': str(total_price),
+        'notes': notes or '',
+        'ingredients': [
+            {'name': ingredient, 'quantity': qty, 'unit_price': str(price)}
+            for ingredient, qty, price in ingredients
+        ],
+        'text': text,
+    }
+
+
+def build_summary(lines):
+    return {'lines': lines, 'text': "\n".join(line['text'] for line in lines)}
+
+
+def backfill_summaries(apps, schema_editor):
+    Order = apps.get_model('restaurant', 'Order')
+    OrderItem = apps.get_model('restaurant', 'OrderItem')
+    OrderSpecialMeal = apps.get_model('restaurant', 'OrderSpecialMeal')
+    OrderSpecialMealIngredient = apps.get_model('restaurant', 'OrderSpecialMealIngredient')
+
+    orders = Order.objects.order_by('pk').prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('product')),
+        Prefetch(
+            'special_meals',
+            queryset=OrderSpecialMeal.objects.select_related('special_meal').prefetch_related(
+                Prefetch(
+                    'selected_ingredients',
+                    queryset=OrderSpecialMealIngredient.objects.select_related('ingredient'),
+                )
+            ),
+        ),
+    )
+    batch = []
+    for order in orders.iterator(chunk_size=BATCH_SIZE):
+        order.summary = build_summary([
+            product_line(item.product.name, item.quantity, item.unit_price, item.total_price)
+            for item in order.items.all()
+        ] + [
+            special_line(
+                special.special_meal.name, special.quantity, special.base_price,
+                special.total_price, special.notes,
+                [(ing.ingredient.name, ing.quantity, ing.unit_price) for ing in special.selected_ingredients.all()],
+            )
+            for special in order.special_meals.all()
+        ])
+        batch.append(order)
+        if len(batch) == BATCH_SIZE:
+            Order.objects.bulk_update(batch, ['summary'])
+            batch = []
+    if batch:
+        Order.objects.bulk_update(batch, ['summary'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0006_imagejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='summary',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
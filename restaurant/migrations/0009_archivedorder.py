@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:14
+
+import django.db.models.deletion
+import django.db.models.functions.comparison
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0008_order_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('customer_phone', models.CharField(max_length=20)),
+                ('customer_name', models.CharField(blank=True, max_length=100)),
+                ('customer_address', models.TextField(blank=True, null=True)),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('additional_notes', models.TextField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'En attente'), ('confirmed', 'Confirmée'), ('preparing', 'En préparation'), ('ready', 'Prête'), ('delivered', 'Livrée'), ('cancelled', 'Annulée')], max_length=20)),
+                ('summary', models.JSONField(blank=True, default=dict)),
+                ('lines', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('delivery_person', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_deliveries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['created_at'], name='archived_order_created_idx'), models.Index(django.db.models.functions.comparison.Collate('customer_phone', 'NOCASE'), name='archived_order_phone_idx')],
+            },
+        ),
+    ]
@@ -1,7 +1,12 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Count, Sum
+from django.db.models.functions import Collate
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from decimal import Decimal
 
+from .pricing import from_cents, get_price_table
+
 # Existing Models
 class Category(models.Model):
     title = models.CharField(max_length=100)
@@ -20,6 +25,8 @@ class Product(models.Model):
     description = models.TextField()
     is_available = models.BooleanField(default=True)
     image = models.ImageField(upload_to='products/')
+    # Resized WebP/JPEG copies of the image (see restaurant/images.py)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     is_featured = models.BooleanField(default=False)
 
@@ -53,6 +60,7 @@ class Ingredient(models.Model):
     )
     is_available = models.BooleanField(default=True)
     image = models.ImageField(upload_to='ingredients/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"{self.name} ({self.category.name})"
@@ -67,6 +75,7 @@ class SpecialMeal(models.Model):
     description = models.TextField()
     base_price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='special_meals/')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_available = models.BooleanField(default=True)
     
     # Available ingredients for this special meal
@@ -122,6 +131,8 @@ class Order(models.Model):
     additional_notes = models.TextField(blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     delivery_person = models.ForeignKey('auth.User', on_delete=models.SET_NULL, blank=True, null=True, related_name='deliveries')
+    # What was ordered, written once with the order (see restaurant.orders.build_summary)
+    summary = models.JSONField(default=dict, blank=True, editable=False)
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -131,6 +142,49 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        # Access paths of the admin and the order feeds; each is checked
+        # against a full table scan by restaurant.queryplans
+        indexes = [
+            # Changelist pages (-created_at, -id) and date filters
+            models.Index(fields=['created_at'], name='order_created_idx'),
+            # Status and courier filters, in changelist order
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+            models.Index(fields=['delivery_person', 'created_at'], name='order_courier_created_idx'),
+            # Incremental feed cursor
+            models.Index(fields=['updated_at'], name='order_updated_idx'),
+            # Phone prefix search: SQLite only uses an index for LIKE
+            # (case-insensitive) if the index is NOCASE
+            models.Index(Collate('customer_phone', 'NOCASE'), name='order_phone_idx'),
+        ]
+
+
+class ArchivedOrder(models.Model):
+    """Delivered or cancelled order moved out of the hot tables (see restaurant/archive.py)"""
+    # The id it had as an Order
+    id = models.BigIntegerField(primary_key=True)
+    customer_phone = models.CharField(max_length=20)
+    customer_name = models.CharField(max_length=100, blank=True)
+    customer_address = models.TextField(blank=True, null=True)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    additional_notes = models.TextField(blank=True, null=True)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    delivery_person = models.ForeignKey('auth.User', on_delete=models.SET_NULL, blank=True, null=True, related_name='archived_deliveries')
+    summary = models.JSONField(default=dict, blank=True)
+    # The OrderItem/OrderSpecialMeal/OrderSpecialMealIngredient rows, with their catalog ids
+    lines = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Commande #{self.id} - {self.customer_phone} - {self.total_price} DA (archivée)"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at'], name='archived_order_created_idx'),
+            models.Index(Collate('customer_phone', 'NOCASE'), name='archived_order_phone_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -182,16 +236,44 @@ class OrderSpecialMealIngredient(models.Model):
 class Cart(models.Model):
     """Cart tied to session or user"""
     session_key = models.CharField(max_length=100, unique=True)
+    # Running totals maintained by every cart mutation (see adjust_totals)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    items_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def get_total(self):
-        total = Decimal('0.00')
-        for item in self.cart_items.all():
-            total += item.total_price
-        for special in self.cart_special_meals.all():
-            total += special.total_price
-        return total
+        return self.total_price
+
+    def adjust_totals(self, total_delta=Decimal('0.00'), count_delta=0):
+        """Atomically apply a line change to the stored total and count"""
+        Cart.objects.filter(pk=self.pk).update(
+            total_price=F('total_price') + total_delta,
+            items_count=F('items_count') + count_delta,
+        )
+        self.refresh_from_db(fields=['total_price', 'items_count'])
+
+    def compute_totals(self):
+        """Recompute the total and line count from the cart lines"""
+        items = self.cart_items.aggregate(total=Sum('total_price'), count=Count('id'))
+        specials = self.cart_special_meals.aggregate(total=Sum('total_price'), count=Count('id'))
+        total = (items['total'] or Decimal('0.00')) + (specials['total'] or Decimal('0.00'))
+        return total, items['count'] + specials['count']
+
+    def reconcile(self, fix=False):
+        """
+        Compare the stored totals with the cart lines.
+
+        Returns ``(total_drift, count_drift)``, both zero when the running
+        totals are in sync. With ``fix=True`` the stored values are reset.
+        """
+        with transaction.atomic():
+            total, count = self.compute_totals()
+            drift = (self.total_price - total, self.items_count - count)
+            if fix and any(drift):
+                Cart.objects.filter(pk=self.pk).update(total_price=total, items_count=count)
+                self.total_price, self.items_count = total, count
+        return drift
 
     def __str__(self):
         return f"Panier {self.session_key}"
@@ -205,7 +287,7 @@ class CartItem(models.Model):
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
 
     def save(self, *args, **kwargs):
-        self.total_price = self.product.price * self.quantity
+        self.total_price = from_cents(get_price_table().product(self.product_id, self.quantity))
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -222,11 +304,11 @@ class CartSpecialMeal(models.Model):
 
     def calculate_total(self):
         """Calculate total including ingredients"""
-        total = self.special_meal.base_price * self.quantity
-        for ing in self.selected_ingredients.all():
-            total += ing.ingredient.price * ing.quantity * self.quantity
-        self.total_price = total
-        return total
+        selections = [(ing.ingredient_id, ing.quantity) for ing in self.selected_ingredients.all()]
+        self.total_price = from_cents(
+            get_price_table().special_meal(self.special_meal_id, self.quantity, selections)
+        )
+        return self.total_price
 
     def __str__(self):
         return f"{self.quantity}x {self.special_meal.name}"
@@ -243,4 +325,42 @@ class CartSpecialMealIngredient(models.Model):
     quantity = models.IntegerField(validators=[MinValueValidator(1)])
 
     def __str__(self):
-        return f"{self.quantity}x {self.ingredient.name}"
\ No newline at end of file
+        return f"{self.quantity}x {self.ingredient.name}"
+
+
+# Background jobs
+class ImageJob(models.Model):
+    """Processing of one uploaded catalog image (see restaurant/jobs.py)"""
+    STATUS_CHOICES = [
+        ('pending', 'En attente'),
+        ('running', 'En cours'),
+        ('done', 'Terminé'),
+        ('failed', 'Échoué'),
+    ]
+    MODEL_CHOICES = [
+        ('product', 'Produit'),
+        ('specialmeal', 'Repas spécial'),
+        ('ingredient', 'Ingrédient'),
+    ]
+
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.PositiveIntegerField()
+    source = models.CharField(max_length=255, help_text="Image file the job was created for")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'object_id', 'source'], name='unique_image_job'),
+        ]
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f"{self.get_model_display()} #{self.object_id} - {self.source} ({self.get_status_display()})"
@@ -0,0 +1,213 @@
+"""
+Order building pipeline.
+
+Turns a cart (see ``restaurant.cart``) into an ``Order`` with a fixed number
+of queries, whatever the size of the cart:
+
+    reads   3  the cart lines with their products, special meals and
+               selected ingredients (``cart.lines()``)
+    writes  1  INSERT order
+            1  UPDATE the order row counter     (``core.counts``)
+            1  bulk INSERT order items          (skipped if none)
+            1  bulk INSERT order special meals  (skipped if none)
+            1  bulk INSERT meal ingredients     (skipped if none)
+            5  clear a ``DatabaseCart`` (items, then special meals and their
+               ingredients, which Django collects before deleting, then the
+               cart totals); a ``SessionCart`` is cleared in the session
+               instead
+
+Everything from reading the cart lines to the cart clean-up runs inside
+one ``transaction.atomic`` block: the prices and the availability written
+are the ones read, and the SQLite write lock is held for a handful of
+statements instead of one round trip per line.
+
+The order also stores a summary of its lines (``Order.summary``), built from
+the cart before the insert, so the admin, the confirmation page and the
+kitchen never join the order lines again::
+
+    {'lines': [
+        {'type': 'product', 'name': 'Burger', 'quantity': 2,
+         'unit_price': '350.00', 'total_price': '700.00', 'text': '2x Burger'},
+        {'type': 'special', 'name': 'Machaoui', 'quantity': 1,
+         'base_price': '400.00', 'total_price': '480.00', 'notes': 'Bien cuit',
+         'ingredients': [{'name': 'Harissa', 'quantity': 2, 'unit_price': '20.00'}],
+         'text': '1x Machaoui [2x Harissa] (Note: Bien cuit)'},
+     ],
+     'text': '2x Burger\n1x Machaoui [2x Harissa] (Note: Bien cuit)'}
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Prefetch
+
+from .models import Order, OrderItem, OrderSpecialMeal, OrderSpecialMealIngredient
+from .pricing import PRODUCT, SPECIAL
+
+
+class EmptyCartError(ValueError):
+    """Raised when trying to place an order from an empty cart"""
+
+
+def product_line(name, quantity, unit_price, total_price):
+    return {
+        'type': PRODUCT,
+        'name': name,
+        'quantity': quantity,
+        'unit_price': str(unit_price),
+        'total_price': str(total_price),
+        'text': f"{quantity}x {name}",
+    }
+
+
+def special_line(name, quantity, base_price, total_price, notes, ingredients):
+    """``ingredients``: ``[(name, quantity, unit_price), ...]``"""
+    text = f"{quantity}x {name}"
+    if ingredients:
+        text += " [" + ", ".join(f"{qty}x {ingredient}" for ingredient, qty, price in ingredients) + "]"
+    if notes:
+        text += f" (Note: {notes})"
+    return {
+        'type': SPECIAL,
+        'name': name,
+        'quantity': quantity,
+        'base_price': str(base_price),
+        'total_price': str(total_price),
+        'notes': notes or '',
+        'ingredients': [
+            {'name': ingredient, 'quantity': qty, 'unit_price': str(price)}
+            for ingredient, qty, price in ingredients
+        ],
+        'text': text,
+    }
+
+
+def build_summary(lines):
+    return {'lines': lines, 'text': "\n".join(line['text'] for line in lines)}
+
+
+def lines_summary(items, specials):
+    """Summary of loaded order lines (products, meals and their ingredients)"""
+    return build_summary([
+        product_line(item.product.name, item.quantity, item.unit_price, item.total_price)
+        for item in items
+    ] + [
+        special_line(
+            special.special_meal.name, special.quantity, special.base_price,
+            special.total_price, special.notes,
+            [(ing.ingredient.name, ing.quantity, ing.unit_price) for ing in special.selected_ingredients.all()],
+        )
+        for special in specials
+    ])
+
+
+def order_lines_summary(order):
+    """Summary of the lines stored for ``order`` (3 queries)"""
+    items = order.items.select_related('product')
+    specials = order.special_meals.select_related('special_meal').prefetch_related(
+        Prefetch(
+            'selected_ingredients',
+            queryset=OrderSpecialMealIngredient.objects.select_related('ingredient'),
+        )
+    )
+    return lines_summary(items, specials)
+
+
+def refresh_summary(order):
+    """Rebuild the summary after the lines were edited (in the admin)"""
+    order.summary = order_lines_summary(order)
+    Order.objects.filter(pk=order.pk).update(summary=order.summary)
+    return order.summary
+
+
+def summary_lines(order):
+    """``(product_lines, special_lines)`` of the summary, prices as ``Decimal``"""
+    summary = order.summary or refresh_summary(order)
+    products, specials = [], []
+    for line in summary['lines']:
+        line = {**line}
+        for key in ('unit_price', 'base_price', 'total_price'):
+            if key in line:
+                line[key] = Decimal(line[key])
+        if line['type'] == SPECIAL:
+            line['ingredients'] = [
+                {**ing, 'unit_price': Decimal(ing['unit_price'])} for ing in line['ingredients']
+            ]
+            specials.append(line)
+        else:
+            products.append(line)
+    return products, specials
+
+
+def create_order(cart, customer_phone, customer_name='', customer_address='',
+                 additional_notes=''):
+    """Materialize ``cart`` into a new order and empty the cart"""
+    with transaction.atomic():
+        items, specials = cart.lines()
+        if not items and not specials:
+            raise EmptyCartError('Panier vide')
+
+        total = sum((item.total_price for item in items), Decimal('0.00'))
+        total += sum((special.total_price for special in specials), Decimal('0.00'))
+        selections = [list(special.selected_ingredients.all()) for special in specials]
+        summary = build_summary([
+            product_line(item.product.name, item.quantity, item.product.price, item.total_price)
+            for item in items
+        ] + [
+            special_line(
+                special.special_meal.name, special.quantity, special.special_meal.base_price,
+                special.total_price, special.notes,
+                [(ing.ingredient.name, ing.quantity, ing.ingredient.price) for ing in chosen],
+            )
+            for special, chosen in zip(specials, selections)
+        ])
+
+        order = Order.objects.create(
+            customer_phone=customer_phone,
+            customer_name=customer_name,
+            customer_address=customer_address,
+            total_price=total,
+            additional_notes=additional_notes,
+            summary=summary,
+        )
+
+        if items:
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=item.product,
+                    quantity=item.quantity,
+                    unit_price=item.product.price,
+                    total_price=item.total_price,
+                )
+                for item in items
+            ])
+
+        if specials:
+            order_specials = OrderSpecialMeal.objects.bulk_create([
+                OrderSpecialMeal(
+                    order=order,
+                    special_meal=special.special_meal,
+                    quantity=special.quantity,
+                    base_price=special.special_meal.base_price,
+                    total_price=special.total_price,
+                    notes=special.notes,
+                )
+                for special in specials
+            ])
+
+            order_selections = [
+                OrderSpecialMealIngredient(
+                    order_special_meal=order_special,
+                    ingredient=ing.ingredient,
+                    quantity=ing.quantity,
+                    unit_price=ing.ingredient.price,
+                )
+                for chosen, order_special in zip(selections, order_specials)
+                for ing in chosen
+            ]
+            if order_selections:
+                OrderSpecialMealIngredient.objects.bulk_create(order_selections)
+
+        cart.clear()
+
+    return order
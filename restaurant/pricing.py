@@ -0,0 +1,101 @@
+"""
+Pricing engine.
+
+Every price shown or stored by the shop comes from here. Catalog prices are
+compiled into integer-cent tables once per catalog version and every line
+is priced with integer arithmetic, using one rule everywhere:
+
+    product line       price x quantity
+    special meal line  (base_price + sum(ingredient price x ingredient quantity))
+                       x meal quantity
+
+Ingredient extras are always multiplied by the meal quantity. Decimal
+amounts only appear at the edges (``to_cents``/``from_cents``).
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+PRODUCT = 'product'
+SPECIAL = 'special'
+
+CENT = Decimal('0.01')
+
+
+def to_cents(amount):
+    """Convert a Decimal amount in DA to integer cents"""
+    return int((Decimal(amount) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    """Convert integer cents back to a 2-decimal amount in DA"""
+    return (Decimal(cents) / 100).quantize(CENT)
+
+
+class PriceTable:
+    """Integer-cent prices of the whole catalog at one version"""
+
+    def __init__(self, version, products, meals, ingredients):
+        self.version = version
+        # {id: cents}
+        self.products = products
+        self.meals = meals
+        self.ingredients = ingredients
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """Compile the price tables of a ``CatalogSnapshot`` (no query)"""
+        return cls(
+            version=catalog.version,
+            products={pk: to_cents(product.price) for pk, product in catalog.products.items()},
+            meals={pk: to_cents(meal.base_price) for pk, meal in catalog.meals_by_id.items()},
+            ingredients={
+                ingredient.id: to_cents(ingredient.price)
+                for ing_category in catalog.ingredient_categories
+                for ingredient in ing_category.ingredients
+            },
+        )
+
+    def product(self, product_id, quantity):
+        """Price of a product line, in cents"""
+        return self.products[product_id] * quantity
+
+    def special_meal_unit(self, meal_id, selections):
+        """Price of one special meal with ``(ingredient_id, quantity)`` selections"""
+        ingredients = self.ingredients
+        return self.meals[meal_id] + sum(
+            ingredients[ingredient_id] * quantity for ingredient_id, quantity in selections
+        )
+
+    def special_meal(self, meal_id, quantity, selections):
+        """Price of a special meal line, in cents"""
+        return self.special_meal_unit(meal_id, selections) * quantity
+
+    def quote_many(self, configurations):
+        """
+        Price many configurations in one call.
+
+        Each configuration is ``(PRODUCT, product_id, quantity)`` or
+        ``(SPECIAL, meal_id, quantity, selections)``. Returns the line
+        totals in cents, with ``None`` for configurations referring to
+        unknown catalog ids.
+        """
+        products, meals, ingredients = self.products, self.meals, self.ingredients
+        totals = []
+        for config in configurations:
+            try:
+                if config[0] == PRODUCT:
+                    totals.append(products[config[1]] * config[2])
+                else:
+                    unit = meals[config[1]]
+                    for ingredient_id, quantity in config[3]:
+                        unit += ingredients[ingredient_id] * quantity
+                    totals.append(unit * config[2])
+            except (KeyError, IndexError, TypeError):
+                totals.append(None)
+        return totals
+
+
+def get_price_table():
+    """Return the price table of the current catalog snapshot"""
+    from .catalog import get_catalog
+
+    return get_catalog().price_table
@@ -0,0 +1,96 @@
+"""
+Query plan checks of the hot order queries.
+
+``hot_queries()`` lists the queries the admin, the order feeds and the
+storefront run all the time, built with the ORM as the code builds them.
+``check_plans()`` runs SQLite's ``EXPLAIN QUERY PLAN`` on each and returns
+the ones that read a whole table:
+
+- a ``SCAN`` of a table or of an index fails, since its cost grows with
+  the table;
+- except for a paginated query (``limited``) whose scan already follows its
+  ``ORDER BY``: it stops after the page. If SQLite has to sort (``USE TEMP
+  B-TREE FOR ORDER BY``) it read everything first and fails.
+
+``restaurant.tests.QueryPlanTests`` checks them against 500k seeded orders,
+after ``ANALYZE`` as production databases should be.
+"""
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from core.pagination import newer_than, older_than
+
+from .archive import archivable_orders
+from .models import Cart, CartItem, Order, OrderItem, OrderSpecialMeal
+from .workflow import ACTIVE_STATUSES
+
+# OrderAdmin changelist: Meta.ordering plus the admin's primary key tie-break
+CHANGELIST_ORDERING = ('-created_at', '-pk')
+PAGE_SIZE = 100
+
+
+class HotQuery:
+    __slots__ = ('name', 'queryset', 'limited')
+
+    def __init__(self, name, queryset, limited=False):
+        self.name = name
+        self.queryset = queryset
+        self.limited = limited
+
+
+def hot_queries():
+    now = timezone.now()
+    page = lambda queryset: queryset.order_by(*CHANGELIST_ORDERING)[:PAGE_SIZE]
+    keys = lambda queryset: queryset.values_list('created_at', 'pk')[:PAGE_SIZE + 1]
+    ordered = Order.objects.order_by(*CHANGELIST_ORDERING)
+    return [
+        HotQuery('changelist page', page(Order.objects.all()), limited=True),
+        # Keyset pages of the changelist (core/pagination.py)
+        HotQuery('next page', keys(ordered.filter(older_than(now, 10 ** 6))), limited=True),
+        HotQuery('previous page', keys(ordered.filter(newer_than(now, 10 ** 6)).reverse()), limited=True),
+        HotQuery('oldest page', keys(ordered.reverse()), limited=True),
+        HotQuery('status filter', page(Order.objects.filter(status='pending'))),
+        HotQuery('courier filter', page(Order.objects.filter(delivery_person_id=1))),
+        HotQuery('date filter', page(Order.objects.filter(created_at__gte=now - timedelta(days=7)))),
+        HotQuery('phone search', page(Order.objects.filter(Q(customer_phone__startswith='0550') | Q(pk=550)))),
+        HotQuery('archive batch', archivable_orders(now).values_list('pk', flat=True)[:PAGE_SIZE], limited=True),
+        HotQuery('latest order', Order.objects.order_by('-id')[:1], limited=True),
+        HotQuery(
+            # Also the kitchen board updates
+            'order feed',
+            Order.objects.filter(updated_at__gt=now - timedelta(minutes=1))
+            .order_by('updated_at').values_list('pk', 'created_at')[:PAGE_SIZE + 1],
+        ),
+        HotQuery(
+            'kitchen board',
+            Order.objects.filter(status__in=ACTIVE_STATUSES).order_by('status', 'created_at', 'pk').only('summary'),
+        ),
+        HotQuery('order items', OrderItem.objects.filter(order_id=1)),
+        HotQuery('order special meals', OrderSpecialMeal.objects.filter(order_id=1)),
+        HotQuery('cart', Cart.objects.filter(session_key='x')),
+        HotQuery('cart items', CartItem.objects.filter(cart_id=1)),
+    ]
+
+
+def full_scans(plan, limited=False):
+    """Lines of an ``EXPLAIN QUERY PLAN`` output that read a whole table"""
+    # Django prints "<id> <parent> <notused> <detail>" lines
+    details = [line.split(' ', 3)[-1] for line in plan.splitlines()]
+    scans = [detail for detail in details if detail.startswith('SCAN ')]
+    sorts = [detail for detail in details if detail.startswith('USE TEMP B-TREE FOR ORDER BY')]
+    if not scans or (limited and not sorts):
+        return []
+    return scans + sorts
+
+
+def check_plans(queries=None):
+    """``{name: (plan, offending lines)}`` of the hot queries that scan a table"""
+    failures = {}
+    for query in queries or hot_queries():
+        plan = query.queryset.explain()
+        scans = full_scans(plan, query.limited)
+        if scans:
+            failures[query.name] = (plan, scans)
+    return failures
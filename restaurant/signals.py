@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .catalog import bump_catalog_version
+from .events import publish_order
+from .images import refresh_variants, store_variants
+from .jobs import enqueue_image_job
+from .models import (
+    Category, Product, IngredientCategory, Ingredient, SpecialMeal, SpecialMealIngredient, Order,
+)
+
+CATALOG_MODELS = (
+    Category, Product, IngredientCategory, Ingredient, SpecialMeal, SpecialMealIngredient,
+)
+IMAGE_MODELS = (Product, Ingredient, SpecialMeal)
+
+
+def catalog_changed(sender, **kwargs):
+    """Invalidate the catalog snapshot of every worker after an admin edit"""
+    # Once committed: a worker seeing the new version must also see the new rows
+    transaction.on_commit(bump_catalog_version)
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(catalog_changed, sender=model, dispatch_uid=f'catalog-save-{model.__name__}')
+    post_delete.connect(catalog_changed, sender=model, dispatch_uid=f'catalog-delete-{model.__name__}')
+
+
+def image_uploading(sender, instance, **kwargs):
+    """Remember whether this save carries a new upload (not yet written)"""
+    instance._image_uploaded = bool(instance.image) and not instance.image._committed
+
+
+def image_uploaded(sender, instance, **kwargs):
+    """Queue the processing of a freshly uploaded image"""
+    if not instance.image:
+        if instance.image_variants and store_variants(instance, {}):
+            transaction.on_commit(bump_catalog_version)
+        return
+    if not getattr(instance, '_image_uploaded', False):
+        return
+    instance._image_uploaded = False
+    if getattr(settings, 'RESTAURANT_IMAGE_JOBS', True):
+        enqueue_image_job(instance)
+    elif refresh_variants(instance):
+        transaction.on_commit(bump_catalog_version)
+
+
+for model in IMAGE_MODELS:
+    pre_save.connect(image_uploading, sender=model, dispatch_uid=f'image-upload-{model.__name__}')
+    post_save.connect(image_uploaded, sender=model, dispatch_uid=f'image-variants-{model.__name__}')
+
+
+def order_placed(sender, instance, created, **kwargs):
+    """Notify the admin pages once the new order is committed"""
+    if created:
+        transaction.on_commit(lambda: publish_order(instance))
+
+
+post_save.connect(order_placed, sender=Order, dispatch_uid='order-placed')
@@ -0,0 +1,93 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from ..images import FORMATS, best_url, placeholder, variant_urls
+
+register = template.Library()
+
+
+def srcset(urls):
+    return ', '.join(f'{url} {width}w' for width, url in urls)
+
+
+@register.simple_tag
+def responsive_image(instance, sizes='100vw', alt='', css_class='', width=None, height=None,
+                     loading='lazy'):
+    """
+    ``<picture>`` of an image field owner (product, special meal,
+    ingredient) with a WebP ``srcset`` and a JPEG fallback. Renders a plain
+    ``<img>`` of the original file until its variants are built. Pass
+    ``loading="eager"`` for images visible above the fold.
+
+        {% responsive_image product sizes="96px" alt=product.name css_class="w-24 h-24" %}
+    """
+    if not instance.image:
+        return ''
+    webp = variant_urls(instance, 'webp')
+    jpeg = variant_urls(instance, 'jpeg')
+    variants = instance.image_variants or {}
+    width = width or variants.get('width')
+    height = height or variants.get('height')
+    dimensions = format_html(' width="{}" height="{}"', width, height) if width and height else ''
+    preview = placeholder(instance)
+    if preview and loading == 'lazy':
+        dimensions += format_html(' style="background: url(\'{}\') center / cover"', preview)
+
+    if not jpeg:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" loading="{}" decoding="async"{}>',
+            instance.image.url, alt, css_class, loading, dimensions,
+        )
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="{}" decoding="async"{}>'
+        '</picture>',
+        srcset(webp), sizes, jpeg[0][1], srcset(jpeg), sizes, alt, css_class, loading, dimensions,
+    )
+
+
+def background_declarations(instance, width):
+    fallback = best_url(instance, width)
+    if not variant_urls(instance, 'jpeg'):
+        return format_html("background-image: url('{}');", fallback)
+    candidates = format_html_join(', ', "url('{}') type('{}') {}", (
+        (best_url(instance, width * density, key), content_type, f'{density}x')
+        for key, _, _, content_type in FORMATS
+        for density in (1, 2)
+    ))
+    return format_html(
+        "background-image: url('{}'); background-image: image-set({});", fallback, candidates,
+    )
+
+
+@register.simple_tag
+def background_image(instance, width):
+    """
+    ``background-image`` declarations for an element about ``width`` CSS
+    pixels wide: an ``image-set()`` of the WebP and JPEG variants at 1x and
+    2x, after a plain JPEG ``url()`` for browsers without ``image-set``.
+
+        <div style="{% background_image product 400 %}">
+    """
+    if not instance.image:
+        return ''
+    return background_declarations(instance, int(width))
+
+
+@register.simple_tag
+def lazy_background(instance, width):
+    """
+    Attributes of an element whose background is loaded when it scrolls
+    into view (``static/js/lazy-images.js``): the inline placeholder as
+    ``style`` and the ``background_image`` declarations in
+    ``data-lazy-background``.
+
+        <div class="bg-cover" {% lazy_background product 400 %}>
+    """
+    if not instance.image:
+        return ''
+    preview = placeholder(instance)
+    style = format_html(' style="background-image: url(\'{}\');"', preview) if preview else ''
+    return format_html(
+        'data-lazy-background="{}"{}', background_declarations(instance, int(width)), style,
+    )
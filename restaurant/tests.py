@@ -1,3 +1,1555 @@
-from django.test import TestCase
+import gzip
+import importlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .models import (
+    Category, Product, IngredientCategory, Ingredient, SpecialMeal,
+    SpecialMealIngredient, Cart, CartItem, CartSpecialMeal,
+    CartSpecialMealIngredient, Order, OrderItem, OrderSpecialMeal,
+    OrderSpecialMealIngredient, ArchivedOrder, ImageJob,
+)
+from .admin import OrderAdmin
+from .archive import archivable_orders, archive_batch, archive_cutoff
+from .workflow import IllegalTransition, transition_orders
+from .cart import CartLineNotFound, DatabaseCart, avoided, avoided_writes, get_cart, is_bot
+from .catalog import (
+    CATALOG_VERSION_KEY, CustomizationError, build_catalog, catalog_version, get_catalog,
+    get_meal_index, validate_customization,
+)
+from .orders import EmptyCartError, create_order, refresh_summary
+from .queryplans import HotQuery, check_plans
+from .pricing import PRODUCT, SPECIAL, PriceTable, from_cents, get_price_table, to_cents
+
+
+class CatalogMixin:
+    """Small catalog shared by the restaurant tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='Grillades', description='')
+        cls.products = [
+            Product.objects.create(
+                name=f'Brochette {i}', category=cls.category, description='',
+                image='products/m.jpg', price=Decimal('150.00') + i,
+            )
+            for i in range(12)
+        ]
+        cls.ing_category = IngredientCategory.objects.create(name='Sauces')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Sauce {i}', category=cls.ing_category, price=Decimal('20.00') * i,
+            )
+            for i in range(4)
+        ]
+        cls.meal = SpecialMeal.objects.create(
+            name='Machaoui', description='', base_price=Decimal('400.00'),
+            image='special_meals/m.jpg',
+        )
+        for ingredient in cls.ingredients:
+            SpecialMealIngredient.objects.create(
+                special_meal=cls.meal, ingredient=ingredient, max_quantity=3,
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def make_request(self):
+        request = RequestFactory().get('/')
+        SessionMiddleware(lambda r: None).process_request(request)
+        return request
+
+    def fill_cart(self, cart, lines):
+        for product in self.products[:lines]:
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        for _ in range(lines):
+            special = CartSpecialMeal.objects.create(
+                cart=cart, special_meal=self.meal, quantity=1, total_price=0,
+            )
+            for ingredient in self.ingredients:
+                CartSpecialMealIngredient.objects.create(
+                    cart_special_meal=special, ingredient=ingredient, quantity=2,
+                )
+            special.calculate_total()
+            special.save()
+
+
+class CreateOrderTests(CatalogMixin, TestCase):
+
+    def place(self, lines):
+        cart = DatabaseCart(self.make_request())
+        self.fill_cart(cart.cart, lines)
+        cart.reconcile(fix=True)
+        expected_total = cart.total
+        with CaptureQueriesContext(connection) as ctx:
+            order = create_order(cart, customer_phone='0550000000')
+        return cart.cart, order, expected_total, len(ctx.captured_queries)
+
+    def test_order_matches_cart(self):
+        cart, order, expected_total, _ = self.place(3)
+
+        self.assertEqual(order.total_price, expected_total)
+        self.assertEqual(order.items.count(), 3)
+        self.assertEqual(order.special_meals.count(), 3)
+        special = order.special_meals.first()
+        self.assertEqual(special.selected_ingredients.count(), len(self.ingredients))
+        self.assertEqual(special.base_price, self.meal.base_price)
+        self.assertFalse(cart.cart_items.exists())
+        self.assertFalse(cart.cart_special_meals.exists())
+        self.assertFalse(CartSpecialMealIngredient.objects.exists())
+
+    def test_query_count_does_not_grow_with_cart(self):
+        _, _, _, small = self.place(1)
+        _, _, _, large = self.place(10)
+
+        # restaurant/orders.py: 3 reads and 10 writes, plus the savepoints
+        # of create_order and of the cart clean-up (inside the test's
+        # transaction) and their releases
+        self.assertEqual(small, 17)
+        self.assertEqual(large, 17)
+
+    def test_empty_cart_is_rejected(self):
+        cart = DatabaseCart(self.make_request())
+
+        with self.assertRaises(EmptyCartError):
+            create_order(cart, customer_phone='0550000000')
+        self.assertFalse(Order.objects.exists())
+
+
+class SessionCartTests(CatalogMixin, TestCase):
+
+    def add_special(self, quantity=1):
+        return self.client.post(
+            reverse('restaurant:add_special_meal'),
+            json.dumps({
+                'meal_id': self.meal.id,
+                'quantity': quantity,
+                'ingredients': [{'id': ing.id, 'quantity': 2} for ing in self.ingredients],
+                'notes': 'Bien cuit',
+            }),
+            content_type='application/json',
+        )
+
+    def test_browsing_writes_nothing(self):
+        for name in ('restaurant:order', 'restaurant:cart'):
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(reverse(name))
+            writes = [q['sql'] for q in ctx.captured_queries if not q['sql'].startswith('SELECT')]
+            self.assertEqual(writes, [])
+        self.assertFalse(Cart.objects.exists())
+
+    def test_lines_and_totals_match_database_cart(self):
+        self.client.post(reverse('restaurant:add_to_cart'), {'product_id': self.products[0].id})
+        self.client.post(reverse('restaurant:add_to_cart'), {'product_id': self.products[0].id})
+        response = self.add_special(quantity=2)
+
+        db_cart = DatabaseCart(self.make_request())
+        db_cart.add_product(self.products[0], 2)
+        db_cart.add_special_meal(validate_customization(
+            self.meal.id, 2, [{'id': ing.id, 'quantity': 2} for ing in self.ingredients],
+            'Bien cuit',
+        ))
+        self.assertEqual(Decimal(str(response.json()['cart_total'])), db_cart.total)
+        self.assertEqual(response.json()['cart_count'], 2)
+        self.assertFalse(Cart.objects.exclude(pk=db_cart.cart.pk).exists())
+
+        response = self.client.get(reverse('restaurant:cart'))
+        special = response.context['cart_special_meals'][0]
+        self.assertEqual(special.notes, 'Bien cuit')
+        self.assertEqual(len(special.selected_ingredients.all()), len(self.ingredients))
+
+    def test_update_and_remove(self):
+        self.client.post(reverse('restaurant:add_to_cart'), {'product_id': self.products[0].id})
+        self.add_special()
+        items = self.client.get(reverse('restaurant:cart')).context['cart_items']
+
+        response = self.client.post(
+            reverse('restaurant:update_cart'),
+            {'item_id': items[0].id, 'quantity': 3, 'type': 'product'},
+        )
+        self.assertTrue(response.json()['success'])
+        response = self.client.post(
+            reverse('restaurant:remove_from_cart'), {'item_id': items[0].id, 'type': 'product'},
+        )
+        self.assertEqual(response.json()['cart_count'], 1)
+
+        response = self.client.post(
+            reverse('restaurant:update_cart'), {'item_id': 999, 'quantity': 3, 'type': 'product'},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(RESTAURANT_CART_ADMIN_MIRROR=True)
+    def test_checkout_mirrors_cart_for_admin(self):
+        self.client.post(reverse('restaurant:add_to_cart'), {'product_id': self.products[0].id})
+        self.add_special()
+
+        response = self.client.get(reverse('restaurant:checkout'))
+
+        cart = Cart.objects.get(session_key=self.client.session.session_key)
+        self.assertEqual(cart.cart_items.count(), 1)
+        self.assertEqual(cart.cart_special_meals.get().selected_ingredients.count(), 4)
+        self.assertEqual(cart.get_total(), response.context['cart_total'])
+
+        # Gone from the admin once the order is placed
+        self.client.post(reverse('restaurant:place_order'), {'phone': '0550000000'})
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+
+
+@override_settings(RESTAURANT_CART_BACKEND='restaurant.cart.DatabaseCart')
+class CartTotalsTests(CatalogMixin, TestCase):
+
+    def add_to_cart(self, product):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('restaurant:add_to_cart'), {'product_id': product.id})
+        return response.json(), len(ctx.captured_queries)
+
+    def test_every_mutation_keeps_totals_in_sync(self):
+        cart = DatabaseCart(self.make_request())
+        cart.add_product(self.products[0], 2)
+        cart.add_product(self.products[0], 1)
+        cart.add_special_meal(validate_customization(
+            self.meal.id, 2, [{'id': ing.id} for ing in self.ingredients],
+        ))
+        item = cart.items[0]
+        special = cart.special_meals[0]
+        cart.update_quantity('product', item.id, 5)
+        cart.update_quantity('special', special.id, 1)
+        cart.remove('product', item.id)
+
+        self.assertEqual(cart.reconcile(), (0, 0))
+        self.assertEqual(cart.total, special.special_meal.base_price + Decimal('120.00'))
+        self.assertEqual(cart.count, 1)
+
+        cart.clear()
+        self.assertEqual((cart.total, cart.count), (0, 0))
+        self.assertEqual(cart.reconcile(), (0, 0))
+
+    def test_reconcile_detects_and_fixes_drift(self):
+        cart = DatabaseCart(self.make_request())
+        cart.add_product(self.products[0], 2)
+        Cart.objects.filter(pk=cart.cart.pk).update(total_price=1, items_count=4)
+        cart.cart.refresh_from_db()
+
+        self.assertEqual(cart.reconcile(), (1 - self.products[0].price * 2, 3))
+        cart.reconcile(fix=True)
+        self.assertEqual(cart.reconcile(), (0, 0))
+
+    def test_invalid_quantities_leave_totals_alone(self):
+        self.add_to_cart(self.products[0])
+        response = self.client.post(
+            reverse('restaurant:add_to_cart'), {'product_id': self.products[0].id, 'quantity': -5},
+        )
+        self.assertEqual(response.status_code, 400)
+        cart = Cart.objects.get()
+        self.assertEqual((cart.total_price, cart.items_count), (self.products[0].price, 1))
+
+        # A line priced out of the catalog is not found, not a server error
+        db_cart = DatabaseCart(self.make_request())
+        db_cart.add_product(self.products[0], 1)
+        with patch('restaurant.models.get_price_table', return_value=PriceTable(0, {}, {}, {})):
+            with self.assertRaises(CartLineNotFound):
+                db_cart.update_quantity(PRODUCT, db_cart.items[0].id, 2)
+
+    def test_cart_response_cost_does_not_grow_with_lines(self):
+        self.add_to_cart(self.products[0])
+        data, first = self.add_to_cart(self.products[1])
+        for product in self.products[2:10]:
+            data, last = self.add_to_cart(product)
+
+        self.assertEqual(first, last)
+        self.assertEqual(data['cart_count'], 10)
+        self.assertEqual(Decimal(str(data['cart_total'])), sum(p.price for p in self.products[:10]))
+
+    def test_session_cart_prices_from_the_snapshot(self):
+        with self.settings(RESTAURANT_CART_BACKEND='restaurant.cart.SessionCart'):
+            self.client.post(reverse('restaurant:add_to_cart'), {'product_id': self.products[0].id, 'quantity': 2})
+            request = self.make_request()
+            request.session = self.client.session
+            request.session.keys()
+            get_catalog()
+            with self.assertNumQueries(0):
+                cart = get_cart(request)
+                [item], specials = cart.lines()
+            self.assertEqual(item.product, self.products[0])
+            self.assertEqual(cart.total, from_cents(get_price_table().product(self.products[0].id, 2)))
+
+    def test_session_cart_badge_costs_no_query(self):
+        with self.settings(RESTAURANT_CART_BACKEND='restaurant.cart.SessionCart'):
+            self.client.post(reverse('restaurant:add_to_cart'), {'product_id': self.products[0].id})
+            request = self.make_request()
+            request.session = self.client.session
+            request.session.keys()
+            with self.assertNumQueries(0):
+                cart = get_cart(request)
+                self.assertEqual((cart.total, cart.count), (self.products[0].price, 1))
+
+
+class MealIndexTests(CatalogMixin, TestCase):
+
+    def selection(self, quantity=1, ingredients=None):
+        return [{'id': ing.id, 'quantity': quantity} for ing in ingredients or self.ingredients]
+
+    def test_prices_customization_in_memory(self):
+        get_meal_index(self.meal.id)
+
+        with self.assertNumQueries(0):
+            customization = validate_customization(self.meal.id, 2, self.selection(2))
+
+        extras = sum(ing.price * 2 for ing in self.ingredients)
+        self.assertEqual(customization.unit_price, self.meal.base_price + extras)
+        self.assertEqual(customization.total_price, (self.meal.base_price + extras) * 2)
+
+    def test_enforces_meal_rules(self):
+        other = Ingredient.objects.create(name='Frites', category=self.ing_category)
+        invalid = [
+            (self.meal.id, 1, self.selection(4)),
+            (self.meal.id, 1, self.selection(2) + self.selection(2)),
+            (self.meal.id, 1, self.selection(ingredients=[other])),
+            (self.meal.id, 0, []),
+            (999, 1, []),
+            (self.meal.id, 1, [{'quantity': 1}]),
+        ]
+        for args in invalid:
+            with self.subTest(args=args), self.assertRaises(CustomizationError):
+                validate_customization(*args)
+
+    def test_admin_edits_rebuild_index(self):
+        self.assertEqual(get_meal_index(self.meal.id).get(self.ingredients[0].id).max_quantity, 3)
+
+        ingredient = self.ingredients[0]
+        ingredient.is_available = False
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        with self.assertRaises(CustomizationError):
+            validate_customization(self.meal.id, 1, self.selection(ingredients=[ingredient]))
+
+        rule = SpecialMealIngredient.objects.get(special_meal=self.meal, ingredient=self.ingredients[1])
+        rule.max_quantity = 5
+        with self.captureOnCommitCallbacks(execute=True):
+            rule.save()
+        self.assertEqual(get_meal_index(self.meal.id).get(self.ingredients[1].id).max_quantity, 5)
+
+    @override_settings(RESTAURANT_CART_BACKEND='restaurant.cart.DatabaseCart')
+    def test_selections_are_bulk_inserted(self):
+        cart = DatabaseCart(self.make_request())
+        cart.cart  # the session and the Cart row are created by the first mutation
+        customization = validate_customization(self.meal.id, 1, self.selection())
+
+        with CaptureQueriesContext(connection) as ctx:
+            cart.add_special_meal(customization)
+
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(CartSpecialMealIngredient.objects.count(), len(self.ingredients))
+
+    def test_customize_page_uses_meal_rules(self):
+        SpecialMealIngredient.objects.filter(ingredient=self.ingredients[0]).update(is_default=True)
+        cache.clear()
+
+        response = self.client.get(reverse('restaurant:customize_meal', args=[self.meal.id]))
+
+        entries = [entry for group in response.context['ingredient_groups'] for entry in group.entries]
+        self.assertEqual([rule.is_default for _, rule in entries], [True, False, False, False])
+        self.assertContains(response, 'max="3"')
+
+
+class CatalogSnapshotTests(CatalogMixin, TestCase):
+
+    def test_public_pages_render_without_queries(self):
+        urls = [
+            reverse('restaurant:menu'),
+            reverse('restaurant:order'),
+            reverse('restaurant:customize_meal', args=[self.meal.id]),
+        ]
+        get_catalog()
+
+        for url in urls:
+            with self.subTest(url=url), self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Sauce 3')
+
+    def test_build_uses_fixed_number_of_queries(self):
+        with self.assertNumQueries(6):
+            build_catalog(1)
+        for i in range(20):
+            Product.objects.create(
+                name=f'Extra {i}', category=self.category, description='',
+                image='products/m.jpg', price=100,
+            )
+        with self.assertNumQueries(6):
+            catalog = build_catalog(2)
+        self.assertEqual(len(catalog.categories[0].products), 32)
+
+    def test_admin_edit_invalidates_snapshot(self):
+        before = get_catalog()
+        self.assertIs(get_catalog(), before)
+
+        product = self.products[0]
+        product.is_available = False
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            product.save()
+            # Not before the commit: the new version would be built from the old rows
+            self.assertIs(get_catalog(), before)
+        self.assertEqual(len(callbacks), 1)
+
+        after = get_catalog()
+        self.assertGreater(after.version, before.version)
+        self.assertNotIn(product, after.categories[0].products)
+        response = self.client.post(reverse('restaurant:add_to_cart'), {'product_id': product.id})
+        self.assertEqual(response.status_code, 400)
+
+    def test_version_never_goes_back_after_eviction(self):
+        before = get_catalog()
+        cache.delete(CATALOG_VERSION_KEY)
+
+        self.assertGreater(catalog_version(), before.version)
+
+    def test_snapshot_is_immutable(self):
+        with self.assertRaises(AttributeError):
+            get_catalog().categories = ()
+
+
+class FragmentCacheTests(CatalogMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        caches['fragments'].clear()
+
+    def test_catalog_edit_refreshes_fragment(self):
+        self.assertContains(self.client.get(reverse('restaurant:menu')), 'Brochette 0')
+
+        product = self.products[0]
+        product.name = 'Brochette royale'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        response = self.client.get(reverse('restaurant:menu'))
+        self.assertContains(response, 'Brochette royale')
+        self.assertNotContains(response, 'Brochette 0<')
+
+    def test_cart_bar_is_not_cached(self):
+        self.client.get(reverse('restaurant:order'))
+        self.client.post(reverse('restaurant:add_to_cart'), {'product_id': self.products[0].id})
+
+        response = self.client.get(reverse('restaurant:order'))
+
+        self.assertContains(response, '<span id="cart-count">1</span>', html=False)
+
+    def test_fragment_is_reused(self):
+        self.client.get(reverse('restaurant:order'))
+        # Changing the snapshot objects in place is not an admin edit: the
+        # cached fragment must still be served for the same version.
+        get_catalog().categories[0].products[0].name = 'Changed in memory'
+        try:
+            response = self.client.get(reverse('restaurant:order'))
+        finally:
+            get_catalog().categories[0].products[0].name = 'Brochette 0'
+
+        self.assertNotContains(response, 'Changed in memory')
+
+
+class CatalogApiTests(CatalogMixin, TestCase):
+
+    def test_serves_full_catalog(self):
+        response = self.client.get(reverse('restaurant:catalog_api'))
+
+        data = response.json()
+        self.assertEqual(data['version'], get_catalog().version)
+        self.assertEqual(len(data['categories'][0]['products']), 12)
+        self.assertEqual(data['categories'][0]['products'][0]['price'], '150.00')
+        self.assertEqual(len(data['special_meals'][0]['ingredients']), 4)
+        self.assertEqual(data['special_meals'][0]['ingredients'][0]['max_quantity'], 3)
+        self.assertEqual(len(data['ingredient_categories'][0]['ingredients']), 4)
+        self.assertEqual(response['Cache-Control'], 'public, no-cache')
+
+    def test_conditional_get(self):
+        url = reverse('restaurant:catalog_api')
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        product = self.products[0]
+        product.price = 175
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_precompressed_body(self):
+        url = reverse('restaurant:catalog_api')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, br')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)), self.client.get(url).json())
+        self.assertNotEqual(response['ETag'], self.client.get(url)['ETag'])
+
+    def test_versioned_url_is_immutable(self):
+        version = get_catalog().version
+        response = self.client.get(reverse('restaurant:catalog_api'), {'v': version})
+
+        self.assertIn('immutable', response['Cache-Control'])
+
+
+class LazyCartTests(CatalogMixin, TestCase):
+    BOT = 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+
+    def setUp(self):
+        super().setUp()
+        avoided.reset()
+
+    def browse(self, **extra):
+        writes = []
+        for name in ('restaurant:order', 'restaurant:cart', 'restaurant:checkout', 'restaurant:menu'):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse(name), **extra)
+            self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+            writes += [q['sql'] for q in ctx.captured_queries if not q['sql'].startswith('SELECT')]
+        return writes
+
+    def test_read_only_views_create_nothing(self):
+        for backend in ('restaurant.cart.SessionCart', 'restaurant.cart.DatabaseCart'):
+            with self.subTest(backend=backend), self.settings(RESTAURANT_CART_BACKEND=backend):
+                self.assertEqual(self.browse(), [])
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(avoided_writes(), {'sessions': 8, 'carts': 8, 'bot_reads': 0})
+
+    @override_settings(RESTAURANT_CART_BACKEND='restaurant.cart.DatabaseCart')
+    def test_first_mutation_creates_the_cart(self):
+        response = self.client.get(reverse('restaurant:cart'))
+        self.assertEqual(response.context['cart_total'], Decimal('0.00'))
+
+        self.client.post(reverse('restaurant:add_to_cart'), {'product_id': self.products[0].id})
+
+        cart = Cart.objects.get(session_key=self.client.session.session_key)
+        self.assertEqual(cart.items_count, 1)
+        response = self.client.get(reverse('restaurant:cart'))
+        self.assertEqual(response.context['cart_total'], self.products[0].price)
+        self.assertEqual(avoided_writes()['carts'], 1)
+
+    def test_crawlers_get_a_read_only_cart(self):
+        for backend in ('restaurant.cart.SessionCart', 'restaurant.cart.DatabaseCart'):
+            with self.subTest(backend=backend), self.settings(RESTAURANT_CART_BACKEND=backend):
+                self.assertEqual(self.browse(HTTP_USER_AGENT=self.BOT), [])
+                response = self.client.post(
+                    reverse('restaurant:add_to_cart'), {'product_id': self.products[0].id},
+                    HTTP_USER_AGENT=self.BOT,
+                )
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(avoided_writes()['bot_reads'], 8)
+        self.assertTrue(is_bot(RequestFactory().get('/', HTTP_USER_AGENT=self.BOT)))
+        self.assertFalse(is_bot(RequestFactory().get('/', HTTP_USER_AGENT='Mozilla/5.0 (X11; Linux) Firefox/140.0')))
+
+
+class CartBatchTests(CatalogMixin, TestCase):
+    BACKENDS = ('restaurant.cart.SessionCart', 'restaurant.cart.DatabaseCart')
+
+    def batch(self, operations):
+        return self.client.post(
+            reverse('restaurant:update_cart_batch'), json.dumps({'operations': operations}),
+            content_type='application/json',
+        )
+
+    def test_mixed_operations_in_one_request(self):
+        for backend in self.BACKENDS:
+            with self.subTest(backend=backend), self.settings(RESTAURANT_CART_BACKEND=backend):
+                self.client = Client()
+                response = self.batch([
+                    {'op': 'add', 'type': 'product', 'id': self.products[0].id, 'quantity': 1},
+                    {'op': 'add', 'type': 'product', 'id': self.products[1].id},
+                    {'op': 'add', 'type': 'special', 'meal_id': self.meal.id, 'quantity': 2,
+                     'ingredients': [{'id': self.ingredients[1].id, 'quantity': 2}]},
+                ])
+                lines = {(line['type'], line['id']) for line in response.json()['lines']}
+                product_ids = sorted(line_id for line_type, line_id in lines if line_type == PRODUCT)
+                special_id = next(line_id for line_type, line_id in lines if line_type == SPECIAL)
+
+                response = self.batch([
+                    {'op': 'update', 'type': 'product', 'item_id': product_ids[0], 'quantity': 4},
+                    {'op': 'remove', 'type': 'product', 'item_id': product_ids[1]},
+                    {'op': 'update', 'type': 'special', 'item_id': special_id, 'quantity': 1},
+                ])
+
+                data = response.json()
+                expected = (self.products[0].price * 4
+                            + self.meal.base_price + self.ingredients[1].price * 2)
+                self.assertEqual(Decimal(str(data['cart_total'])), expected)
+                self.assertEqual(data['cart_count'], 2)
+                cart = self.client.get(reverse('restaurant:cart')).context['cart']
+                self.assertEqual(cart.total, expected)
+                self.assertEqual(cart.reconcile(), (Decimal('0.00'), 0))
+
+    def test_invalid_operation_rolls_back_the_batch(self):
+        for backend in self.BACKENDS:
+            with self.subTest(backend=backend), self.settings(RESTAURANT_CART_BACKEND=backend):
+                self.client = Client()
+                self.client.post(reverse('restaurant:add_to_cart'), {'product_id': self.products[0].id})
+                item = self.client.get(reverse('restaurant:cart')).context['cart_items'][0]
+
+                response = self.batch([
+                    {'op': 'update', 'type': 'product', 'item_id': item.id, 'quantity': 5},
+                    {'op': 'add', 'type': 'product', 'id': self.products[1].id},
+                    {'op': 'remove', 'type': 'product', 'item_id': item.id},
+                    {'op': 'update', 'type': 'product', 'item_id': 999, 'quantity': 2},
+                ])
+
+                self.assertEqual(response.status_code, 400)
+                response = self.client.get(reverse('restaurant:cart'))
+                self.assertEqual([line.quantity for line in response.context['cart_items']], [1])
+                self.assertEqual(response.context['cart_total'], self.products[0].price)
+
+    def test_rejects_malformed_batches(self):
+        response = self.batch([{'op': 'update', 'type': 'product', 'item_id': 1, 'quantity': 0}])
+        self.assertEqual(response.json()['message'], 'Opération 1: Quantité invalide')
+        response = self.batch([{'op': 'remove', 'type': 'product', 'item_id': 1}] * 51)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Session.objects.exists())
+
+    def test_session_batch_cost_does_not_grow_with_operations(self):
+        self.client.post(reverse('restaurant:add_to_cart'), {'product_id': self.products[0].id})
+        item = self.client.get(reverse('restaurant:cart')).context['cart_items'][0]
+        counts = []
+        for size in (1, 20):
+            operations = [
+                {'op': 'update', 'type': 'product', 'item_id': item.id, 'quantity': q + 1}
+                for q in range(size)
+            ]
+            with CaptureQueriesContext(connection) as ctx:
+                self.batch(operations)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class MediaMixin:
+    """Uploads go to a temporary MEDIA_ROOT"""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def upload(self, size=(1200, 800), name='photo.jpg', exif=None):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (200, 120, 40)).save(buffer, 'JPEG', quality=95, exif=exif or b'')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(RESTAURANT_IMAGE_JOBS=False)
+class ImageVariantTests(MediaMixin, CatalogMixin, TestCase):
+
+    def test_upload_builds_hashed_variants(self):
+        product = Product.objects.create(
+            name='Côtelettes', category=self.category, description='',
+            image=self.upload(), price=Decimal('900.00'),
+        )
+
+        variants = Product.objects.get(pk=product.pk).image_variants
+        self.assertEqual(variants['source'], product.image.name)
+        self.assertEqual((variants['width'], variants['height']), (1200, 800))
+        self.assertEqual(sorted(variants['webp'], key=int), ['160', '320', '640', '960'])
+        name = variants['jpeg']['320']
+        self.assertEqual(name, f"derived/products/{variants['hash']}-320.jpg")
+        with product.image.storage.open(variants['webp']['640']) as handle:
+            self.assertEqual(Image.open(handle).size, (640, 427))
+
+        # Same bytes uploaded again: same names, nothing rewritten
+        other = Product.objects.create(
+            name='Côtelettes 2', category=self.category, description='',
+            image=self.upload(), price=Decimal('900.00'),
+        )
+        self.assertEqual(other.image_variants['jpeg'], variants['jpeg'])
+
+    def test_small_images_are_not_upscaled(self):
+        ingredient = Ingredient.objects.create(
+            name='Harissa', category=self.ing_category, image=self.upload((120, 90)),
+        )
+
+        self.assertEqual(list(ingredient.image_variants['webp']), ['120'])
+
+    def test_template_tags(self):
+        product = Product.objects.create(
+            name='Merguez', category=self.category, description='',
+            image=self.upload(), price=Decimal('300.00'),
+        )
+        template = Template(
+            '{% load restaurant_images %}'
+            '{% responsive_image product sizes="96px" alt=product.name %}'
+            '|{% background_image product 400 %}'
+        )
+
+        picture, style = template.render(Context({'product': product})).split('|')
+        self.assertIn('<source type="image/webp"', picture)
+        self.assertIn('-960.webp 960w', picture)
+        self.assertIn('width="1200" height="800"', picture)
+        self.assertIn("url('/media/derived/products/", style)
+        self.assertIn("-640.jpg') type('image/jpeg') 1x", style)
+        self.assertIn("-960.webp') type('image/webp') 2x", style)
+
+        # Without variants the original file is used
+        html = template.render(Context({'product': self.products[0]}))
+        self.assertIn('src="/media/products/m.jpg"', html)
+        self.assertIn("background-image: url('/media/products/m.jpg');", html)
+
+    def test_backfill_command(self):
+        product = Product.objects.create(
+            name='Merguez', category=self.category, description='',
+            image=self.upload(), price=Decimal('300.00'),
+        )
+        Product.objects.filter(pk=product.pk).update(image_variants={})
+
+        out = io.StringIO()
+        with self.assertLogs('restaurant.images', 'WARNING'):
+            call_command('build_image_variants', stdout=out, stderr=io.StringIO())
+
+        self.assertTrue(Product.objects.get(pk=product.pk).image_variants['webp'])
+        # The catalog fixtures point at files that do not exist here
+        self.assertIn('1 image(s) processed, 4 up to date, 13 failed', out.getvalue())
+
+
+class ImageJobTests(MediaMixin, CatalogMixin, TestCase):
+
+    def run_worker(self, workers=0):
+        out = io.StringIO()
+        call_command('run_image_worker', '--once', '--workers', str(workers), stdout=out, stderr=out)
+        return out.getvalue()
+
+    def create_product(self, **kwargs):
+        return Product.objects.create(
+            name='Côtelettes', category=self.category, description='',
+            image=kwargs.pop('image', None) or self.upload(), price=Decimal('900.00'), **kwargs,
+        )
+
+    def test_save_only_queues_a_job(self):
+        product = self.create_product()
+
+        job = ImageJob.objects.get()
+        self.assertEqual((job.model, job.object_id, job.source), ('product', product.pk, product.image.name))
+        self.assertEqual(Product.objects.get(pk=product.pk).image_variants, {})
+        # Until the worker ran, templates use the original file
+        html = Template('{% load restaurant_images %}{% responsive_image p %}').render(Context({'p': product}))
+        self.assertIn(f'src="/media/{product.image.name}"', html)
+
+        # Saving again without a new upload does not queue anything
+        product.price = Decimal('950.00')
+        product.save()
+        self.assertEqual(ImageJob.objects.count(), 1)
+
+    def test_worker_pool_builds_variants(self):
+        products = [self.create_product() for _ in range(3)]
+        version = catalog_version()
+
+        self.assertIn('3 job(s) processed', self.run_worker(workers=2))
+
+        self.assertFalse(ImageJob.objects.exclude(status='done').exists())
+        for product in products:
+            product.refresh_from_db()
+            self.assertEqual(sorted(product.image_variants['jpeg'], key=int), ['160', '320', '640', '960'])
+        self.assertNotEqual(catalog_version(), version)
+
+    def test_orientation_is_fixed_and_metadata_removed(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotated 90° clockwise
+        exif[0x010F] = 'Phone'
+        product = self.create_product(image=self.upload((400, 300), exif=exif.tobytes()))
+
+        self.run_worker()
+
+        with product.image.storage.open(product.image.name) as handle:
+            original = Image.open(handle)
+            self.assertEqual(original.size, (300, 400))
+            self.assertFalse(original.getexif())
+        product.refresh_from_db()
+        self.assertEqual((product.image_variants['width'], product.image_variants['height']), (300, 400))
+
+    def test_original_survives_a_failed_rewrite(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        product = self.create_product(image=self.upload((400, 300), exif=exif.tobytes()))
+        path = product.image.path
+        with open(path, 'rb') as handle:
+            before = handle.read()
+
+        with patch('restaurant.images.os.replace', side_effect=OSError('disk full')):
+            self.run_worker()
+        with open(path, 'rb') as handle:
+            self.assertEqual(handle.read(), before)
+        self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(path)])
+
+        ImageJob.objects.update(run_after=timezone.now())
+        self.run_worker()
+        with open(path, 'rb') as handle:
+            self.assertNotEqual(handle.read(), before)
+
+    def test_failed_jobs_are_retried_then_given_up(self):
+        product = self.create_product()
+        product.image.storage.delete(product.image.name)
+
+        self.run_worker()
+        job = ImageJob.objects.get()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertIn('FileNotFoundError', job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+
+        for attempt in (2, 3):
+            ImageJob.objects.update(run_after=timezone.now())
+            self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 3))
+
+    def test_jobs_are_idempotent(self):
+        product = self.create_product()
+        self.run_worker()
+        product.refresh_from_db()
+        variants = product.image_variants
+
+        # A job whose worker died is claimed again and gives the same result
+        ImageJob.objects.update(status='running', locked_at=timezone.now() - timedelta(hours=1))
+        self.run_worker()
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants, variants)
+        self.assertEqual(ImageJob.objects.get().status, 'done')
+
+        # A job for an image that was replaced since is dropped
+        stale = ImageJob.objects.create(model='product', object_id=product.pk, source='products/old.jpg')
+        self.run_worker()
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'done')
+        self.assertEqual(Product.objects.get(pk=product.pk).image_variants, variants)
+
+    def test_jobs_that_kill_their_worker_are_given_up(self):
+        self.create_product()
+        ImageJob.objects.update(status='running', locked_at=timezone.now() - timedelta(hours=1), attempts=3)
+
+        self.assertIn('0 job(s) processed', self.run_worker())
+        job = ImageJob.objects.get()
+        self.assertEqual((job.status, job.attempts, job.locked_at), ('failed', 3, None))
+
+
+@override_settings(RESTAURANT_IMAGE_JOBS=False)
+class LazyImageTests(MediaMixin, CatalogMixin, TestCase):
+
+    def photo(self, name):
+        buffer = io.BytesIO()
+        Image.effect_noise((1200, 800), 40).convert('RGB').save(buffer, 'JPEG', quality=90)
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_placeholder_is_stored_with_the_variants(self):
+        ingredient = Ingredient.objects.create(
+            name='Harissa', category=self.ing_category, image=self.photo('harissa.jpg'),
+        )
+
+        preview = ingredient.image_variants['placeholder']
+        self.assertTrue(preview.startswith('data:image/jpeg;base64,'))
+        self.assertLess(len(preview), 600)
+
+    def test_catalog_pages_only_inline_placeholders(self):
+        uploaded = [
+            Product.objects.create(
+                name=f'Grillade {i}', category=self.category, description='',
+                image=self.photo(f'grillade-{i}.jpg'), price=Decimal('500.00'),
+            )
+            for i in range(6)
+        ]
+        original_bytes = sum(product.image.size for product in uploaded)
+
+        # The order page also lists the special meal
+        for name, cards in (('restaurant:menu', 18), ('restaurant:order', 19)):
+            html = self.client.get(reverse(name)).content.decode()
+            # What the browser fetches before any scrolling
+            eager = re.sub(r'data-lazy-background="[^"]*"', '', html)
+            self.assertNotIn('/media/', eager)
+            inline = sum(len(uri) for uri in re.findall(r'data:image/jpeg;base64,[^&\'"]+', eager))
+            self.assertEqual(html.count('data-lazy-background='), cards)
+            self.assertLess(inline, original_bytes * 0.2)
+
+
+class PricingEngineTests(CatalogMixin, TestCase):
+    """Randomized checks of the integer-cent engine against the Decimal formulas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        rng = random.Random(8)
+        for product in cls.products:
+            product.price = Decimal(rng.randint(1, 500000)) / 100
+            product.save()
+        for ingredient in cls.ingredients:
+            ingredient.price = Decimal(rng.randint(0, 9999)) / 100
+            ingredient.save()
+
+    def random_configurations(self, rng, count):
+        configurations = []
+        for _ in range(count):
+            if rng.random() < 0.5:
+                product = rng.choice(self.products)
+                quantity = rng.randint(1, 30)
+                expected = product.price * quantity
+                configurations.append(((PRODUCT, product.id, quantity), expected))
+            else:
+                quantity = rng.randint(1, 30)
+                selected = rng.sample(self.ingredients, rng.randint(0, len(self.ingredients)))
+                selections = [(ing.id, rng.randint(1, 3)) for ing in selected]
+                # Historical CartSpecialMeal.calculate_total formula
+                expected = self.meal.base_price * quantity
+                for ing, (_, ing_quantity) in zip(selected, selections):
+                    expected += ing.price * ing_quantity * quantity
+                configurations.append(((SPECIAL, self.meal.id, quantity, selections), expected))
+        return configurations
+
+    def test_matches_decimal_results(self):
+        rng = random.Random(2024)
+        prices = get_price_table()
+        configurations = self.random_configurations(rng, 500)
+
+        totals = prices.quote_many([config for config, _ in configurations])
+
+        for (config, expected), cents in zip(configurations, totals):
+            self.assertEqual(from_cents(cents), expected, config)
+            if config[0] == PRODUCT:
+                self.assertEqual(prices.product(config[1], config[2]), cents)
+            else:
+                self.assertEqual(prices.special_meal(*config[1:]), cents)
+
+    def test_cart_backends_price_like_the_engine(self):
+        rng = random.Random(7)
+        for backend in ('restaurant.cart.SessionCart', 'restaurant.cart.DatabaseCart'):
+            with self.subTest(backend=backend), self.settings(RESTAURANT_CART_BACKEND=backend):
+                client = Client()
+                expected = Decimal('0.00')
+                for (config, line_total) in self.random_configurations(rng, 20):
+                    if config[0] == PRODUCT:
+                        client.post(reverse('restaurant:add_to_cart'),
+                                    {'product_id': config[1], 'quantity': config[2]})
+                    else:
+                        client.post(
+                            reverse('restaurant:add_special_meal'),
+                            json.dumps({
+                                'meal_id': config[1], 'quantity': config[2],
+                                'ingredients': [{'id': i, 'quantity': q} for i, q in config[3]],
+                            }),
+                            content_type='application/json',
+                        )
+                    expected += line_total
+                response = client.get(reverse('restaurant:cart'))
+                self.assertEqual(response.context['cart_total'], expected)
+                lines = response.context['cart_items'] + response.context['cart_special_meals']
+                self.assertEqual(sum(line.total_price for line in lines), expected)
+
+    def test_unknown_ids_are_not_priced(self):
+        prices = get_price_table()
+
+        self.assertEqual(
+            prices.quote_many([(PRODUCT, 999, 1), (SPECIAL, self.meal.id, 1, [(999, 1)]), None]),
+            [None, None, None],
+        )
+
+    def test_batch_quote_endpoint(self):
+        items = [
+            {'type': 'product', 'id': self.products[0].id, 'quantity': 3},
+            {'type': 'special', 'meal_id': self.meal.id, 'quantity': 2,
+             'ingredients': [{'id': self.ingredients[1].id, 'quantity': 2}]},
+            {'type': 'product', 'id': 'abc'},
+        ]
+        get_price_table()  # warm the snapshot: quoting itself never queries
+
+        with self.assertNumQueries(0):
+            response = self.client.post(
+                reverse('restaurant:quote'), json.dumps({'items': items}),
+                content_type='application/json',
+            )
+
+        quotes = response.json()['quotes']
+        self.assertEqual(quotes[0]['total_cents'], to_cents(self.products[0].price) * 3)
+        self.assertEqual(
+            from_cents(quotes[1]['total_cents']),
+            (self.meal.base_price + self.ingredients[1].price * 2) * 2,
+        )
+        self.assertIn('error', quotes[2])
+
+    def test_customize_page_embeds_cent_prices(self):
+        response = self.client.get(reverse('restaurant:customize_meal', args=[self.meal.id]))
+
+        self.assertContains(response, 'id="meal-prices"')
+        self.assertEqual(response.context['meal_prices']['base'], to_cents(self.meal.base_price))
+
+
+class PlaceOrderViewTests(CatalogMixin, TestCase):
+
+    def test_place_order_empties_cart(self):
+        for product in self.products[:2]:
+            self.client.post(reverse('restaurant:add_to_cart'), {'product_id': product.id})
+
+        response = self.client.post(reverse('restaurant:place_order'), {'phone': '0550000000'})
+
+        self.assertTrue(response.json()['success'])
+        order = Order.objects.get(id=response.json()['order_id'])
+        self.assertEqual(order.items.count(), 2)
+        self.assertEqual(self.client.get(reverse('restaurant:cart')).context['cart_total'], 0)
+
+    @override_settings(RESTAURANT_CART_BACKEND='restaurant.cart.DatabaseCart')
+    def test_place_order_with_database_cart(self):
+        self.client.post(reverse('restaurant:add_to_cart'), {'product_id': self.products[0].id})
+        cart = Cart.objects.get(session_key=self.client.session.session_key)
+
+        response = self.client.post(reverse('restaurant:place_order'), {'phone': '0550000000'})
+
+        self.assertTrue(response.json()['success'])
+        self.assertFalse(cart.cart_items.exists())
+
+    def test_place_order_requires_items(self):
+        response = self.client.post(reverse('restaurant:place_order'), {'phone': '0550000000'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], 'Panier vide')
+
+
+class OrderFeedTests(CatalogMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        admin_user = User.objects.create_superuser('gerant', password='x')
+        self.client.force_login(admin_user)
+        self.url = reverse('admin:restaurant_order_feed')
+
+    def order(self, **kwargs):
+        order = Order.objects.create(customer_phone='0550000000', total_price=Decimal('300.00'), **kwargs)
+        OrderItem.objects.create(order=order, product=self.products[0], quantity=2, unit_price=Decimal('150.00'))
+        refresh_summary(order)
+        return order
+
+    def test_changelist_carries_the_cursor(self):
+        before = timezone.now()
+        response = self.client.get(reverse('admin:restaurant_order_changelist'))
+        cursor = re.search(r'name="order-feed" content="([^"]+)" data-cursor="([^"]+)"', response.content.decode())
+        self.assertEqual(cursor.group(1), self.url)
+        self.assertGreaterEqual(datetime.fromisoformat(cursor.group(2)), before)
+
+    def test_feed_renders_new_and_updated_rows(self):
+        old = self.order(customer_name='Ancienne')
+        Order.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(minutes=1))
+        old.refresh_from_db()
+        since = timezone.now()
+        new = self.order(customer_name='Nouvelle')
+        old.status = 'ready'
+        old.save()
+
+        response = self.client.get(self.url, {'since': since.isoformat()})
+        data = response.json()
+        self.assertGreater(datetime.fromisoformat(data['cursor']), since)
+        self.assertEqual(data['removed'], [])
+        rows = {row['id']: row for row in data['rows']}
+        self.assertEqual(set(rows), {old.id, new.id})
+        self.assertTrue(rows[new.id]['created'])
+        self.assertFalse(rows[old.id]['created'])
+
+        row = rows[new.id]
+        self.assertIn('Nouvelle', row['html'])
+        self.assertIn('2x Brochette 0', row['html'])
+        self.assertIn(f'value="{new.id}" class="action-select"', row['html'])
+        self.assertIn('name="form-__prefix__-status"', row['html'])
+        self.assertIn(f'name="form-__prefix__-id" value="{new.id}"', row['hidden'])
+        self.assertNotIn('form-0-', row['html'] + row['hidden'])
+        # A few kilobytes per order, not a whole changelist
+        self.assertLess(len(response.content), 8 * 1024)
+
+        # Sent again within the grace window
+        data = self.client.get(self.url, {'since': data['cursor']}).json()
+        self.assertEqual({row['id'] for row in data['rows']}, {old.id, new.id})
+        with override_settings(ORDER_FEED_GRACE=0):
+            data = self.client.get(self.url, {'since': data['cursor']}).json()
+        self.assertEqual(data['rows'], [])
+
+    def test_feed_sends_late_commits(self):
+        since = timezone.now()
+        # Created and stamped before the cursor, committed after the poll
+        order = self.order()
+        Order.objects.filter(pk=order.pk).update(
+            created_at=since - timedelta(seconds=1), updated_at=since - timedelta(seconds=1),
+        )
+        data = self.client.get(self.url, {'since': since.isoformat()}).json()
+        self.assertEqual([row['id'] for row in data['rows']], [order.id])
+        self.assertTrue(data['rows'][0]['created'])
+
+    def test_feed_follows_the_page_filters(self):
+        since = timezone.now()
+        pending = self.order()
+        cancelled = self.order(status='cancelled')
+
+        data = self.client.get(self.url, {'since': since.isoformat(), 'status__exact': 'pending', 'p': '3'}).json()
+        self.assertEqual([row['id'] for row in data['rows']], [pending.id])
+        # Changed but no longer in the filtered list
+        self.assertEqual(data['removed'], [cancelled.id])
+
+    def test_feed_asks_for_a_reload_past_a_page(self):
+        since = timezone.now()
+        with patch.object(OrderAdmin, 'list_per_page', 2):
+            for _ in range(3):
+                self.order()
+            data = self.client.get(self.url, {'since': since.isoformat()}).json()
+        self.assertTrue(data['reload'])
+
+    def test_feed_rejects_bad_cursors(self):
+        for since in ('', 'hier', '2024-13-45T00:00', '0001-01-01T00:00:00+01:00'):
+            response = self.client.get(self.url, {'since': since})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'error': 'since'})
+
+    def test_feed_is_for_staff(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.client.logout()
+        response = self.client.get(self.url, {'since': timezone.now().isoformat()})
+        self.assertEqual(response.status_code, 302)
+
+
+class OrderAdminQueryTests(CatalogMixin, TestCase):
+    """The order admin pages run a fixed number of queries, whatever the size of the page"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('gerant', password='x'))
+        for i in range(3):
+            User.objects.create_user(f'livreur{i}')
+
+    def place(self, lines):
+        cart = DatabaseCart(self.make_request())
+        self.fill_cart(cart.cart, lines)
+        return create_order(cart, customer_phone='0550000000')
+
+    def count_queries(self, url):
+        self.client.get(url)  # content types and permissions caches
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_changelist(self):
+        changelist = reverse('admin:restaurant_order_changelist')
+        self.place(2)
+        few, response = self.count_queries(changelist)
+        self.assertContains(response, '1x Machaoui [2x Sauce 0')
+        for _ in range(9):
+            self.place(3)
+        many, _ = self.count_queries(changelist)
+        # session, user, courier filter, order counter, page keys, page,
+        # 2 permission checks, courier select: the lines come from Order.summary
+        self.assertEqual(many, 9)
+
+    def test_search(self):
+        first, second = self.place(1), self.place(1)
+        Order.objects.filter(pk=second.pk).update(customer_phone='0661234567')
+        changelist = reverse('admin:restaurant_order_changelist')
+        # Phone prefix or order id
+        response = self.client.get(changelist, {'q': '066 12'})
+        self.assertEqual([o.pk for o in response.context['cl'].result_list], [second.pk])
+        response = self.client.get(changelist, {'q': str(first.pk)})
+        self.assertIn(first.pk, [o.pk for o in response.context['cl'].result_list])
+        # Names still use the default search
+        response = self.client.get(changelist, {'q': 'nobody'})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+    def test_change_form(self):
+        small, large = self.place(1), self.place(6)
+        few, response = self.count_queries(reverse('admin:restaurant_order_change', args=[small.pk]))
+        self.assertContains(response, '<li>Sauce 3 (x2)')
+        many, _ = self.count_queries(reverse('admin:restaurant_order_change', args=[large.pk]))
+        self.assertEqual(few, many)
+        self.assertEqual(many, 11)
+
+    def test_special_meal_admin(self):
+        small, large = self.place(1), self.place(6)
+        few, _ = self.count_queries(reverse('admin:restaurant_orderspecialmeal_changelist'))
+        self.place(6)
+        many, _ = self.count_queries(reverse('admin:restaurant_orderspecialmeal_changelist'))
+        self.assertEqual(few, many)
+
+        special = large.special_meals.first()
+        count, response = self.count_queries(
+            reverse('admin:restaurant_orderspecialmeal_change', args=[special.pk])
+        )
+        self.assertContains(response, 'Sauce 3 (Sauces)')
+        other = small.special_meals.first()
+        self.assertEqual(
+            count, self.count_queries(reverse('admin:restaurant_orderspecialmeal_change', args=[other.pk]))[0]
+        )
+        self.assertEqual(count, 10)
+
+
+class OrderSummaryTests(CatalogMixin, TestCase):
+
+    def place(self):
+        cart = DatabaseCart(self.make_request())
+        self.fill_cart(cart.cart, 2)
+        special = cart.cart.cart_special_meals.first()
+        special.notes = 'Bien cuit'
+        special.save()
+        return create_order(cart, customer_phone='0550000000')
+
+    def test_summary_is_written_with_the_order(self):
+        order = self.place()
+        order.refresh_from_db()
+        self.assertEqual(order.summary['text'].split('\n'), [
+            '2x Brochette 0',
+            '2x Brochette 1',
+            '1x Machaoui [2x Sauce 0, 2x Sauce 1, 2x Sauce 2, 2x Sauce 3] (Note: Bien cuit)',
+            '1x Machaoui [2x Sauce 0, 2x Sauce 1, 2x Sauce 2, 2x Sauce 3]',
+        ])
+        special = order.summary['lines'][2]
+        self.assertEqual(special['base_price'], '400.00')
+        self.assertEqual(special['ingredients'][1], {'name': 'Sauce 1', 'quantity': 2, 'unit_price': '20.00'})
+        self.assertEqual(order.summary, refresh_summary(order))
+
+    def test_confirmation_page_reads_the_summary(self):
+        order = self.place()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('restaurant:order_confirmation', args=[order.id]))
+        self.assertContains(response, '2x Brochette 1')
+        self.assertContains(response, '151 DA / unité')
+        self.assertContains(response, '(+20 DA)')
+        self.assertContains(response, 'Bien cuit')
+
+    def test_admin_edits_refresh_the_summary(self):
+        order = self.place()
+        self.client.force_login(User.objects.create_superuser('gerant', password='x'))
+        special = order.special_meals.first()
+        data = {'special_meal': self.meal.pk, 'quantity': 3, 'base_price': '400.00', 'total_price': '1440.00',
+                'notes': '', 'order': order.pk}
+        prefix = 'selected_ingredients'
+        data.update({f'{prefix}-TOTAL_FORMS': 0, f'{prefix}-INITIAL_FORMS': 0})
+        response = self.client.post(reverse('admin:restaurant_orderspecialmeal_change', args=[special.pk]), data)
+        self.assertEqual(response.status_code, 302)
+        order.refresh_from_db()
+        self.assertIn('3x Machaoui [2x Sauce 0', order.summary['text'])
+
+    def test_migration_backfills_existing_orders(self):
+        from django.apps import apps
+        migration = importlib.import_module('restaurant.migrations.0007_order_summary')
+        order = self.place()
+        expected = Order.objects.get(pk=order.pk).summary
+        Order.objects.update(summary={})
+        migration.backfill_summaries(apps, None)
+        order.refresh_from_db()
+        self.assertEqual(order.summary, expected)
+
+
+class WorkflowTests(TestCase):
+
+    def setUp(self):
+        self.orders = [
+            Order.objects.create(customer_phone='0550000000', total_price=Decimal('300.00'))
+            for _ in range(40)
+        ]
+        self.ids = [order.pk for order in self.orders]
+
+    def statuses(self):
+        return dict(Order.objects.values_list('pk', 'status'))
+
+    def test_one_update_for_the_rush(self):
+        before = timezone.now()
+        with CaptureQueriesContext(connection) as ctx:
+            changed, updated_at = transition_orders(self.ids, 'confirmed')
+        self.assertEqual(changed, self.ids)
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(set(self.statuses().values()), {'confirmed'})
+        # Seen by the admin feed and the kitchen board
+        self.assertEqual(Order.objects.filter(updated_at__gt=before).count(), 40)
+
+    def test_only_the_given_orders_are_reported(self):
+        now = timezone.now()
+        # Another order moved by someone else in the same microsecond
+        Order.objects.filter(pk=self.ids[-1]).update(status='confirmed', updated_at=now)
+        with patch('restaurant.workflow.timezone.now', return_value=now):
+            changed, _ = transition_orders(self.ids[:2], 'confirmed')
+        self.assertEqual(changed, self.ids[:2])
+
+    def test_only_legal_transitions(self):
+        transition_orders(self.ids[:10], 'confirmed')
+        transition_orders(self.ids[:5], 'cancelled')
+        # Skipping a step, or reviving a cancelled order, changes nothing
+        changed, _ = transition_orders(self.ids, 'preparing')
+        self.assertEqual(changed, self.ids[5:10])
+        changed, _ = transition_orders(self.ids, 'delivered')
+        self.assertEqual(changed, [])
+        self.assertEqual(transition_orders(self.ids[:5], 'confirmed')[0], [])
+        with self.assertRaises(IllegalTransition):
+            transition_orders(self.ids, 'pending')
+
+    def test_transition_of_a_filtered_queryset(self):
+        changed, _ = transition_orders(Order.objects.filter(status='pending', pk__in=self.ids[:3]), 'confirmed')
+        self.assertEqual(changed, self.ids[:3])
+
+
+class WorkflowAdminTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('gerant', password='x'))
+        self.orders = [
+            Order.objects.create(customer_phone='0550000000', total_price=Decimal('300.00'), status=status)
+            for status in ('pending', 'pending', 'confirmed', 'delivered')
+        ]
+        self.url = reverse('admin:restaurant_order_transition')
+
+    def test_bulk_action(self):
+        response = self.client.post(reverse('admin:restaurant_order_changelist'), {
+            'action': 'mark_confirmed',
+            '_selected_action': [order.pk for order in self.orders],
+        }, follow=True)
+        self.assertContains(response, '2 commande(s) passée(s) à « Confirmée »')
+        statuses = [Order.objects.get(pk=order.pk).status for order in self.orders]
+        self.assertEqual(statuses, ['confirmed', 'confirmed', 'confirmed', 'delivered'])
+
+    def test_endpoint(self):
+        ids = ','.join(str(order.pk) for order in self.orders)
+        data = self.client.post(self.url, {'ids': ids, 'status': 'preparing'}).json()
+        self.assertEqual(data['changed'], [self.orders[2].pk])
+        self.assertEqual(data['unchanged'], [self.orders[0].pk, self.orders[1].pk, self.orders[3].pk])
+        self.assertEqual(Order.objects.get(pk=self.orders[2].pk).status, 'preparing')
+
+        self.assertEqual(self.client.post(self.url, {'ids': ids, 'status': 'pending'}).status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'ids': 'x', 'status': 'ready'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+        self.client.logout()
+        self.assertEqual(self.client.post(self.url, {'ids': ids, 'status': 'ready'}).status_code, 302)
+
+
+class KitchenBoardTests(CatalogMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('chef', password='x'))
+        self.board = reverse('restaurant:kitchen')
+        self.updates = reverse('restaurant:kitchen_updates')
+
+    def place(self, status='pending'):
+        cart = DatabaseCart(self.make_request())
+        self.fill_cart(cart.cart, 1)
+        order = create_order(cart, customer_phone='0550000000', customer_name='Amine')
+        if status != 'pending':
+            Order.objects.filter(pk=order.pk).update(status=status)
+        return order
+
+    def test_board_groups_active_orders(self):
+        orders = {status: self.place(status) for status in ('pending', 'preparing', 'ready', 'delivered')}
+        # session, user, orders: the lines come from Order.summary
+        with self.assertNumQueries(3):
+            response = self.client.get(self.board)
+        columns = {column['status']: column['orders'] for column in response.context['columns']}
+        self.assertEqual(list(columns), ['pending', 'confirmed', 'preparing', 'ready'])
+        self.assertEqual([o.pk for o in columns['preparing']], [orders['preparing'].pk])
+        self.assertNotContains(response, f'id="order-{orders["delivered"].pk}"')
+        self.assertContains(response, '2× Sauce 3')
+        self.assertContains(response, 'data-next="ready">Prête</button>')
+
+    def test_updates_follow_the_cursor(self):
+        old = self.place()
+        cursor = self.client.get(self.board).context['cursor']
+        new = self.place()
+        transition_orders([old.pk], 'cancelled')
+
+        with self.assertNumQueries(3):
+            data = self.client.get(self.updates, {'since': cursor}).json()
+        self.assertGreater(data['cursor'], cursor)
+        orders = {order['id']: order for order in data['orders']}
+        self.assertEqual(set(orders), {old.pk, new.pk})
+        self.assertEqual(orders[old.pk]['html'], '')
+        self.assertIn(f'id="order-{new.pk}"', orders[new.pk]['html'])
+        self.assertIn('<b>1×</b> Machaoui', orders[new.pk]['html'])
+        self.assertIn('<li>2× Sauce 3</li>', orders[new.pk]['html'])
+
+        # Recent changes are sent again (grace window), older ones are not
+        data = self.client.get(self.updates, {'since': data['cursor']}).json()
+        self.assertEqual({order['id'] for order in data['orders']}, {old.pk, new.pk})
+        with override_settings(ORDER_FEED_GRACE=0):
+            data = self.client.get(self.updates, {'since': data['cursor']}).json()
+        self.assertEqual(data['orders'], [])
+
+    def test_late_commit_is_not_missed(self):
+        cursor = self.client.get(self.board).context['cursor']
+        # Stamped before the cursor, committed after the board was read
+        order = self.place()
+        Order.objects.filter(pk=order.pk).update(
+            updated_at=datetime.fromisoformat(cursor) - timedelta(seconds=1),
+        )
+        data = self.client.get(self.updates, {'since': cursor}).json()
+        self.assertEqual([o['id'] for o in data['orders']], [order.pk])
+
+    @override_settings(KITCHEN_MAX_CHANGES=1)
+    def test_too_many_changes_reload(self):
+        since = timezone.now().isoformat()
+        self.place(), self.place()
+        self.assertTrue(self.client.get(self.updates, {'since': since}).json()['reload'])
+        for bad in ('hier', '2024-13-45T00:00', '0001-01-01T00:00:00+01:00'):
+            self.assertEqual(self.client.get(self.updates, {'since': bad}).status_code, 400)
+
+    def test_staff_only(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.board).status_code, 302)
+        self.assertEqual(self.client.get(self.updates, {'since': timezone.now().isoformat()}).status_code, 302)
+
+
+class ArchiveTests(CatalogMixin, TestCase):
+
+    def place(self, status, days):
+        cart = DatabaseCart(self.make_request())
+        self.fill_cart(cart.cart, 1)
+        order = create_order(cart, customer_phone='0550000000')
+        Order.objects.filter(pk=order.pk).update(status=status, created_at=timezone.now() - timedelta(days=days))
+        return order
+
+    def archive(self, **options):
+        call_command('archive_orders', batch_size=1, pause=0, stdout=io.StringIO(), **options)
+
+    def test_completed_orders_move_to_the_archive(self):
+        old = [self.place('delivered', 100), self.place('cancelled', 95)]
+        kept = [self.place('pending', 100), self.place('delivered', 10)]
+        summary = Order.objects.get(pk=old[0].pk).summary
+        self.archive()
+
+        self.assertEqual(set(ArchivedOrder.objects.values_list('pk', flat=True)), {o.pk for o in old})
+        self.assertEqual(set(Order.objects.values_list('pk', flat=True)), {o.pk for o in kept})
+        self.assertFalse(OrderItem.objects.filter(order__in=old).exists())
+        self.assertFalse(OrderSpecialMealIngredient.objects.filter(order_special_meal__order__in=old).exists())
+        self.assertEqual(OrderSpecialMeal.objects.filter(order__in=kept).count(), 2)
+
+        archived = ArchivedOrder.objects.get(pk=old[0].pk)
+        self.assertEqual(archived.summary, summary)
+        self.assertEqual(archived.lines['items'][0]['product'], self.products[0].pk)
+        ingredients = archived.lines['special_meals'][0]['ingredients']
+        self.assertEqual([ing['ingredient'] for ing in ingredients], [i.pk for i in self.ingredients])
+
+        # Idempotent, and --days moves the younger ones
+        self.archive()
+        self.assertEqual(ArchivedOrder.objects.count(), 2)
+        self.archive(days=5)
+        self.assertEqual(ArchivedOrder.objects.count(), 3)
+
+    def test_archived_orders_are_still_found(self):
+        order = self.place('delivered', 100)
+        self.archive()
+        response = self.client.get(reverse('restaurant:order_confirmation', args=[order.pk]))
+        self.assertContains(response, '2x Brochette 0')
+        response = self.client.get(reverse('restaurant:order_confirmation', args=[order.pk + 1]))
+        self.assertEqual(response.status_code, 404)
+
+        self.client.force_login(User.objects.create_superuser('gerant', password='x'))
+        response = self.client.get(reverse('admin:restaurant_order_change', args=[order.pk]))
+        archived_url = reverse('admin:restaurant_archivedorder_change', args=[order.pk])
+        self.assertRedirects(response, archived_url)
+        self.assertContains(self.client.get(archived_url), '1x Machaoui [2x Sauce 0')
+        response = self.client.get(reverse('admin:restaurant_archivedorder_changelist'), {'q': order.pk})
+        self.assertEqual([o.pk for o in response.context['cl'].result_list], [order.pk])
+
+    def test_archive_changelist_pages_by_key(self):
+        start = timezone.now() - timedelta(days=200)
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(
+                id=pk, customer_phone='0550000000', total_price=Decimal('900.00'), status='delivered',
+                created_at=start + timedelta(minutes=pk), updated_at=start,
+            )
+            for pk in range(1, 251)
+        ])
+        self.client.force_login(User.objects.create_superuser('gerant', password='x'))
+        url = reverse('admin:restaurant_archivedorder_changelist')
+        response = self.client.get(url)
+        cl = response.context['cl']
+        self.assertContains(response, 'Suivants')
+        self.assertEqual([o.pk for o in cl.result_list], list(range(250, 150, -1)))
+        response = self.client.get(url + cl.next_url)
+        self.assertEqual([o.pk for o in response.context['cl'].result_list], list(range(150, 50, -1)))
+
+    def test_reopened_orders_stay(self):
+        order = self.place('delivered', 100)
+        calls = []
+
+        def selection(cutoff):
+            # Reopened between the selection and the move
+            if calls:
+                Order.objects.filter(pk=order.pk).update(status='preparing')
+            calls.append(cutoff)
+            return archivable_orders(cutoff)
+
+        with patch('restaurant.archive.archivable_orders', selection):
+            self.assertEqual(archive_batch(archive_cutoff()), 0)
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(Order.objects.filter(pk=order.pk).exists())
+
+
+class QueryPlanTests(TestCase):
+    """The hot order queries never scan a whole table, on a realistic volume"""
+    ORDERS = 500_000
+
+    @classmethod
+    def setUpTestData(cls):
+        couriers = [User.objects.create_user(f'livreur{i}').pk for i in range(5)]
+        with connection.cursor() as cursor:
+            # Most orders are delivered, a few are still in the kitchen
+            cursor.execute(
+                """
+                WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < %s)
+                INSERT INTO restaurant_order (
+                    customer_phone, customer_name, total_price, status, delivery_person_id,
+                    summary, created_at, updated_at
+                )
+                SELECT printf('05%%08d', abs(random()) %% 100000000), 'Client ' || n, '900.00',
+                       CASE WHEN n %% 100 = 0 THEN 'pending' WHEN n %% 100 < 3 THEN 'preparing'
+                            WHEN n %% 50 = 7 THEN 'cancelled' ELSE 'delivered' END,
+                       CASE WHEN n %% 3 = 0 THEN %s + n %% 5 END,
+                       '{}',
+                       strftime('%%Y-%%m-%%d %%H:%%M:%%f', '2024-01-01', printf('+%%d minutes', n)),
+                       strftime('%%Y-%%m-%%d %%H:%%M:%%f', '2024-01-01', printf('+%%d minutes', n))
+                FROM seq
+                """,
+                [cls.ORDERS, couriers[0]],
+            )
+            cursor.execute('ANALYZE')
+
+    def test_hot_queries_use_indexes(self):
+        self.assertEqual(Order.objects.count(), self.ORDERS)
+        failures = check_plans()
+        self.assertFalse(failures, '\n'.join(
+            f'{name}:\n{plan}' for name, (plan, scans) in failures.items()
+        ))
+
+    def test_full_scans_are_detected(self):
+        # Unindexed column, and a sort of a whole table to get one page
+        self.assertTrue(check_plans([HotQuery('notes', Order.objects.filter(additional_notes='x'))]))
+        self.assertTrue(check_plans([
+            HotQuery('by total', Order.objects.order_by('-total_price')[:100], limited=True),
+        ]))
+        self.assertFalse(check_plans([
+            HotQuery('page', Order.objects.order_by('-created_at')[:100], limited=True),
+        ]))
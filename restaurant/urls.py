@@ -8,6 +8,9 @@ urlpatterns = [
     # Order page
     path('commander/', views.order_page, name='order'),
     
+    # Catalog for client-side menus
+    path('api/catalogue/', views.catalog_api, name='catalog_api'),
+    
     # Customize special meal
     path('personnaliser/<int:meal_id>/', views.customize_special_meal, name='customize_meal'),
     
@@ -17,10 +20,16 @@ urlpatterns = [
     path('ajouter-repas-special/', views.add_special_meal_to_cart, name='add_special_meal'),
     path('modifier-panier/', views.update_cart_item, name='update_cart'),
     path('retirer-du-panier/', views.remove_from_cart, name='remove_from_cart'),
+    path('modifier-panier/lot/', views.update_cart_batch, name='update_cart_batch'),
+    path('devis/', views.quote_prices, name='quote'),
     
     # Checkout
     path('finaliser/', views.checkout, name='checkout'),
     path('passer-commande/', views.place_order, name='place_order'),
     path('confirmation/<int:order_id>/', views.order_confirmation, name='order_confirmation'),
 
+    # Kitchen display board (staff)
+    path('cuisine/', views.kitchen_board, name='kitchen'),
+    path('cuisine/maj/', views.kitchen_updates, name='kitchen_updates'),
+
 ]
@@ -2,91 +2,172 @@ from django.shortcuts import render
 
 
 from django.shortcuts import render
-from .models import Category, Product
+from django.conf import settings
 
 def menu(request):
-    # Get all categories with their products
-    categories = Category.objects.prefetch_related('product_set').all()
-    
-    # Get featured/popular products (you can customize this logic)
-    featured_products = Product.objects.filter(is_available=True)[:4]
+    # Categories with their available products, from the catalog snapshot
+    catalog = get_catalog()
+    cart = get_cart(request)
     
     context = {
-        'categories': categories,
-        'featured_products': featured_products,
+        'categories': catalog.categories,
+        'featured_products': catalog.featured_products,
+        'catalog_version': catalog.version,
+        'fragment_timeout': settings.RESTAURANT_FRAGMENT_CACHE_TIMEOUT,
+        'cart_total': cart.total,
+        'cart_items_count': cart.count,
     }
     return render(request, 'menu/menu.html', context)
 
 
 
-from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.shortcuts import render, redirect
+from django.http import JsonResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_safe
 from django.contrib import messages
-from decimal import Decimal
+from django.contrib.admin.views.decorators import staff_member_required
+from datetime import timedelta
 import json
 
-from .models import (
-    Category, Product, SpecialMeal, Ingredient, IngredientCategory,
-    Cart, CartItem, CartSpecialMeal, CartSpecialMealIngredient,
-    Order, OrderItem, OrderSpecialMeal, OrderSpecialMealIngredient
-)
-
-
-def get_or_create_cart(request):
-    """Get or create cart for current session"""
-    if not request.session.session_key:
-        request.session.create()
-    
-    session_key = request.session.session_key
-    cart, created = Cart.objects.get_or_create(session_key=session_key)
-    return cart
+from .cart import get_cart
+from .catalog import get_catalog, validate_customization
+from .pricing import PRODUCT, SPECIAL, from_cents, get_price_table
+from .orders import create_order, summary_lines
+from .archive import find_order
+from .models import Order
+from .workflow import ACTIVE_STATUSES, NEXT_STATUS
 
 
 def order_page(request):
     """Main order page showing special meals and categories"""
-    special_meals = SpecialMeal.objects.filter(is_available=True)
-    categories = Category.objects.prefetch_related('product_set').all()
-    cart = get_or_create_cart(request)
+    catalog = get_catalog()
+    cart = get_cart(request)
     
     context = {
-        'special_meals': special_meals,
-        'categories': categories,
+        'special_meals': catalog.special_meals,
+        'categories': catalog.categories,
+        'catalog_version': catalog.version,
+        'fragment_timeout': settings.RESTAURANT_FRAGMENT_CACHE_TIMEOUT,
         'cart': cart,
-        'cart_total': cart.get_total(),
-        'cart_items_count': cart.cart_items.count() + cart.cart_special_meals.count()
+        'cart_total': cart.total,
+        'cart_items_count': cart.count
     }
     return render(request, 'restaurant/order.html', context)
 
 
-def customize_special_meal(request, meal_id):
-    """Page to customize a special meal with ingredients"""
-    special_meal = get_object_or_404(SpecialMeal, id=meal_id, is_available=True)
+@require_safe
+def catalog_api(request):
+    """
+    Full catalog as JSON for client-side menus and kiosks.
+
+    The body is encoded and gzipped once per catalog version. Clients
+    revalidate with ``If-None-Match`` and get a 304 while the catalog is
+    unchanged; ``?v=<version>`` URLs never change and can be cached forever.
+    """
+    catalog = get_catalog()
+    body, gzipped = catalog.json_payload
+    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+    etag = f'"catalog-{catalog.version}{"-gzip" if use_gzip else ""}"'
     
-    # Get available ingredients grouped by category
-    ingredient_categories = IngredientCategory.objects.prefetch_related(
-        'ingredient_set'
-    ).all()
+    if request.GET.get('v') == str(catalog.version):
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'public, no-cache'
     
-    # Get which ingredients are available for this meal
-    available_ingredient_ids = special_meal.specialmealingredient_set.values_list(
-        'ingredient_id', flat=True
-    )
+    client_etags = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in client_etags or '*' in client_etags:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(gzipped if use_gzip else body, content_type='application/json')
+        if use_gzip:
+            response['Content-Encoding'] = 'gzip'
     
-    # Get default ingredients
-    default_ingredients = special_meal.specialmealingredient_set.filter(
-        is_default=True
-    ).select_related('ingredient')
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def customize_special_meal(request, meal_id):
+    """Page to customize a special meal with ingredients"""
+    catalog = get_catalog()
+    special_meal = catalog.get_special_meal(meal_id)
+    if special_meal is None:
+        raise Http404('Repas introuvable')
+    
+    # Allowed ingredients grouped by category, with their rules
+    groups = catalog.meal_groups[special_meal.id]
+    prices = catalog.price_table
     
     context = {
         'special_meal': special_meal,
-        'ingredient_categories': ingredient_categories,
-        'available_ingredient_ids': list(available_ingredient_ids),
-        'default_ingredients': default_ingredients,
+        'ingredient_groups': groups,
+        # Integer-cent prices so the page computes totals like the server does
+        'meal_prices': {
+            'base': prices.meals[special_meal.id],
+            'ingredients': {
+                ingredient.id: prices.ingredients[ingredient.id]
+                for group in groups
+                for ingredient, rule in group.entries
+            },
+        },
     }
     return render(request, 'restaurant/customize_meal.html', context)
 
 
+MAX_QUOTES = 200
+
+
+def parse_quote(item):
+    """Turn one quote request item into a pricing configuration"""
+    try:
+        quantity = int(item.get('quantity', 1))
+        if quantity < 1:
+            return None
+        if item.get('type') == PRODUCT:
+            return (PRODUCT, int(item['id']), quantity)
+        return (SPECIAL, int(item['meal_id']), quantity, [
+            (int(ing['id']), int(ing.get('quantity', 1)))
+            for ing in item.get('ingredients', [])
+        ])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+@csrf_exempt
+@require_POST
+def quote_prices(request):
+    """
+    Price many product or special meal configurations in one request.
+
+    Body: ``{"items": [{"type": "product", "id": 1, "quantity": 2},
+    {"type": "special", "meal_id": 3, "quantity": 1, "ingredients":
+    [{"id": 4, "quantity": 2}]}, ...]}``. Nothing is stored, so the
+    endpoint does not need a CSRF token.
+    """
+    try:
+        items = json.loads(request.body).get('items', [])
+        if len(items) > MAX_QUOTES:
+            return JsonResponse({'success': False, 'message': f'{MAX_QUOTES} articles maximum'}, status=400)
+        
+        totals = get_price_table().quote_many([parse_quote(item) for item in items])
+        quotes = [
+            {'total': float(from_cents(cents)), 'total_cents': cents}
+            if cents is not None else {'error': 'Article invalide'}
+            for cents in totals
+        ]
+        return JsonResponse({'success': True, 'quotes': quotes})
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+
 @require_POST
 def add_to_cart(request):
     """Add regular product to cart"""
@@ -94,25 +175,19 @@ def add_to_cart(request):
         product_id = request.POST.get('product_id')
         quantity = int(request.POST.get('quantity', 1))
         
-        product = get_object_or_404(Product, id=product_id, is_available=True)
-        cart = get_or_create_cart(request)
-        
-        # Check if item already in cart
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        product = get_catalog().products.get(int(product_id))
+        if product is None or not product.is_available:
+            raise ValueError('Produit indisponible')
+        if quantity < 1:
+            raise ValueError('Quantité invalide')
+        cart = get_cart(request)
+        cart.add_product(product, quantity)
         
         return JsonResponse({
             'success': True,
             'message': f'{product.name} ajouté au panier',
-            'cart_total': float(cart.get_total()),
-            'cart_count': cart.cart_items.count() + cart.cart_special_meals.count()
+            'cart_total': float(cart.total),
+            'cart_count': cart.count
         })
     
     except Exception as e:
@@ -124,45 +199,23 @@ def add_special_meal_to_cart(request):
     """Add customized special meal to cart"""
     try:
         data = json.loads(request.body)
-        meal_id = data.get('meal_id')
-        quantity = int(data.get('quantity', 1))
-        ingredients = data.get('ingredients', [])  # List of {id, quantity}
-        notes = data.get('notes', '')
-        
-        special_meal = get_object_or_404(SpecialMeal, id=meal_id, is_available=True)
-        cart = get_or_create_cart(request)
         
-        # Create cart special meal
-        cart_special = CartSpecialMeal.objects.create(
-            cart=cart,
-            special_meal=special_meal,
-            quantity=quantity,
-            notes=notes,
-            total_price=special_meal.base_price * quantity
+        # Validate and price the whole customization against the meal index
+        customization = validate_customization(
+            meal_id=data.get('meal_id'),
+            quantity=data.get('quantity', 1),
+            ingredients=data.get('ingredients', []),  # List of {id, quantity}
+            notes=data.get('notes', '')
         )
         
-        # Add ingredients
-        total_ingredients_price = Decimal('0.00')
-        for ing_data in ingredients:
-            ingredient = get_object_or_404(Ingredient, id=ing_data['id'])
-            ing_quantity = int(ing_data.get('quantity', 1))
-            
-            CartSpecialMealIngredient.objects.create(
-                cart_special_meal=cart_special,
-                ingredient=ingredient,
-                quantity=ing_quantity
-            )
-            total_ingredients_price += ingredient.price * ing_quantity
-        
-        # Update total price
-        cart_special.total_price = (special_meal.base_price + total_ingredients_price) * quantity
-        cart_special.save()
+        cart = get_cart(request)
+        cart.add_special_meal(customization)
         
         return JsonResponse({
             'success': True,
-            'message': f'{special_meal.name} personnalisé ajouté au panier',
-            'cart_total': float(cart.get_total()),
-            'cart_count': cart.cart_items.count() + cart.cart_special_meals.count()
+            'message': f'{customization.name} personnalisé ajouté au panier',
+            'cart_total': float(cart.total),
+            'cart_count': cart.count
         })
     
     except Exception as e:
@@ -171,19 +224,14 @@ def add_special_meal_to_cart(request):
 
 def view_cart(request):
     """View cart contents"""
-    cart = get_or_create_cart(request)
-    
-    # Get all cart items with details
-    cart_items = cart.cart_items.select_related('product').all()
-    cart_special_meals = cart.cart_special_meals.select_related('special_meal').prefetch_related(
-        'selected_ingredients__ingredient'
-    ).all()
+    cart = get_cart(request)
+    cart_items, cart_special_meals = cart.lines()
     
     context = {
         'cart': cart,
         'cart_items': cart_items,
         'cart_special_meals': cart_special_meals,
-        'cart_total': cart.get_total()
+        'cart_total': cart.total
     }
     return render(request, 'restaurant/cart.html', context)
 
@@ -199,21 +247,12 @@ def update_cart_item(request):
         if quantity < 1:
             return JsonResponse({'success': False, 'message': 'Quantité invalide'}, status=400)
         
-        cart = get_or_create_cart(request)
-        
-        if item_type == 'product':
-            item = get_object_or_404(CartItem, id=item_id, cart=cart)
-            item.quantity = quantity
-            item.save()
-        else:
-            item = get_object_or_404(CartSpecialMeal, id=item_id, cart=cart)
-            item.quantity = quantity
-            item.calculate_total()
-            item.save()
+        cart = get_cart(request)
+        cart.update_quantity(item_type, item_id, quantity)
         
         return JsonResponse({
             'success': True,
-            'cart_total': float(cart.get_total())
+            'cart_total': float(cart.total)
         })
     
     except Exception as e:
@@ -227,17 +266,98 @@ def remove_from_cart(request):
         item_id = request.POST.get('item_id')
         item_type = request.POST.get('type')
         
-        cart = get_or_create_cart(request)
+        cart = get_cart(request)
+        cart.remove(item_type, item_id)
+        
+        return JsonResponse({
+            'success': True,
+            'cart_total': float(cart.total),
+            'cart_count': cart.count
+        })
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+
+MAX_CART_OPERATIONS = 50
+
+
+def parse_cart_operation(item, catalog):
+    """Turn one operation of a cart batch into a ``cart.apply`` operation"""
+    try:
+        action = item.get('op')
+        line_type = item.get('type')
+        if line_type not in (PRODUCT, SPECIAL):
+            raise ValueError('Type invalide')
+        
+        if action == 'add' and line_type == PRODUCT:
+            product = catalog.products.get(int(item['id']))
+            quantity = int(item.get('quantity', 1))
+            if product is None or not product.is_available:
+                raise ValueError('Produit indisponible')
+            if quantity < 1:
+                raise ValueError('Quantité invalide')
+            return ('add', PRODUCT, product, quantity)
+        if action == 'add':
+            return ('add', SPECIAL, validate_customization(
+                meal_id=item.get('meal_id'),
+                quantity=item.get('quantity', 1),
+                ingredients=item.get('ingredients', []),
+                notes=item.get('notes', '')
+            ))
+        if action == 'update':
+            quantity = int(item['quantity'])
+            if quantity < 1:
+                raise ValueError('Quantité invalide')
+            return ('update', line_type, int(item['item_id']), quantity)
+        if action == 'remove':
+            return ('remove', line_type, int(item['item_id']))
+        raise ValueError('Opération inconnue')
+    
+    except (AttributeError, KeyError, TypeError):
+        raise ValueError('Opération invalide')
+
+
+@require_POST
+def update_cart_batch(request):
+    """
+    Apply several cart operations in one request, all or nothing.
+
+    Body: ``{"operations": [{"op": "update", "type": "product", "item_id": 4,
+    "quantity": 3}, {"op": "remove", "type": "special", "item_id": 2},
+    {"op": "add", "type": "product", "id": 7, "quantity": 1}, ...]}``;
+    special meals are added with the same fields as ``add_special_meal``.
+    Returns the new totals and the remaining lines once.
+    """
+    try:
+        operations = json.loads(request.body).get('operations', [])
+        if len(operations) > MAX_CART_OPERATIONS:
+            return JsonResponse(
+                {'success': False, 'message': f'{MAX_CART_OPERATIONS} opérations maximum'}, status=400
+            )
         
-        if item_type == 'product':
-            CartItem.objects.filter(id=item_id, cart=cart).delete()
-        else:
-            CartSpecialMeal.objects.filter(id=item_id, cart=cart).delete()
+        catalog = get_catalog()
+        parsed = []
+        for position, item in enumerate(operations, start=1):
+            try:
+                parsed.append(parse_cart_operation(item, catalog))
+            except ValueError as e:
+                raise ValueError(f'Opération {position}: {e}')
+        
+        cart = get_cart(request)
+        cart.apply(parsed)
+        cart_items, cart_special_meals = cart.lines()
         
         return JsonResponse({
             'success': True,
-            'cart_total': float(cart.get_total()),
-            'cart_count': cart.cart_items.count() + cart.cart_special_meals.count()
+            'cart_total': float(cart.total),
+            'cart_count': cart.count,
+            'lines': [
+                {'type': line_type, 'id': line.id, 'quantity': line.quantity,
+                 'total': float(line.total_price)}
+                for line_type, lines in ((PRODUCT, cart_items), (SPECIAL, cart_special_meals))
+                for line in lines
+            ]
         })
     
     except Exception as e:
@@ -246,15 +366,19 @@ def remove_from_cart(request):
 
 def checkout(request):
     """Checkout page"""
-    cart = get_or_create_cart(request)
+    cart = get_cart(request)
     
-    if not cart.cart_items.exists() and not cart.cart_special_meals.exists():
+    if cart.is_empty:
         messages.warning(request, 'Votre panier est vide')
         return redirect('restaurant:order')
     
+    # Let staff see carts that reached the checkout in the admin
+    if getattr(settings, 'RESTAURANT_CART_ADMIN_MIRROR', False) and hasattr(cart, 'mirror_to_db'):
+        cart.mirror_to_db()
+    
     context = {
         'cart': cart,
-        'cart_total': cart.get_total()
+        'cart_total': cart.total
     }
     return render(request, 'restaurant/checkout.html', context)
 
@@ -263,10 +387,7 @@ def checkout(request):
 def place_order(request):
     """Create order from cart"""
     try:
-        cart = get_or_create_cart(request)
-        
-        if not cart.cart_items.exists() and not cart.cart_special_meals.exists():
-            return JsonResponse({'success': False, 'message': 'Panier vide'}, status=400)
+        cart = get_cart(request)
         
         # Get customer info
         customer_phone = request.POST.get('phone')
@@ -277,49 +398,15 @@ def place_order(request):
         if not customer_phone:
             return JsonResponse({'success': False, 'message': 'Numéro de téléphone requis'}, status=400)
         
-        # Create order
-        order = Order.objects.create(
+        # Create order, its lines and clear the cart in one transaction
+        order = create_order(
+            cart,
             customer_phone=customer_phone,
             customer_name=customer_name,
             customer_address=customer_address,
-            total_price=cart.get_total(),
             additional_notes=additional_notes
         )
         
-        # Add regular items
-        for cart_item in cart.cart_items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
-                unit_price=cart_item.product.price,
-                total_price=cart_item.total_price
-            )
-        
-        # Add special meals
-        for cart_special in cart.cart_special_meals.all():
-            order_special = OrderSpecialMeal.objects.create(
-                order=order,
-                special_meal=cart_special.special_meal,
-                quantity=cart_special.quantity,
-                base_price=cart_special.special_meal.base_price,
-                total_price=cart_special.total_price,
-                notes=cart_special.notes
-            )
-            
-            # Add ingredients
-            for ing in cart_special.selected_ingredients.all():
-                OrderSpecialMealIngredient.objects.create(
-                    order_special_meal=order_special,
-                    ingredient=ing.ingredient,
-                    quantity=ing.quantity,
-                    unit_price=ing.ingredient.price
-                )
-        
-        # Clear cart
-        cart.cart_items.all().delete()
-        cart.cart_special_meals.all().delete()
-        
         return JsonResponse({
             'success': True,
             'message': 'Commande passée avec succès',
@@ -332,9 +419,99 @@ def place_order(request):
 
 def order_confirmation(request, order_id):
     """Order confirmation page"""
-    order = get_object_or_404(Order, id=order_id)
-    
+    # Still there once the order is archived
+    order = find_order(order_id)
+    if order is None:
+        raise Http404('Commande introuvable')
+    products, specials = summary_lines(order)
+
     context = {
-        'order': order
+        'order': order,
+        'products': products,
+        'specials': specials,
+    }
+    return render(request, 'restaurant/order_confirmation.html', context)
+
+
+# What a card shows: no join, the lines come from Order.summary
+KITCHEN_FIELDS = (
+    'id', 'status', 'customer_name', 'customer_phone', 'additional_notes', 'summary', 'created_at',
+)
+KITCHEN_ACTIONS = {'confirmed': 'Confirmer', 'preparing': 'Commencer', 'ready': 'Prête', 'delivered': 'Livrée'}
+
+
+def _kitchen_context(request):
+    return {
+        'can_advance': request.user.has_perm('restaurant.change_order'),
+        'transition_url': reverse('admin:restaurant_order_transition'),
     }
-    return render(request, 'restaurant/order_confirmation.html', context)
\ No newline at end of file
+
+
+def _kitchen_card(order):
+    order.next_status = NEXT_STATUS.get(order.status)
+    order.next_label = KITCHEN_ACTIONS.get(order.next_status, '')
+    return order
+
+
+@staff_member_required
+@require_safe
+def kitchen_board(request):
+    """Active orders by status, kept up to date by js/kitchen-board.js"""
+    # The next read starts ORDER_FEED_GRACE seconds before it (kitchen_updates)
+    cursor = timezone.now()
+    # Status first: read in the order of the (status, created_at) index
+    active = Order.objects.filter(status__in=ACTIVE_STATUSES).order_by('status', 'created_at', 'pk')
+    orders = [_kitchen_card(order) for order in active.only(*KITCHEN_FIELDS)]
+    labels = dict(Order.STATUS_CHOICES)
+    columns = [
+        {'status': status, 'label': labels[status], 'orders': [o for o in orders if o.status == status]}
+        for status in ACTIVE_STATUSES
+    ]
+    return render(request, 'restaurant/kitchen/board.html', {
+        **_kitchen_context(request),
+        'columns': columns,
+        'cursor': cursor.isoformat(),
+        'poll_interval': getattr(settings, 'KITCHEN_POLL_INTERVAL', 5),
+    })
+
+
+@staff_member_required
+@require_safe
+def kitchen_updates(request):
+    """
+    Orders changed after ``?since=`` (read through the ``updated_at``
+    index), rendered as cards; delivered and cancelled ones come without
+    html and leave the board. Answers ``reload`` past
+    ``KITCHEN_MAX_CHANGES`` changes.
+
+    ``updated_at`` is stamped before the write commits, so a row committed
+    after the previous read may be older than its cursor: the read goes back
+    ``ORDER_FEED_GRACE`` seconds. Cards seen twice are just replaced.
+    """
+    try:
+        since = parse_datetime(request.GET.get('since', ''))
+        if since is not None:
+            since -= timedelta(seconds=getattr(settings, 'ORDER_FEED_GRACE', 5))
+    except (ValueError, OverflowError):
+        # Well formed but out of range
+        since = None
+    if since is None:
+        return JsonResponse({'error': 'since'}, status=400)
+    limit = getattr(settings, 'KITCHEN_MAX_CHANGES', 100)
+    cursor = timezone.now()
+    changed = list(
+        Order.objects.filter(updated_at__gt=since).order_by('updated_at').only(*KITCHEN_FIELDS)[:limit + 1]
+    )
+    if len(changed) > limit:
+        return JsonResponse({'cursor': cursor.isoformat(), 'reload': True})
+
+    context = _kitchen_context(request)
+    orders = []
+    for order in changed:
+        html = ''
+        if order.status in ACTIVE_STATUSES:
+            html = render_to_string('restaurant/kitchen/card.html', {**context, 'order': _kitchen_card(order)})
+        orders.append({'id': order.pk, 'status': order.status, 'html': html})
+    response = JsonResponse({'cursor': cursor.isoformat(), 'orders': orders})
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,61 @@
+"""
+Order status workflow.
+
+    pending → confirmed → preparing → ready → delivered
+    (any step before delivered) → cancelled
+
+``transition_orders`` moves many orders at once with a single conditional
+``UPDATE … WHERE id IN (…) AND status IN (<legal sources>)``: the database
+enforces the transition, so two staff members advancing the same tickets
+cannot skip a step or revive a cancelled order. ``updated_at`` is set in the
+same statement (``update()`` bypasses ``auto_now``), which the admin feed and
+the kitchen board follow.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order
+
+# Status: the statuses it can be reached from
+TRANSITIONS = {
+    'confirmed': ('pending',),
+    'preparing': ('confirmed',),
+    'ready': ('preparing',),
+    'delivered': ('ready',),
+    'cancelled': ('pending', 'confirmed', 'preparing', 'ready'),
+}
+
+# The next step of each active status (kitchen board buttons)
+NEXT_STATUS = {'pending': 'confirmed', 'confirmed': 'preparing', 'preparing': 'ready', 'ready': 'delivered'}
+ACTIVE_STATUSES = tuple(NEXT_STATUS)
+
+
+class IllegalTransition(ValueError):
+    """Raised for a target status no order can be moved to"""
+
+
+def transition_orders(orders, status):
+    """
+    Move ``orders`` (ids or a queryset of orders) to ``status`` where the
+    transition is legal. Returns ``(ids of the orders changed, updated_at)``;
+    the others are left untouched.
+    """
+    if status not in TRANSITIONS:
+        raise IllegalTransition(status)
+    if not isinstance(orders, (list, tuple, set)):
+        orders = orders.values('pk')
+    now = timezone.now()
+    with transaction.atomic():
+        # Resolved before the UPDATE: ``orders`` may be a subquery on the old status
+        candidates = list(
+            Order.objects.filter(pk__in=orders, status__in=TRANSITIONS[status]).values_list('pk', flat=True)
+        )
+        Order.objects.filter(pk__in=candidates, status__in=TRANSITIONS[status]).update(
+            status=status, updated_at=now,
+        )
+        # Those the UPDATE moved (another writer may have changed some meanwhile)
+        changed = list(
+            Order.objects.filter(pk__in=candidates, updated_at=now, status=status)
+            .order_by('pk').values_list('pk', flat=True)
+        )
+    return changed, now
@@ -34,9 +34,16 @@
         }
     });
 
-    // ---- POLLING WITH PERSISTENT LAST ID ----
-    const INTERVAL = 15000;
+    // ---- NEW ORDER NOTIFICATIONS ----
+    // Pushed by /orders/events/ (Server-Sent Events, ASGI). When the server
+    // cannot stream (WSGI answers 204) or the stream keeps failing, fall
+    // back to long-polling /orders/poll/ with the last known order id.
+    const STREAM_URL = "/orders/events/";
+    const POLL_URL = "/orders/poll/";
+    const RETRY_DELAY = 5000;
+    const RELOAD_DELAY = 300;  // coalesces a burst of orders into one update
     let lastKnownId = null;
+    let reloadTimer = null;
 
     // Initialize lastKnownId from sessionStorage (survives reload)
     const storedId = sessionStorage.getItem("last_order_id");
@@ -45,42 +52,183 @@
         console.log("📦 Restored last known ID:", lastKnownId);
     }
 
-    async function checkNewOrders() {
-        try {
-            const res = await fetch("/latest-order-meta/");
-            const data = await res.json();
+    function remember(id) {
+        lastKnownId = id;
+        sessionStorage.setItem("last_order_id", lastKnownId);
+    }
 
-            console.log("Polling - Current ID:", data.last_id, "Last Known:", lastKnownId);
+    function onNewOrder(order) {
+        if (lastKnownId !== null && order.id <= lastKnownId) return;
+        console.log("🆕 New order detected! Old ID:", lastKnownId, "New ID:", order.id);
+        remember(order.id);
 
-            // First time initialization
-            if (lastKnownId === null) {
-                lastKnownId = data.last_id;
-                sessionStorage.setItem("last_order_id", lastKnownId);
-                console.log("📝 Initialized last known ID:", lastKnownId);
-                return;
+        if (!document.body.classList.contains("change-list")) {
+            // Do not reload a form being edited: just ring
+            playNotification();
+            return;
+        }
+        // A burst of orders is fetched at once
+        clearTimeout(reloadTimer);
+        reloadTimer = setTimeout(orderFeed() ? patchRows : reloadWithSound, RELOAD_DELAY);
+    }
+
+    function reloadWithSound() {
+        // Set flag to play sound after reload
+        sessionStorage.setItem("play_new_order_sound", "1");
+        location.reload();
+    }
+
+    // ---- INCREMENTAL CHANGELIST UPDATES ----
+    // The feed returns the orders created or updated since the cursor,
+    // rendered as rows for the filters of this page.
+    let feed;
+
+    function orderFeed() {
+        // Read once the page is parsed: the meta tag follows this script
+        if (feed === undefined) {
+            const meta = document.querySelector('meta[name="order-feed"]');
+            feed = meta ? { url: meta.content, cursor: meta.dataset.cursor } : null;
+        }
+        return feed;
+    }
+
+    function rowOf(id) {
+        const checkbox = document.querySelector('#result_list input.action-select[value="' + id + '"]');
+        return checkbox && checkbox.closest("tr");
+    }
+
+    function isDirty(row) {
+        // Never overwrite a status or courier being changed
+        return Array.from(row.querySelectorAll("select, input, textarea")).some((field) =>
+            field.tagName === "SELECT"
+                ? Array.from(field.options).some((option) => option.selected !== option.defaultSelected)
+                : field.value !== field.defaultValue || field.checked !== field.defaultChecked
+        );
+    }
+
+    function formIndex(row) {
+        const field = row.querySelector('[name^="form-"]');
+        return field ? field.name.split("-")[1] : null;
+    }
+
+    function buildRow(html, index) {
+        const tbody = document.createElement("tbody");
+        tbody.innerHTML = "<tr role=\"row\">" + html.replaceAll("form-__prefix__-", "form-" + index + "-") + "</tr>";
+        return tbody.firstElementChild;
+    }
+
+    function insertRow(data, table) {
+        // New forms go after the existing ones of the list-editable formset
+        const total = document.getElementById("id_form-TOTAL_FORMS");
+        const initial = document.getElementById("id_form-INITIAL_FORMS");
+        const index = total ? parseInt(total.value, 10) : 0;
+        table.tBodies[0].prepend(buildRow(data.html, index));
+        if (total) {
+            total.value = index + 1;
+            initial.value = parseInt(initial.value, 10) + 1;
+            let hidden = document.querySelector("#changelist-form .hiddenfields");
+            if (!hidden) {
+                hidden = document.createElement("div");
+                hidden.className = "hiddenfields";
+                table.closest("form").prepend(hidden);
             }
+            hidden.insertAdjacentHTML("beforeend", data.hidden.replaceAll("form-__prefix__-", "form-" + index + "-"));
+        }
+    }
+
+    async function patchRows() {
+        const table = document.getElementById("result_list");
+        const params = new URLSearchParams(location.search);
+        // New rows belong on top only on the first page in the default order
+        const atTop = !params.get("p") && !params.get("o") && !params.get("after") && !params.get("before");
+        if (!table) {
+            reloadWithSound();
+            return;
+        }
+        params.delete("p");
+        params.delete("after");
+        params.delete("before");
+        params.set("since", feed.cursor);
 
-            // New order detected
-            if (data.last_id > lastKnownId) {
-                console.log("🆕 New order detected! Old ID:", lastKnownId, "New ID:", data.last_id);
-                
-                // Update stored ID BEFORE reload
-                lastKnownId = data.last_id;
-                sessionStorage.setItem("last_order_id", lastKnownId);
-                
-                // Set flag to play sound after reload
-                sessionStorage.setItem("play_new_order_sound", "1");
-                
-                location.reload();
+        try {
+            const res = await fetch(feed.url + "?" + params.toString(), { cache: "no-store" });
+            const data = await res.json();
+            if (data.reload) {
+                reloadWithSound();
+                return;
             }
+            feed.cursor = data.cursor;
 
+            // Rows may come twice (grace window of the feed): ring for new rows only
+            let created = false;
+            data.rows.slice().reverse().forEach((row) => {
+                const current = rowOf(row.id);
+                if (current) {
+                    if (!isDirty(current)) current.replaceWith(buildRow(row.html, formIndex(current)));
+                } else if (row.created) {
+                    created = true;
+                    if (atTop) insertRow(row, table);
+                }
+            });
+            data.removed.forEach((id) => {
+                const current = rowOf(id);
+                // Rows with list-editable fields stay: the formset counts them
+                if (current && formIndex(current) === null) current.remove();
+            });
+            if (created) playNotification();
         } catch (e) {
-            console.warn("⚠️ Order polling failed", e);
+            console.warn("⚠️ Order feed failed, reloading", e);
+            reloadWithSound();
+        }
+    }
+
+    function query() {
+        return lastKnownId === null ? "" : "?since_id=" + lastKnownId;
+    }
+
+    function listen() {
+        if (!window.EventSource) {
+            poll();
+            return;
+        }
+        let opened = false;
+        const source = new EventSource(STREAM_URL + query());
+
+        source.addEventListener("ready", (event) => {
+            opened = true;
+            if (lastKnownId === null) remember(JSON.parse(event.data).last_id);
+        });
+        source.addEventListener("order", (event) => onNewOrder(JSON.parse(event.data)));
+        source.onerror = () => {
+            // Reconnections are automatic once the stream worked
+            if (source.readyState === EventSource.CLOSED || !opened) {
+                source.close();
+                console.warn("⚠️ Order stream unavailable, long-polling instead");
+                poll();
+            }
+        };
+    }
+
+    async function poll() {
+        while (true) {
+            try {
+                const res = await fetch(POLL_URL + query(), { cache: "no-store" });
+                const data = await res.json();
+                if (lastKnownId === null || data.last_id < lastKnownId) {
+                    remember(data.last_id);
+                }
+                data.orders.forEach(onNewOrder);
+                // Short poll (WSGI server): the server did not wait, so we do
+                if (data.retry_after) {
+                    await new Promise((resolve) => setTimeout(resolve, data.retry_after * 1000));
+                }
+            } catch (e) {
+                console.warn("⚠️ Order polling failed", e);
+                await new Promise((resolve) => setTimeout(resolve, RETRY_DELAY));
+            }
         }
     }
 
-    // Start polling immediately, then every INTERVAL
-    checkNewOrders();
-    setInterval(checkNewOrders, INTERVAL);
+    listen();
 
-})();
\ No newline at end of file
+})();
@@ -0,0 +1,138 @@
+// Kitchen board (restaurant.views.kitchen_board): fetches the orders changed
+// since the last cursor and patches their cards in place. Meant to run for
+// hours on a cheap tablet: one timer chain, one click listener for the whole
+// board, no per-card state kept in JavaScript.
+(function () {
+    const board = document.getElementById("kitchen-board");
+    if (!board) return;
+
+    const POLL = (parseFloat(board.dataset.poll) || 5) * 1000;
+    const MAX_BACKOFF = 60000;
+    const REQUEST_TIMEOUT = 15000;
+    const LATE_MINUTES = 20;
+    // Reused to turn card html into elements
+    const parser = document.createElement("template");
+    let cursor = board.dataset.cursor;
+    let timer = null;
+    let failures = 0;
+    let busy = false;
+
+    function column(status) {
+        return board.querySelector(`.column[data-status="${status}"] .cards`);
+    }
+
+    function updateCounts() {
+        board.querySelectorAll(".column").forEach(col => {
+            col.querySelector(".count").textContent = col.querySelector(".cards").children.length;
+        });
+    }
+
+    function updateAges() {
+        const now = Date.now();
+        board.querySelectorAll(".card").forEach(card => {
+            const minutes = Math.floor((now - Date.parse(card.dataset.created)) / 60000);
+            card.querySelector(".age").textContent = minutes > 0 ? `${minutes} min` : "";
+            card.classList.toggle("late", minutes >= LATE_MINUTES);
+        });
+    }
+
+    function ring() {
+        const audio = new Audio(board.dataset.sound);
+        audio.play().catch(() => {});
+    }
+
+    function patch(orders) {
+        let rang = false;
+        for (const order of orders) {
+            const existing = document.getElementById(`order-${order.id}`);
+            if (existing) existing.remove();
+            const target = order.html && column(order.status);
+            if (!target) continue;
+            parser.innerHTML = order.html.trim();
+            const card = parser.content.firstElementChild;
+            // Oldest first: before the first card with a larger id
+            const next = Array.from(target.children).find(el => Number(el.dataset.id) > order.id);
+            target.insertBefore(card, next || null);
+            if (!existing && order.status === "pending" && !rang) {
+                ring();
+                rang = true;
+            }
+        }
+        parser.innerHTML = "";
+        updateCounts();
+        updateAges();
+    }
+
+    async function fetchJSON(url, options) {
+        const controller = new AbortController();
+        const abort = setTimeout(() => controller.abort(), REQUEST_TIMEOUT);
+        try {
+            const res = await fetch(url, { cache: "no-store", signal: controller.signal, ...options });
+            // Session expired: the login redirect is not JSON
+            if (!(res.headers.get("Content-Type") || "").includes("application/json")) {
+                location.reload();
+                return null;
+            }
+            if (!res.ok) throw new Error(res.status);
+            return await res.json();
+        } finally {
+            clearTimeout(abort);
+        }
+    }
+
+    function schedule(delay) {
+        clearTimeout(timer);
+        timer = document.hidden ? null : setTimeout(poll, delay);
+    }
+
+    async function poll() {
+        if (busy) return;
+        busy = true;
+        try {
+            const data = await fetchJSON(`${board.dataset.updates}?since=${encodeURIComponent(cursor)}`);
+            if (!data) return;
+            if (data.reload) {
+                location.reload();
+                return;
+            }
+            cursor = data.cursor;
+            if (data.orders.length) patch(data.orders);
+            failures = 0;
+            document.body.classList.remove("is-offline");
+        } catch (err) {
+            failures += 1;
+            document.body.classList.toggle("is-offline", failures > 1);
+        } finally {
+            busy = false;
+            schedule(Math.min(POLL * 2 ** failures, MAX_BACKOFF));
+        }
+    }
+
+    // Advance a ticket (admin transition endpoint, one UPDATE)
+    board.addEventListener("click", async event => {
+        const button = event.target.closest("button[data-next]");
+        if (!button) return;
+        const card = button.closest(".card");
+        button.disabled = true;
+        const body = new FormData();
+        body.append("ids", card.dataset.id);
+        body.append("status", button.dataset.next);
+        try {
+            await fetchJSON(board.dataset.transition, {
+                method: "POST",
+                body,
+                headers: { "X-CSRFToken": board.dataset.csrf },
+            });
+        } catch (err) {
+            button.disabled = false;
+        }
+        schedule(0);
+    });
+
+    // No polling in the background; catch up as soon as the board is shown
+    document.addEventListener("visibilitychange", () => schedule(0));
+
+    updateAges();
+    setInterval(updateAges, 30000);
+    schedule(POLL);
+})();
@@ -0,0 +1,32 @@
+// Swap the inline placeholder of [data-lazy-background] elements for the
+// real image when they get close to the viewport (see the lazy_background
+// template tag in restaurant/templatetags/restaurant_images.py).
+(function () {
+    function load(element) {
+        element.style.cssText += ';' + element.dataset.lazyBackground;
+        element.removeAttribute('data-lazy-background');
+    }
+
+    function init() {
+        const elements = document.querySelectorAll('[data-lazy-background]');
+        if (!('IntersectionObserver' in window)) {
+            elements.forEach(load);
+            return;
+        }
+        const observer = new IntersectionObserver(entries => {
+            entries.forEach(entry => {
+                if (entry.isIntersecting) {
+                    observer.unobserve(entry.target);
+                    load(entry.target);
+                }
+            });
+        }, {rootMargin: '200px 0px'});
+        elements.forEach(element => observer.observe(element));
+    }
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', init);
+    } else {
+        init();
+    }
+})();